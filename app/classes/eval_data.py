@@ -1,5 +1,6 @@
 from dataclasses import field
-from typing import List, Optional
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
 from apiflask.validators import OneOf
 from marshmallow import post_dump
 from marshmallow_dataclass import dataclass
@@ -14,11 +15,17 @@ class EvalData:
     pac: PAC
     dest_host: str
     src_ip: str
+    # optional overrides of the environment the PAC is evaluated in
+    dns: Optional[Dict[str, Optional[str]]] = None
+    timestamp: Optional[datetime] = None
 
-    def __init__(self, pac: PAC, dest_host: str, src_ip: str):
+    def __init__(self, pac: PAC, dest_host: str, src_ip: str,
+                 dns: Optional[Dict[str, Optional[str]]] = None, timestamp: Optional[datetime] = None):
         self.pac = pac
         self.dest_host = dest_host
         self.src_ip = src_ip
+        self.dns = dns
+        self.timestamp = timestamp
 
     def simple(self) -> dict:
         return {
@@ -27,6 +34,27 @@ class EvalData:
             "dest_host": self.dest_host,
         }
 
+    def engine_case(self) -> dict:
+        """The fields of the engine payload, that describe this single case."""
+        case = {
+            "src_ip": self.src_ip,
+            "dest_host": self.dest_host,
+        }
+        if self.dns is not None:
+            case["dns"] = self.dns
+        if self.timestamp is not None:
+            case["clock"] = self.clock()
+        return case
+
+    def clock(self) -> dict:
+        """The timestamp as unix time in milliseconds, and the offset of its timezone in minutes.
+        The offset is used as local time by the engines, timestamps without timezone are treated as UTC."""
+        timestamp = self.timestamp if self.timestamp.tzinfo else self.timestamp.replace(tzinfo=timezone.utc)
+        return {
+            "timestamp": int(timestamp.timestamp() * 1000),
+            "utc_offset": int(timestamp.utcoffset().total_seconds() // 60),
+        }
+
     def engine_payload(self) -> dict:
         return {
             "pac": {
@@ -34,23 +62,61 @@ class EvalData:
                 "url": f"http://127.0.0.1:8080/pac/{self.pac.uid}",
                 "content": self.pac.content,
             },
-            "src_ip": self.src_ip,
-            "dest_host": self.dest_host,
+            **self.engine_case(),
+        }
+
+    @post_dump
+    def remove_skip_values(self, data, **kwargs):
+        # only include the overrides, if they were provided
+        return {
+            key: value for key, value in data.items()
+            if key not in ["dns", "timestamp"] or value is not None
+        }
+
+
+class EvalBatchData:
+    """Object to hold all the data required for evaluating multiple cases against a single pac"""
+    pac: PAC
+    cases: List[EvalData]
+
+    def __init__(self, pac: PAC, cases: List[EvalData]):
+        self.pac = pac
+        self.cases = cases
+
+    def engine_payload(self, cases: Optional[List[EvalData]] = None) -> dict:
+        """Build the payload for the engines, optionally only for a subset of the cases."""
+        return {
+            "pac": {
+                "uid": self.pac.uid,
+                "url": f"http://127.0.0.1:8080/pac/{self.pac.uid}",
+                "content": self.pac.content,
+            },
+            "cases": [
+                case.engine_case()
+                for case
+                in (self.cases if cases is None else cases)
+            ],
         }
 
+
 @dataclass
 class EngineResult:
     """Object to hold the results of a single pac engine evaluation"""
     engine: str
     status: str = field(metadata={
         "required": True,
-        "validate": OneOf(["success", "failed"]),
+        "validate": OneOf(["success", "failed", "timed_out", "unavailable"]),
     })
     flags: List[str] = field(default_factory=list)
     error_code: Optional[int] = None
     error: Optional[str] = field(default="")
     message: Optional[str] = field(default="")
     proxy: Optional[str] = field(default="")
+    cached: bool = field(default=False)
+    # milliseconds until the engine replied, and the evaluation time the engine reported itself
+    # only used to build the EvalTimings, so they are not part of the exported json
+    network_time: Optional[float] = field(default=None, metadata={"load_only": True})
+    compute_time: Optional[float] = field(default=None, metadata={"load_only": True})
 
     @post_dump
     def remove_skip_values(self, data, **kwargs):
@@ -61,16 +127,132 @@ class EngineResult:
         }
 
 
+@dataclass
+class EngineTimings:
+    """Milliseconds spent on a single engine"""
+    # until the engine replied, including the evaluation itself
+    network: float
+    # evaluation time reported by the engine, if it reports it
+    compute: Optional[float] = None
+
+    @post_dump
+    def remove_skip_values(self, data, **kwargs):
+        return {key: value for key, value in data.items() if value is not None}
+
+
+@dataclass
+class EvalTimings:
+    """Milliseconds spent in every phase of an evaluation request"""
+    # parsing and validating the input
+    validation: float
+    # adding the PAC to, or getting it from the PAC-Store
+    storage: float
+    # waiting for the engines
+    dispatch: float
+    total: float
+    # engines that were called, engines with a cached result are left out
+    engines: Dict[str, EngineTimings] = field(default_factory=dict)
+
+    @staticmethod
+    def from_phases(phases: Dict[str, float], total: float, results: List[EngineResult]) -> "EvalTimings":
+        """Build the timings from the phase durations (in seconds) and the engine results."""
+        return EvalTimings(
+            validation=round(phases.get("validation", 0) * 1000, 3),
+            storage=round(phases.get("storage", 0) * 1000, 3),
+            dispatch=round(phases.get("dispatch", 0) * 1000, 3),
+            total=round(total * 1000, 3),
+            engines={
+                result.engine: EngineTimings(network=result.network_time, compute=result.compute_time)
+                for result in results
+                if result.network_time is not None
+            },
+        )
+
+    def server_timing(self) -> str:
+        """Format the timings as value of a Server-Timing header."""
+        metrics = [
+            f"validation;dur={self.validation}",
+            f"storage;dur={self.storage}",
+            f"dispatch;dur={self.dispatch}",
+        ]
+        for name, engine in self.engines.items():
+            metrics.append(f'engine-{name};dur={engine.network};desc="{name} network"')
+            if engine.compute is not None:
+                metrics.append(f'engine-{name}-compute;dur={engine.compute};desc="{name} compute"')
+        metrics.append(f"total;dur={self.total}")
+        return ", ".join(metrics)
+
+
 @dataclass
 class EvalResponse:
     """Object to hold bundled results of pac evaluation requests, which gets returned to the client"""
     request: EvalData
     status: str = field(default="success")
     results: List[EngineResult] = field(default_factory=list)
+    # only included if requested via ?timings=1
+    timings: Optional[EvalTimings] = field(default=None)
 
     def __init__(self, eval_data: EvalData):
         self.request = eval_data
         self.results = []
+        self.timings = None
+
+    def register_engine(self, er: EngineResult):
+        self.results.append(er)
+
+    @post_dump
+    def remove_skip_values(self, data, **kwargs):
+        if data.get("timings") is None:
+            data.pop("timings", None)
+        return data
+
+
+@dataclass
+class EvalCase:
+    """The fields of a single case of a batch, without the PAC shared by all cases"""
+    dest_host: str
+    src_ip: str
+    dns: Optional[Dict[str, Optional[str]]] = None
+    timestamp: Optional[datetime] = None
+
+    @post_dump
+    def remove_skip_values(self, data, **kwargs):
+        # only include the overrides, if they were provided
+        return {
+            key: value for key, value in data.items()
+            if key not in ["dns", "timestamp"] or value is not None
+        }
+
+
+@dataclass
+class EvalCaseResponse:
+    """Object to hold the results of a single case of a batch evaluation"""
+    request: EvalCase
+    status: str = field(default="success")
+    results: List[EngineResult] = field(default_factory=list)
+
+    def __init__(self, eval_data: EvalData):
+        self.request = EvalCase(
+            dest_host=eval_data.dest_host,
+            src_ip=eval_data.src_ip,
+            dns=eval_data.dns,
+            timestamp=eval_data.timestamp,
+        )
+        self.status = "success"
+        self.results = []
 
     def register_engine(self, er: EngineResult):
         self.results.append(er)
+
+
+@dataclass
+class EvalBatchResponse:
+    """Object to hold the bundled results of a batch evaluation, the PAC is only included once for all cases"""
+    pac: PAC
+    status: str = field(default="success")
+    results: List[EvalCaseResponse] = field(default_factory=list)
+
+    def __init__(self, batch_data: EvalBatchData):
+        self.pac = batch_data.pac
+        self.status = "success"
+        self.results = [EvalCaseResponse(case) for case in batch_data.cases]
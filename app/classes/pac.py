@@ -1,3 +1,4 @@
+import hashlib
 import time
 import uuid
 from dataclasses import field
@@ -18,10 +19,16 @@ class PAC:
     added_time: float = field(metadata={"description": "Timestamp when the PAC was added"})
     content: str = field(metadata={"description": "Unique identifier for the PAC"})
 
-    def __init__(self, uid: str, content: str, added_time: float):
+    def __init__(self, uid: str, content: str, added_time: float, content_hash: str = None):
         self.uid = uid
         self.content = content
         self.added_time = added_time
+        # not part of the schema, only used to identify PACs with identical content
+        self.content_hash = content_hash if content_hash else PAC.hash_content(content)
+
+    @staticmethod
+    def hash_content(content: str) -> str:
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
 
     @staticmethod
     def new_pac(content):
@@ -0,0 +1,91 @@
+"""This File contains the app-wide Thread-Pool used to send requests to the engines.
+The Pool is created once at startup, and is shared by all requests.
+To apply backpressure, the number of tasks waiting for a free worker is limited.
+If a request would exceed that limit, it is rejected with a 503 instead of piling up."""
+
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Iterable
+from apiflask import APIFlask
+from apiflask.exceptions import HTTPError
+
+# imports from other parts of this app
+from engine_registry import get_engines
+from metrics import engine_pool_rejected
+
+
+class EnginePoolFullError(HTTPError):
+    """Raised when the engine pool can't accept any more tasks."""
+    status_code = 503
+    message = "Too many requests to the engines, try again later"
+    headers = {"Retry-After": "1"}
+
+
+class EnginePool:
+    """Thread-Pool with a bounded queue, which also keeps track of its queue depth."""
+
+    def __init__(self, workers: int, max_queue: int):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="engine")
+        self.lock = threading.Lock()
+        # tasks currently being processed by a worker
+        self.active = 0
+        # tasks waiting for a free worker
+        self.queued = 0
+
+    def submit_all(self, fn: Callable, args_list: Iterable[tuple]) -> list[Future]:
+        """Submit one task per entry in args_list.
+        Either all tasks are accepted, or none of them is and an EnginePoolFullError is raised."""
+        args_list = list(args_list)
+        with self.lock:
+            if self.active + self.queued + len(args_list) > self.workers + self.max_queue:
+                engine_pool_rejected.inc()
+                raise EnginePoolFullError()
+            self.queued += len(args_list)
+        return [self.executor.submit(self._run, fn, args) for args in args_list]
+
+    def _run(self, fn: Callable, args: tuple):
+        with self.lock:
+            self.queued -= 1
+            self.active += 1
+        try:
+            return fn(*args)
+        finally:
+            with self.lock:
+                self.active -= 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "active": self.active,
+                "queued": self.queued,
+            }
+
+
+engine_pool: EnginePool = None
+def init_engine_pool(app: APIFlask):
+    """Create the pool, requires the engine registry to be initialized.
+    Every request submits a task per engine at once, so the pool has to fit at least one task per engine,
+    otherwise every request would be rejected with a 503."""
+    global engine_pool
+    engine_pool = EnginePool(
+        workers=int(app.config.get('ENGINE_WORKERS', 32)),
+        max_queue=int(app.config.get('ENGINE_QUEUE_SIZE', 128)),
+    )
+    engine_count = len(get_engines())
+    if engine_pool.workers + engine_pool.max_queue < engine_count:
+        raise ValueError(
+            f"APP_ENGINE_WORKERS ({engine_pool.workers}) + APP_ENGINE_QUEUE_SIZE ({engine_pool.max_queue}) "
+            f"must be at least the number of engines ({engine_count}), otherwise no request can be admitted"
+        )
+
+
+def submit_all(fn: Callable, args_list: Iterable[tuple]) -> list[Future]:
+    return engine_pool.submit_all(fn, args_list)
+
+
+def pool_stats() -> dict:
+    return engine_pool.stats()
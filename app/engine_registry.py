@@ -0,0 +1,279 @@
+"""This File contains the Registry of all known "pac-engines".
+The Engines are loaded from a config file (ENGINES_CONFIG) or the ENGINES config, and default to the packaged engines.
+Every engine can have multiple instances, requests are balanced to the instance with the least outstanding requests.
+A background thread polls the "/up" Endpoint of every instance, to keep track of its health.
+Every instance has a circuit breaker, which opens after repeated failures, so requests skip down instances immediately."""
+
+import itertools
+import json
+import threading
+import time
+from typing import Optional
+from urllib.parse import urlparse
+from apiflask import APIFlask
+from requests.adapters import HTTPAdapter
+import requests
+
+# Flags available for Engines
+FLAG_EVALUATION = "evaluation"
+FLAG_VALIDATION = "validation"
+FLAG_SRC_IP = "src_ip"
+# the engine supports the dns and timestamp overrides of an evaluation
+FLAG_DNS = "dns"
+FLAG_CLOCK = "clock"
+
+# Engines used if no config is provided
+DEFAULT_ENGINES = [
+    # for some reason using localhost adds nearly 2 seconds to the request time...
+    # so make sure to stick with 127.0.0.1...
+    # https://stackoverflow.com/a/50565643
+    {"name": "v8", "url": "http://127.0.0.1:8081/", "flags": [FLAG_EVALUATION, FLAG_SRC_IP, FLAG_DNS, FLAG_CLOCK]},
+    {"name": "winhttp", "url": "http://127.0.0.1:8082/", "flags": [FLAG_EVALUATION]},
+    {"name": "eslint", "url": "http://127.0.0.1:8083/", "flags": [FLAG_VALIDATION]},
+]
+
+# Additional instances of an engine listen on the port of the first instance plus a multiple of this step
+# e.g. the 2nd v8 instance listens on 8181, the 3rd on 8281
+# keep in sync with the start.sh of the engines
+INSTANCE_PORT_STEP = 100
+
+# Health states of an engine instance
+HEALTH_UNKNOWN = "unknown"
+HEALTH_UP = "up"
+HEALTH_DOWN = "down"
+
+
+class CircuitBreaker:
+    """Circuit breaker for a single engine instance.
+    - closed: requests are sent to the instance
+    - open: the instance failed too often, requests are skipped until reset_timeout passed
+    - half_open: a single trial request is sent, which decides if the circuit closes or opens again"""
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CircuitBreaker.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.lock = threading.Lock()
+
+    def allow_request(self) -> bool:
+        with self.lock:
+            if self.state == CircuitBreaker.CLOSED:
+                return True
+            if self.state == CircuitBreaker.OPEN and time.monotonic() >= self.opened_at + self.reset_timeout:
+                # let a single trial request through
+                self.state = CircuitBreaker.HALF_OPEN
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.state = CircuitBreaker.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == CircuitBreaker.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = CircuitBreaker.OPEN
+                self.opened_at = time.monotonic()
+
+
+class EngineInstance:
+    """A single running instance of an engine, including the state required to send requests to it."""
+
+    def __init__(self, url: str, pool_size: int, breaker: CircuitBreaker):
+        self.url = url
+        self.breaker = breaker
+        self.health = HEALTH_UNKNOWN
+        self.last_check: Optional[float] = None
+        # number of requests currently sent to this instance
+        self.outstanding = 0
+        self.lock = threading.Lock()
+
+        # a long-lived session per instance keeps connections to the instance alive between requests
+        self.session = requests.Session()
+        self.session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+        self.session.headers.update({"Content-Type": "application/json"})
+
+    def acquire(self):
+        with self.lock:
+            self.outstanding += 1
+
+    def release(self):
+        with self.lock:
+            self.outstanding -= 1
+
+    def check_health(self, timeout: float):
+        """Call the "/up" Endpoint of the instance, and feed the result into the circuit breaker."""
+        try:
+            res = self.session.get(self.url + "up", timeout=(timeout, timeout))
+            healthy = res.status_code == 200
+        except requests.exceptions.RequestException:
+            healthy = False
+
+        self.health = HEALTH_UP if healthy else HEALTH_DOWN
+        self.last_check = time.time()
+        if healthy:
+            self.breaker.record_success()
+        else:
+            self.breaker.record_failure()
+
+    def status(self) -> dict:
+        return {
+            "url": self.url,
+            "health": self.health,
+            "circuit": self.breaker.state,
+            "failures": self.breaker.failures,
+            "outstanding": self.outstanding,
+            "last_check": self.last_check,
+        }
+
+
+class Engine:
+    """A single "pac-engine", including the settings required to send requests to it and all its instances."""
+
+    def __init__(self, name: str, instances: list[EngineInstance], flags: list[str], cache_ttl: float,
+                 connect_timeout: float, read_timeout: float, retries: int):
+        self.name = name
+        self.instances = instances
+        self.flags = flags
+        self.cache_ttl = cache_ttl
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        # how often a failed request is retried on another instance
+        self.retries = retries
+        # used to rotate between instances with the same number of outstanding requests
+        self.rotation = itertools.count()
+
+    def pick_instance(self, exclude: list[EngineInstance]) -> Optional[EngineInstance]:
+        """Pick the instance with the least outstanding requests, skipping instances with an open circuit breaker.
+        Returns None if no instance is available."""
+        offset = next(self.rotation) % len(self.instances)
+        rotated = self.instances[offset:] + self.instances[:offset]
+        # sorting is stable, so instances with the same number of outstanding requests are picked round-robin
+        candidates = sorted(
+            (instance for instance in rotated if instance not in exclude),
+            key=lambda instance: instance.outstanding,
+        )
+        for instance in candidates:
+            if instance.breaker.allow_request():
+                return instance
+        return None
+
+    def check_health(self):
+        for instance in self.instances:
+            instance.check_health(self.connect_timeout)
+
+    def health(self) -> str:
+        # the engine is up as long as a single instance is up
+        health = [instance.health for instance in self.instances]
+        if HEALTH_UP in health:
+            return HEALTH_UP
+        if all(h == HEALTH_UNKNOWN for h in health):
+            return HEALTH_UNKNOWN
+        return HEALTH_DOWN
+
+    def status(self) -> dict:
+        return {
+            "name": self.name,
+            "flags": self.flags,
+            "health": self.health(),
+            "instances": [instance.status() for instance in self.instances],
+        }
+
+
+class EngineRegistry:
+    """Holds all known engines, and polls their health in the background."""
+
+    def __init__(self, engines: list[Engine], health_interval: float):
+        self.engines = engines
+        self.health_interval = health_interval
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self):
+        # an interval of 0 disables the health checks
+        if self.health_interval <= 0:
+            return
+        self.thread = threading.Thread(target=self._poll, name="engine-health", daemon=True)
+        self.thread.start()
+
+    def _poll(self):
+        while True:
+            for engine in self.engines:
+                engine.check_health()
+            time.sleep(self.health_interval)
+
+
+def engine_config(app: APIFlask, engine_name: str, key: str, default):
+    """Get a config value, that can be overwritten per engine by appending the engine name.
+    E.g. ENGINE_READ_TIMEOUT_WINHTTP takes precedence over ENGINE_READ_TIMEOUT."""
+    return app.config.get(f'{key}_{engine_name.upper()}', app.config.get(key, default))
+
+
+def load_engine_definitions(app: APIFlask) -> list[dict]:
+    """Load the list of engines, either from a json file or directly from the config."""
+    config_file = app.config.get('ENGINES_CONFIG')
+    if config_file:
+        with open(config_file, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return app.config.get('ENGINES', DEFAULT_ENGINES)
+
+
+def instance_urls(app: APIFlask, definition: dict) -> list[str]:
+    """Get the urls of all instances of an engine.
+    Either they are listed in the definition, or they are derived from the url of the first instance
+    and the number of instances, which is configured via ENGINE_INSTANCES."""
+    if "urls" in definition:
+        urls = definition["urls"]
+    else:
+        count = int(definition.get("instances", engine_config(app, definition["name"], 'ENGINE_INSTANCES', 1)))
+        parsed = urlparse(definition["url"])
+        urls = [
+            parsed._replace(netloc=f"{parsed.hostname}:{parsed.port + i * INSTANCE_PORT_STEP}").geturl()
+            for i in range(count)
+        ] if parsed.port else [definition["url"]]
+    return [url if url.endswith("/") else url + "/" for url in urls]
+
+
+def build_engine(app: APIFlask, definition: dict) -> Engine:
+    """Build an engine from its definition. Settings missing in the definition are taken from the app config."""
+    name = definition["name"]
+    pool_size = int(definition.get("pool_size", engine_config(app, name, 'ENGINE_POOL_SIZE', 10)))
+    instances = [
+        EngineInstance(
+            url=url,
+            pool_size=pool_size,
+            breaker=CircuitBreaker(
+                failure_threshold=int(engine_config(app, name, 'ENGINE_FAILURE_THRESHOLD', 3)),
+                reset_timeout=float(engine_config(app, name, 'ENGINE_RESET_TIMEOUT', 30)),
+            ),
+        )
+        for url
+        in instance_urls(app, definition)
+    ]
+    return Engine(
+        name=name,
+        instances=instances,
+        flags=definition.get("flags", []),
+        cache_ttl=float(definition.get("cache_ttl", engine_config(app, name, 'RESULT_CACHE_TTL', 3600))),
+        connect_timeout=float(definition.get("connect_timeout", engine_config(app, name, 'ENGINE_CONNECT_TIMEOUT', 1))),
+        read_timeout=float(definition.get("read_timeout", engine_config(app, name, 'ENGINE_READ_TIMEOUT', 5))),
+        retries=int(definition.get("retries", engine_config(app, name, 'ENGINE_RETRIES', 1))),
+    )
+
+
+engine_registry: EngineRegistry = None
+def init_engine_registry(app: APIFlask):
+    global engine_registry
+    engines = [build_engine(app, definition) for definition in load_engine_definitions(app)]
+    engine_registry = EngineRegistry(engines, float(app.config.get('ENGINE_HEALTH_INTERVAL', 5)))
+    engine_registry.start()
+
+
+def get_engines() -> list[Engine]:
+    return engine_registry.engines
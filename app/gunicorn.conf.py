@@ -0,0 +1,48 @@
+"""Config to serve the core server with multiple worker processes, using gunicorn:
+    gunicorn -c gunicorn.conf.py server:app
+Every worker process runs its own copy of the app, so PACs have to be kept in a store shared by all workers."""
+
+import multiprocessing
+import os
+import tempfile
+
+bind = "0.0.0.0:8080"
+
+# number of worker processes, defaults to the number of CPU cores
+workers = int(os.environ.get('APP_SERVER_WORKERS', multiprocessing.cpu_count()))
+# requests mostly wait for the engines, so every worker handles multiple requests at once using threads
+worker_class = "gthread"
+threads = int(os.environ.get('APP_SERVER_THREADS', 8))
+
+# the memory and disk store are per process, so multiple workers require the sqlite store
+if workers > 1:
+    store_backend = os.environ.setdefault('APP_STORE_BACKEND', 'sqlite').lower()
+    if store_backend != 'sqlite':
+        raise ValueError(f"Store backend '{store_backend}' can't be shared by {workers} worker processes, use 'sqlite'")
+
+    # every worker keeps its own metrics, so they are merged via files in a shared directory, see metrics.py
+    # the files are removed on start, so the counters start at 0 again
+    metrics_dir = os.environ.setdefault('APP_METRICS_DIR', os.path.join(tempfile.gettempdir(), f'pac-metrics-{os.getpid()}'))
+
+
+def remove_metrics_files():
+    """Remove the metrics files of the workers (see metrics.py), but nothing else in APP_METRICS_DIR."""
+    metrics_dir = os.environ.get('APP_METRICS_DIR')
+    if not metrics_dir or not os.path.isdir(metrics_dir):
+        return
+    for name in os.listdir(metrics_dir):
+        if name.endswith(('.json', '.json.tmp')):
+            os.remove(os.path.join(metrics_dir, name))
+
+
+def on_starting(server):
+    remove_metrics_files()
+
+
+def on_exit(server):
+    remove_metrics_files()
+    try:
+        os.rmdir(os.environ['APP_METRICS_DIR'])
+    except (KeyError, OSError):
+        # not set, or not empty
+        pass
@@ -0,0 +1,368 @@
+"""This File contains the metrics of the core server, which are exported in the Prometheus text format via GET /metrics.
+Counters and histograms are updated on the hot path of every request, so they don't take a lock:
+every thread writes to its own shard of a metric, and the shards are only summed up when the metrics are scraped.
+Gauges are read from the rest of the app when the metrics are scraped, so they cost nothing on the hot path.
+With multiple worker processes (APP_METRICS_DIR, see init_metrics), every process writes its metrics into its own file
+in a shared directory, and a scrape merges the files of all processes, so it doesn't matter which worker handles it."""
+
+import bisect
+import json
+import os
+import threading
+import time
+from typing import Callable, Iterable, Iterator, Optional
+from apiflask import APIFlask
+from flask import Response, g, request
+
+# default buckets for latencies (in seconds), same as the official Prometheus clients
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# all metrics, in the order they are exported
+registry: list = []
+
+
+def escape_label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(label_names: tuple, labels: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{escape_label_value(value)}"' for name, value in zip(label_names, labels)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class ShardedMetric:
+    """Base for metrics updated on the hot path, their values only ever increase.
+    Every thread gets its own shard, mapping the label values to a list of numbers only that thread writes to.
+    Shards of threads that ended are folded into a single retired shard, so short-lived threads don't leak memory."""
+    metric_type = ""
+    # the values of processes that exited are still part of the totals
+    cumulative = True
+
+    def __init__(self, name: str, help: str, label_names: tuple = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.local = threading.local()
+        # (thread, shard) of all live threads
+        self.shards: list[tuple[threading.Thread, dict[tuple, list]]] = []
+        self.retired: dict[tuple, list] = {}
+        # only taken when a thread creates its shard, and when the metric is scraped
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def new_values(self) -> list:
+        raise NotImplementedError()
+
+    def _shard(self) -> dict[tuple, list]:
+        try:
+            return self.local.shard
+        except AttributeError:
+            shard = {}
+            with self.lock:
+                self._retire_dead_shards()
+                self.shards.append((threading.current_thread(), shard))
+            self.local.shard = shard
+            return shard
+
+    def _values(self, labels: tuple) -> list:
+        shard = self._shard()
+        values = shard.get(labels)
+        if values is None:
+            values = shard[labels] = self.new_values()
+        return values
+
+    def _retire_dead_shards(self):
+        for thread, shard in self.shards:
+            if not thread.is_alive():
+                self._merge(self.retired, shard)
+        self.shards = [(thread, shard) for thread, shard in self.shards if thread.is_alive()]
+
+    def _merge(self, target: dict[tuple, list], shard: dict[tuple, list]):
+        # copying is atomic, so a thread adding new labels to its shard meanwhile doesn't break the iteration
+        for labels, values in shard.copy().items():
+            merged = target.setdefault(labels, self.new_values())
+            for i, value in enumerate(values):
+                merged[i] += value
+
+    def collect(self) -> dict[tuple, list]:
+        """Sum up all shards. Values written meanwhile might be missing, but are included in the next scrape."""
+        with self.lock:
+            self._retire_dead_shards()
+            total: dict[tuple, list] = {}
+            self._merge(total, self.retired)
+            for _, shard in self.shards:
+                self._merge(total, shard)
+        return total
+
+    def merge_values(self, merged: list, values: list):
+        """Add the values of another process."""
+        for i, value in enumerate(values):
+            merged[i] += value
+
+    def render(self, samples: dict[tuple, list]) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.metric_type}"]
+        for labels, values in sorted(samples.items()):
+            lines.extend(self.render_values(labels, values))
+        return lines
+
+    def render_values(self, labels: tuple, values: list) -> list[str]:
+        raise NotImplementedError()
+
+
+class Counter(ShardedMetric):
+    """Monotonically increasing value, e.g. the number of failed requests."""
+    metric_type = "counter"
+
+    def new_values(self) -> list:
+        return [0]
+
+    def inc(self, *labels: str, amount: float = 1):
+        self._values(labels)[0] += amount
+
+    def render_values(self, labels: tuple, values: list) -> list[str]:
+        return [f"{self.name}{format_labels(self.label_names, labels)} {format_value(values[0])}"]
+
+
+class Histogram(ShardedMetric):
+    """Distribution of observed values, e.g. latencies, counted into buckets."""
+    metric_type = "histogram"
+
+    def __init__(self, name: str, help: str, label_names: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, help, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def new_values(self) -> list:
+        # one count per bucket, one for +Inf, and the sum of all observed values
+        return [0] * (len(self.buckets) + 1) + [0.0]
+
+    def observe(self, value: float, *labels: str):
+        values = self._values(labels)
+        # buckets are upper bounds including the value itself
+        values[bisect.bisect_left(self.buckets, value)] += 1
+        values[-1] += value
+
+    def render_values(self, labels: tuple, values: list) -> list[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), values):
+            cumulative += count
+            le = f'le="{format_value(bound)}"'
+            lines.append(f"{self.name}_bucket{format_labels(self.label_names, labels, le)} {cumulative}")
+        lines.append(f"{self.name}_sum{format_labels(self.label_names, labels)} {format_value(values[-1])}")
+        lines.append(f"{self.name}_count{format_labels(self.label_names, labels)} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """Value read from the app when the metrics are scraped, e.g. the size of the PAC-Store.
+    The function returns a dict of label values -> value, or a single value if the gauge has no labels.
+    Use metric_type "counter" for values that only ever increase, but are tracked elsewhere in the app.
+    aggregate is how the values of multiple worker processes are merged: "sum" or "max",
+    e.g. "max" for state shared by all processes, which every process reports on its own."""
+
+    def __init__(self, name: str, help: str, fn: Callable, label_names: tuple = (), metric_type: str = "gauge",
+                 aggregate: str = "sum"):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.label_names = tuple(label_names)
+        self.metric_type = metric_type
+        self.aggregate = aggregate
+        # gauges of processes that exited are left out, counters are still part of the totals
+        self.cumulative = metric_type == "counter"
+        registry.append(self)
+
+    def collect(self) -> dict[tuple, list]:
+        values = self.fn()
+        if not isinstance(values, dict):
+            values = {(): values}
+        return {labels: [value] for labels, value in values.items()}
+
+    def merge_values(self, merged: list, values: list):
+        merged[0] = max(merged[0], values[0]) if self.aggregate == "max" else merged[0] + values[0]
+
+    def render(self, samples: dict[tuple, list]) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.metric_type}"]
+        for labels, values in sorted(samples.items()):
+            lines.append(f"{self.name}{format_labels(self.label_names, labels)} {format_value(values[0])}")
+        return lines
+
+
+# directory shared by all worker processes, every process writes its metrics into its own file, see init_metrics
+# None if the process exports only its own metrics
+metrics_dir: Optional[str] = None
+# file of this process, the start time is part of the name, so a new process reusing the pid doesn't overwrite it
+metrics_file: Optional[str] = None
+# lock, so a scrape and the background thread don't write the file at the same time
+metrics_file_lock = threading.Lock()
+
+
+def write_metrics_file():
+    """Write the current values of all metrics of this process into its file, replaced atomically,
+    so other processes never read a partially written file."""
+    data = {metric.name: [[list(labels), values] for labels, values in metric.collect().items()] for metric in registry}
+    with metrics_file_lock:
+        tmp_file = metrics_file + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_file, metrics_file)
+
+
+def process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # the process exists, but belongs to another user
+        pass
+    return True
+
+
+def read_metrics_files() -> dict[str, dict[tuple, list]]:
+    """Merge the metrics of all processes, the metric name -> label values -> values."""
+    metrics = {metric.name: metric for metric in registry}
+    samples = {metric.name: {} for metric in registry}
+    files = [name for name in os.listdir(metrics_dir) if name.endswith(".json")]
+    # only the newest file of a pid belongs to a live process, the others were written by processes that exited
+    newest = {}
+    for name in files:
+        pid, started = (int(part) for part in name[:-len(".json")].split("_"))
+        newest[pid] = max(newest.get(pid, started), started)
+    for name in files:
+        pid, started = (int(part) for part in name[:-len(".json")].split("_"))
+        alive = newest[pid] == started and process_alive(pid)
+        try:
+            with open(os.path.join(metrics_dir, name)) as f:
+                data = json.load(f)
+        except OSError:
+            continue
+        for metric_name, metric_samples in data.items():
+            metric = metrics.get(metric_name)
+            if metric is None or not (alive or metric.cumulative):
+                continue
+            for labels, values in metric_samples:
+                merged = samples[metric_name].get(tuple(labels))
+                if merged is None:
+                    samples[metric_name][tuple(labels)] = values
+                else:
+                    metric.merge_values(merged, values)
+    return samples
+
+
+def render_metrics() -> str:
+    if metrics_dir is None:
+        samples = {metric.name: metric.collect() for metric in registry}
+    else:
+        # the file of this process is written first, so the scrape includes everything this process counted so far
+        write_metrics_file()
+        samples = read_metrics_files()
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render(samples[metric.name]))
+    return "\n".join(lines) + "\n"
+
+
+# metrics of the hot path, the gauges are registered together with the /metrics route
+http_request_duration = Histogram(
+    "pac_http_request_duration_seconds",
+    "Time until a route returned its response, or until its stream ended",
+    ("method", "route", "status"),
+)
+engine_request_duration = Histogram(
+    "pac_engine_request_duration_seconds",
+    "Duration of a single request to an engine instance",
+    ("engine", "endpoint"),
+)
+engine_requests = Counter(
+    "pac_engine_requests_total",
+    "Requests to engine instances by outcome: success, error (engine replied with an error), timeout or connection_error",
+    ("engine", "outcome"),
+)
+engine_deadline_exceeded = Counter(
+    "pac_engine_deadline_exceeded_total",
+    "Engines that did not reply before the deadline of the request",
+    ("engine",),
+)
+engine_unavailable = Counter(
+    "pac_engine_unavailable_total",
+    "Requests skipped because no instance of the engine was available",
+    ("engine",),
+)
+result_cache_lookups = Counter(
+    "pac_result_cache_lookups_total",
+    "Lookups in the result cache by result: hit or miss",
+    ("engine", "result"),
+)
+engine_pool_rejected = Counter(
+    "pac_engine_pool_rejected_total",
+    "Requests rejected with a 503, because the engine pool was full",
+)
+
+
+def write_metrics_periodically(interval: float):
+    while True:
+        time.sleep(interval)
+        try:
+            write_metrics_file()
+        except Exception as e:
+            print(f"Failed to write the metrics to {metrics_file}: {e}")
+
+
+def init_metrics(app: APIFlask):
+    """Measure the latency of every request.
+    If APP_METRICS_DIR is set (by gunicorn.conf.py if there are multiple workers), the metrics of this process are
+    written into that directory every APP_METRICS_WRITE_INTERVAL seconds, and merged with the other processes on scrape."""
+    global metrics_dir, metrics_file
+    metrics_dir = app.config.get('METRICS_DIR') or None
+    if metrics_dir is not None:
+        os.makedirs(metrics_dir, exist_ok=True)
+        metrics_file = os.path.join(metrics_dir, f"{os.getpid()}_{time.time_ns()}.json")
+        write_metrics_file()
+        interval = float(app.config.get('METRICS_WRITE_INTERVAL', 1))
+        threading.Thread(target=write_metrics_periodically, args=(interval,), daemon=True, name="metrics-writer").start()
+
+    @app.before_request
+    def start_timer():
+        # also used for the timings of the eval routes
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def observe_duration(response: Response) -> Response:
+        start: Optional[float] = g.get("request_start")
+        if start is not None:
+            # use the rule instead of the path, so every uid doesn't end up in its own label
+            route = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+            if response.is_streamed:
+                # the route only returned the generator, the stream is done once it is exhausted
+                response.response = observe_stream(response.response, start, request.method, route, str(response.status_code))
+            else:
+                http_request_duration.observe(time.perf_counter() - start, request.method, route, str(response.status_code))
+        return response
+
+
+def observe_stream(stream: Iterable, start: float, method: str, route: str, status: str) -> Iterator:
+    """Pass the stream through, and observe the duration once it ended.
+    The status code was sent before the stream started, so a stream that failed midway is recorded as 500."""
+    try:
+        yield from stream
+    except Exception:
+        status = "500"
+        raise
+    finally:
+        # also when the client disconnected, and the server closed the stream early
+        if hasattr(stream, "close"):
+            stream.close()
+        http_request_duration.observe(time.perf_counter() - start, method, route, status)
@@ -1,87 +1,305 @@
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import collections
+import json
+import time
+from concurrent.futures import Future, as_completed, TimeoutError as FutureTimeoutError
+from dataclasses import replace
+from typing import Any, Iterator, List, Optional, Union
+from apiflask import APIFlask
 import requests
 
 # imports from other parts of this app
-from classes.eval_data import EvalData, EvalResponse, EngineResult
+from classes.eval_data import EvalData, EvalResponse, EngineResult, EvalBatchData, EvalBatchResponse
+from engine_pool import submit_all
+from engine_registry import Engine, EngineInstance, get_engines, FLAG_EVALUATION, FLAG_SRC_IP, FLAG_DNS, FLAG_CLOCK
+from metrics import engine_deadline_exceeded, engine_request_duration, engine_requests, engine_unavailable, result_cache_lookups
+from storage.result_cache import ResultCache
 
-# Flags available for Engines
-FLAG_EVALUATION = "evaluation"
-FLAG_VALIDATION = "validation"
-FLAG_SRC_IP = "src_ip"
+# batch requests get some extra read timeout (in seconds) for every case they include
+ENGINE_BATCH_TIMEOUT_PER_CASE = 0.5
 
-# List of known "pac-engines"
-engines = [
-    # for some reason using localhost adds nearly 2 seconds to the request time...
-    # so make sure to stick with 127.0.0.1...
-    # https://stackoverflow.com/a/50565643
-    {"name": "v8", "url": "http://127.0.0.1:8081/", "flags": [FLAG_EVALUATION, FLAG_SRC_IP]},
-    {"name": "winhttp", "url": "http://127.0.0.1:8082/", "flags": [FLAG_EVALUATION]},
-    {"name": "eslint", "url": "http://127.0.0.1:8083/", "flags": [FLAG_VALIDATION]},
-]
+
+result_cache: ResultCache = None
+# seconds to wait for the engines, before replying with the results available so far
+eval_deadline: float = 10
+def init_engines(app: APIFlask):
+    global result_cache, eval_deadline
+    # cache for engine results, a size of 0 disables the cache
+    result_cache = ResultCache(int(app.config.get('RESULT_CACHE_SIZE', 10000)))
+    eval_deadline = float(app.config.get('EVAL_DEADLINE', 10))
+
+
+def result_cache_stats() -> dict:
+    return {
+        "size": len(result_cache),
+        "max_size": result_cache.max_size,
+        "evictions": result_cache.evictions,
+    }
+
+
+def cache_key(engine: Engine, content_hash: str, data: EvalData) -> tuple:
+    """Build the key for the result cache.
+    Inputs an engine does not support can't change its result, so they are left out of the key."""
+    return (
+        content_hash,
+        data.dest_host if FLAG_EVALUATION in engine.flags else None,
+        data.src_ip if FLAG_SRC_IP in engine.flags else None,
+        tuple(sorted(data.dns.items())) if data.dns is not None and FLAG_DNS in engine.flags else None,
+        data.timestamp.isoformat() if data.timestamp is not None and FLAG_CLOCK in engine.flags else None,
+        engine.name,
+    )
+
+
+def get_cached_result(key: tuple) -> Optional[EngineResult]:
+    cached = result_cache.get(key)
+    # the engine name is the last part of the key
+    result_cache_lookups.inc(key[-1], "miss" if cached is None else "hit")
+    if cached is None:
+        return None
+    # the engine was not called for this request, so the timings of the original request don't apply
+    return replace(cached, cached=True, network_time=None, compute_time=None)
 
 
 def call_engines(data: EvalData) -> EvalResponse:
     """This function handles sending the requests to the engines.
-    To improve the performance, the requests are done in Parallel.
+    To improve the performance, the requests are done in Parallel, using the app-wide engine pool.
     Responses are then bundled into a single EvalResponse for future use."""
     eval_resp = EvalResponse(data)
+    for engine_result in stream_engines(data):
+        eval_resp.register_engine(engine_result)
+    return eval_resp
+
+
+def stream_engines(data: EvalData) -> Iterator[EngineResult]:
+    """Send the requests to the engines, and yield every EngineResult as soon as it is available.
+    The requests are submitted right away, so a full engine pool raises before the first result is consumed."""
+    # the payload is the same for all engines, so only serialize it once
+    engine_payload = serialize_payload(data.engine_payload())
 
-    # According to ChatGPT, this does the requests to the engines in parallel
-    with ThreadPoolExecutor() as executor:
-        future_to_engine = {
-            executor.submit(process_engine, engine, data.engine_payload()): engine
-            for engine
-            in engines
-        }
+    engines = get_engines()
+    futures = submit_all(process_engine, [(engine, data, engine_payload) for engine in engines])
+    return (
+        engine_result if engine_result is not None
+        else timed_out_result(engine, "Engine did not reply before the deadline of the request")
+        for engine, engine_result
+        in collect_results(dict(zip(futures, engines)), eval_deadline)
+    )
 
-        for future in as_completed(future_to_engine):
-            engine_result = future.result()
+
+def call_engines_batch(data: EvalBatchData) -> EvalBatchResponse:
+    """Same as call_engines, but for multiple cases against a single PAC.
+    Every engine receives all cases in a single request,
+    and the results are split back into one EvalCaseResponse per case."""
+    batch_resp = EvalBatchResponse(data)
+
+    engines = get_engines()
+    futures = submit_all(process_engine_batch, [(engine, data) for engine in engines])
+    deadline = eval_deadline + len(data.cases) * ENGINE_BATCH_TIMEOUT_PER_CASE
+    for engine, engine_results in collect_results(dict(zip(futures, engines)), deadline):
+        if engine_results is None:
+            engine_results = [timed_out_result(engine, "Engine did not reply before the deadline of the request")] * len(data.cases)
+        for eval_resp, engine_result in zip(batch_resp.results, engine_results):
             eval_resp.register_engine(engine_result)
 
-    return eval_resp
+    return batch_resp
+
+
+def collect_results(future_to_engine: dict[Future, Engine], deadline: float) -> Iterator[tuple[Engine, Any]]:
+    """Yield the engine and the result of its future, as soon as the future completes.
+    Engines that did not complete within the deadline (in seconds) are yielded with a result of None.
+    Their futures keep running in the background, so their results can still end up in the cache."""
+    pending = set(future_to_engine)
+    try:
+        for future in as_completed(future_to_engine, timeout=deadline):
+            pending.discard(future)
+            yield future_to_engine[future], future.result()
+    except FutureTimeoutError:
+        for future, engine in future_to_engine.items():
+            if future in pending:
+                engine_deadline_exceeded.inc(engine.name)
+                yield engine, None
+
+
+def timed_out_result(engine: Engine, error: str) -> EngineResult:
+    return EngineResult(
+        engine=engine.name,
+        status="timed_out",
+        error=error,
+        error_code=500,
+        flags=engine.flags,
+    )
+
+
+def unavailable_result(engine: Engine) -> EngineResult:
+    return EngineResult(
+        engine=engine.name,
+        status="unavailable",
+        error="Engine is unavailable",
+        message="All instances of the engine failed repeatedly, so it is skipped until an instance recovers",
+        error_code=503,
+        flags=engine.flags,
+    )
+
+
+def process_engine(engine: Engine, data: EvalData, engine_payload: bytes) -> EngineResult:
+    """Send a single request to a single engine, unless the result is already cached."""
+    key = cache_key(engine, data.pac.content_hash, data)
+    cached = get_cached_result(key)
+    if cached is not None:
+        return cached
+
+    start = time.perf_counter()
+    reply = request_engine(engine, "", engine_payload, engine.read_timeout)
+    network_time = round((time.perf_counter() - start) * 1000, 3)
+    if isinstance(reply, EngineResult):
+        # failed requests are not cached, since the engine did not manage to evaluate the PAC
+        return replace(reply, network_time=network_time)
+
+    engine_result = replace(parse_engine_reply(engine, reply), network_time=network_time)
+    result_cache.put(key, engine_result, engine.cache_ttl)
+    return engine_result
+
+
+def process_engine_batch(engine: Engine, data: EvalBatchData) -> List[EngineResult]:
+    """Send all cases of a batch as a single request to a single engine.
+    Only cases without a cached result are sent, and cases that share a cache key are only sent once.
+    Returns one EngineResult per case, in the same order as the cases of the batch."""
+    results: List[Optional[EngineResult]] = [None] * len(data.cases)
 
+    # cache key -> indexes of all cases with that key, that are not cached yet
+    pending: collections.OrderedDict[tuple, List[int]] = collections.OrderedDict()
+    for index, case in enumerate(data.cases):
+        key = cache_key(engine, data.pac.content_hash, case)
+        if key not in pending:
+            results[index] = get_cached_result(key)
+            if results[index] is not None:
+                continue
+        pending.setdefault(key, []).append(index)
 
-def process_engine(engine: dict, engine_payload: dict) -> EngineResult:
-    """Send a single request to a single engine."""
+    if not pending:
+        return results
+
+    cases = [data.cases[indexes[0]] for indexes in pending.values()]
+    read_timeout = engine.read_timeout + len(cases) * ENGINE_BATCH_TIMEOUT_PER_CASE
+
+    reply = request_engine(engine, "batch", serialize_payload(data.engine_payload(cases)), read_timeout)
+
+    if isinstance(reply, EngineResult):
+        # the whole batch failed, so the error applies to every pending case
+        engine_results = [reply] * len(cases)
+    elif len(reply.get("results", [])) != len(cases):
+        engine_results = [EngineResult(
+            engine=engine.name,
+            status="failed",
+            error="Engine returned an invalid batch response",
+            message=f"Expected {len(cases)} results, got {len(reply.get('results', []))}",
+            error_code=500,
+            flags=engine.flags,
+        )] * len(cases)
+    else:
+        engine_results = [parse_engine_reply(engine, result) for result in reply["results"]]
+        for key, engine_result in zip(pending, engine_results):
+            result_cache.put(key, engine_result, engine.cache_ttl)
+
+    for indexes, engine_result in zip(pending.values(), engine_results):
+        for index in indexes:
+            results[index] = engine_result
+
+    return results
+
+
+def parse_engine_reply(engine: Engine, res_json: dict) -> EngineResult:
+    """Convert the json reply of an engine for a single evaluation into an EngineResult."""
+    return EngineResult(
+        engine=engine.name,
+        status=res_json.get("status", "failed"),
+        proxy=res_json.get("proxy", "<undefined>"),
+        error=res_json.get("error", None),
+        error_code=res_json.get("error_code", 0),
+        message=res_json.get("message", None),
+        flags=engine.flags,
+        compute_time=res_json.get("eval_time", None),
+    )
+
+
+def serialize_payload(engine_payload: dict) -> bytes:
+    return json.dumps(engine_payload).encode("utf-8")
+
+
+def request_engine(engine: Engine, path: str, engine_payload: bytes, read_timeout: float) -> Union[dict, EngineResult]:
+    """Send a request to an instance of an engine, picking the instance with the least outstanding requests.
+    Evaluations are idempotent, so if an instance can't be reached, the request is retried on another instance.
+    Requests that reached an instance, but timed out while waiting for the reply, are not retried.
+    Requests an instance rejected with 503 (it can't evaluate anything right now) are retried as well.
+    Returns the json body if the engine managed to handle the request,
+    or a failed EngineResult describing why the request failed."""
+    tried = []
+    reply = None
+    while len(tried) <= engine.retries:
+        instance = engine.pick_instance(exclude=tried)
+        if instance is None:
+            break
+        tried.append(instance)
+
+        instance.acquire()
+        try:
+            reply, retryable = request_instance(engine, instance, path, engine_payload, read_timeout)
+        finally:
+            instance.release()
+        if not retryable:
+            return reply
+
+    # no instance left to try, or all tried instances failed
+    if reply is None:
+        engine_unavailable.inc(engine.name)
+        return unavailable_result(engine)
+    return reply
+
+
+def request_instance(engine: Engine, instance: EngineInstance, path: str, engine_payload: bytes, read_timeout: float) -> tuple[Union[dict, EngineResult], bool]:
+    """Send a request to a single instance of an engine, using the pooled session of the instance.
+    Returns the reply (see request_engine), and if the request may be retried on another instance.
+    The outcome is fed into the circuit breaker of the instance."""
 
     # additional data added to all engine results
-    engine_name = engine["name"]
-    engine_flags = engine.get("flags", [])
+    engine_name = engine.name
+    engine_flags = engine.flags
 
+    start = time.perf_counter()
     try:
         # do request
-        res = requests.post(
-            engine["url"],
-            json=engine_payload,
-            timeout=5
+        res = instance.session.post(
+            instance.url + path,
+            data=engine_payload,
+            timeout=(engine.connect_timeout, read_timeout)
         )
+        if res.status_code == 503:
+            # the instance is reachable, but can't evaluate anything (e.g. its workers failed to start)
+            instance.breaker.record_failure()
+        else:
+            # the instance replied, so it is reachable
+            instance.breaker.record_success()
+        engine_request_duration.observe(time.perf_counter() - start, engine_name, path or "eval")
+        engine_requests.inc(engine_name, "success" if res.status_code == 200 else "error")
 
         if res.status_code == 200:
             # request "successfully"
             # this only means that the engine managed to evaluate the pac
             # not that the PAC passed all checks
-            res_json = res.json()
-            return EngineResult(
-                engine=engine_name,
-                status=res_json.get("status", "failed"),
-                proxy=res_json.get("proxy", "<undefined>"),
-                error=res_json.get("error", None),
-                error_code=res_json.get("error_code", 0),
-                message=res_json.get("message", None),
-                flags=engine_flags,
-            )
+            return res.json(), False
         else:
             try:
                 # request failed, but we might have a json error in the body
                 body=res.json()
+                # nothing was evaluated by an unavailable instance, so the request can be retried on another one
                 return EngineResult(
                     engine=engine_name,
                     status="failed",
                     error=body.get("error", ""),
                     error_code=body.get("error_code", 1),
                     message=body.get("message", "No Message"),
-                    flags=engine_flags
-                )
+                    flags=engine_flags,
+                    compute_time=body.get("eval_time", None),
+                ), res.status_code == 503
             except ValueError:
                 # the request body is not a json, so we can't gain any additional error info
                 return EngineResult(
@@ -91,18 +309,20 @@ def process_engine(engine: dict, engine_payload: dict) -> EngineResult:
                     error=res.text,
                     error_code=res.status_code,
                     flags=engine_flags
-                )
-    except requests.exceptions.Timeout:
+                ), False
+    except requests.exceptions.Timeout as e:
         # Engine unavailable
-        return EngineResult(
-            engine=engine_name,
-            status="failed",
-            error="Request to engine timed out",
-            error_code=500,
-            flags=engine_flags
-        )
+        instance.breaker.record_failure()
+        engine_request_duration.observe(time.perf_counter() - start, engine_name, path or "eval")
+        engine_requests.inc(engine_name, "timeout")
+        # only retry if the connection could not be established, retrying a read timeout would make
+        # a slow engine take (retries + 1) * read_timeout
+        return timed_out_result(engine, "Request to engine timed out"), isinstance(e, requests.exceptions.ConnectTimeout)
     except requests.exceptions.RequestException as e:
         # A different, unexpected Error happend
+        instance.breaker.record_failure()
+        engine_request_duration.observe(time.perf_counter() - start, engine_name, path or "eval")
+        engine_requests.inc(engine_name, "connection_error")
         return EngineResult(
             engine=engine_name,
             status="failed",
@@ -110,4 +330,4 @@ def process_engine(engine: dict, engine_payload: dict) -> EngineResult:
             message=str(e),
             error_code=400,
             flags=engine_flags
-        )
+        ), isinstance(e, requests.exceptions.ConnectionError)
@@ -1,38 +1,64 @@
-"""This File contains all Utility to implement and Interact with a simple, in-memory PAC-Store.
-The Store consists of a ring-buffer that holds the last 1000 PACs, referenced by Unique ID."""
+"""This File contains all Utility to implement and Interact with a simple PAC-Store.
+The Store holds the last 1000 PACs, referenced by Unique ID.
+Identical PACs are only stored once, and the least recently used PAC gets evicted when the Store is full.
 
-import collections
+Three backends are available, selected via the STORE_BACKEND config:
+- "memory" (default) keeps all PACs in memory, see storage/memory_store.py
+- "disk" keeps only the metadata in memory and the PAC content in a segment file, see storage/disk_store.py
+- "sqlite" keeps all PACs in a SQLite database, which is shared by all worker processes, see storage/sqlite_store.py"""
+
+from typing import Union
 from apiflask import APIFlask
 
 # imports from other parts of this app
 from classes.pac import PAC, ShortPac
+from storage.disk_store import DiskStore
+from storage.memory_store import MemoryStore
+from storage.sqlite_store import SqliteStore
 
 
-pac_store: collections.deque[PAC] = None
+pac_store: Union[MemoryStore, DiskStore, SqliteStore] = None
 def init_store(app: APIFlask):
     global pac_store
     # set a max cache size based on an environment variable
-    pac_store = collections.deque(maxlen=app.config.get('MAX_CACHE', 1000))
+    max_cache = int(app.config.get('MAX_CACHE', 1000))
+
+    backend = app.config.get('STORE_BACKEND', 'memory').lower()
+    if backend == 'memory':
+        pac_store = MemoryStore(max_cache)
+    elif backend == 'disk':
+        pac_store = DiskStore(max_cache, app.config.get('STORE_PATH', 'data/pac_store.seg'))
+    elif backend == 'sqlite':
+        pac_store = SqliteStore(max_cache, app.config.get('STORE_PATH', 'data/pac_store.sqlite3'))
+    else:
+        raise ValueError(f"Unknown store backend '{backend}'")
 
 
 def has_pac(uid: str) -> bool:
-    return any(pac.uid == uid for pac in pac_store)
+    return pac_store.has_pac(uid)
 
 
 def get_pac(uid: str) -> PAC:
-    for pac in pac_store:
-        if pac.uid == uid:
-            return pac
-    raise KeyError(f"PAC with UID {uid} not found")
+    return pac_store.get_pac(uid)
+
 
+def get_pac_content(uid: str) -> Union[str, bytes]:
+    return pac_store.get_pac_content(uid)
 
-def add_pac(pac: PAC):
-    for existing in pac_store:
-        if existing.uid == pac.uid:
-            pac_store.remove(existing)
-            break
-    pac_store.append(pac)
+
+def add_pac(pac: PAC) -> PAC:
+    """Add a PAC to the store.
+    If a PAC with identical content is already stored, the existing PAC is returned instead."""
+    return pac_store.add_pac(pac)
 
 
 def list_pac() -> list[ShortPac]:
-    return [pac.simple() for pac in pac_store]
+    return pac_store.list_pac()
+
+
+def store_stats() -> dict:
+    return {
+        "size": len(pac_store),
+        "max_size": pac_store.max_cache,
+        "evictions": pac_store.evictions,
+    }
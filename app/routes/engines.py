@@ -0,0 +1,52 @@
+from apiflask import APIFlask, Schema
+from apiflask.fields import Float, Integer, List, Nested, String
+
+# imports from other parts of this app
+from engine_pool import pool_stats
+from engine_registry import get_engines
+from routes.schemas.generic_output import GenericOutput
+
+
+class EngineInstanceStatus(Schema):
+    """State of a single instance of an engine."""
+    url = String(required=True, metadata={"description": "URL of the instance"})
+    health = String(required=True, metadata={"description": "Result of the last health check: 'up', 'down' or 'unknown'"})
+    circuit = String(required=True, metadata={"description": "State of the circuit breaker: 'closed', 'open' or 'half_open'"})
+    failures = Integer(required=True, metadata={"description": "Number of failures in a row"})
+    outstanding = Integer(required=True, metadata={"description": "Number of requests currently sent to the instance"})
+    last_check = Float(allow_none=True, metadata={"description": "Timestamp of the last health check"})
+
+
+class EngineStatus(Schema):
+    """State of a single engine."""
+    name = String(required=True, metadata={"description": "Name of the engine"})
+    flags = List(String(), required=True, metadata={"description": "Features supported by the engine"})
+    health = String(required=True, metadata={"description": "'up' if at least one instance is up, otherwise 'down' or 'unknown'"})
+    instances = List(Nested(EngineInstanceStatus), required=True, metadata={"description": "List of instances of the engine"})
+
+
+class EngineListOutput(GenericOutput):
+    """Output for listing all engines."""
+    engines = List(Nested(EngineStatus), required=True, metadata={"description": "List of engines"})
+
+
+class EnginePoolOutput(GenericOutput):
+    """Output for the state of the engine pool."""
+    workers = Integer(required=True, metadata={"description": "Number of worker threads"})
+    max_queue = Integer(required=True, metadata={"description": "Maximum number of tasks waiting for a worker"})
+    active = Integer(required=True, metadata={"description": "Number of tasks currently processed by a worker"})
+    queued = Integer(required=True, metadata={"description": "Number of tasks waiting for a worker"})
+
+
+def register_engine_routes(app: APIFlask):
+    @app.get('/api/v1/engines')
+    @app.doc(tags=['Engines'], summary='List all engines', description='List all engines, including their health and the state of their circuit breaker')
+    @app.output(EngineListOutput)
+    def r_list_engines():
+        return {"status": "success", "engines": [engine.status() for engine in get_engines()]}
+
+    @app.get('/api/v1/engines/pool')
+    @app.doc(tags=['Engines'], summary='Get engine pool state', description='Get the size and queue depth of the thread-pool used to send requests to the engines')
+    @app.output(EnginePoolOutput)
+    def r_get_engine_pool():
+        return {"status": "success", **pool_stats()}
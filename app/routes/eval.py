@@ -1,15 +1,21 @@
+import json
+import time
 from dataclasses import field
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional
 from apiflask import APIFlask
 from apiflask.validators import Length
+from flask import g
 from marshmallow_dataclass import dataclass
 
 # imports from other parts of this app
-from classes.eval_data import EvalData, EvalResponse
+from classes.eval_data import EvalData, EvalResponse, EvalBatchData, EvalBatchResponse, EngineResult, EvalTimings
 from classes.pac import PAC
-from pac_engines import call_engines
+from pac_engines import call_engines, call_engines_batch, stream_engines
 from pac_storage import get_pac, add_pac
 from routes.schemas.pac_uid import PACId
-from validators.url import IPValidator, HostnameValidator
+from routes.schemas.timings import TimingsQuery
+from validators.url import IPValidator, HostnameValidator, DnsMapValidator
 
 
 @dataclass
@@ -25,6 +31,13 @@ class EvalInput:
         "validate": IPValidator('"src_ip" must be a valid IP'),
         "description": "The source IP URL",
     })
+    dns: Optional[Dict[str, Optional[str]]] = field(default=None, kw_only=True, metadata={
+        "validate": DnsMapValidator('"dns" must map hostnames to IPs, or null if the hostname is unresolvable'),
+        "description": "Overrides DNS for the PAC functions (e.g. dnsResolve), hostnames not listed are unresolvable",
+    })
+    timestamp: Optional[datetime] = field(default=None, kw_only=True, metadata={
+        "description": "Overrides the current time for the PAC functions (e.g. timeRange), the timezone is used as local time",
+    })
 
 
 @dataclass
@@ -37,28 +50,135 @@ class EvalWithPacInput(EvalInput):
     })
 
 
+# the deadline of a batch grows with every case, so the number of cases is limited
+MAX_BATCH_CASES = 100
+
+
+@dataclass
+class EvalBatchInput:
+    """List of cases (except PAC) to evaluate against a single PAC."""
+    cases: List[EvalInput] = field(metadata={
+        "required": True,
+        "validate": Length(min=1, max=MAX_BATCH_CASES),
+        "description": f"The cases to evaluate, each consisting of a dest_host and src_ip (at most {MAX_BATCH_CASES})",
+    })
+
+
+@dataclass
+class EvalBatchWithPacInput(EvalBatchInput):
+    """Full Batch Input including PAC Content for evaluation by the Engines."""
+    content: str = field(metadata={
+        "required": True,
+        "validate": Length(min=1),
+        "description": "The content of the PAC"
+    })
+
+
+engine_result_schema = EngineResult.Schema()
+def ndjson_response(engine_results: Iterator[EngineResult]):
+    """Stream every EngineResult as a single line of json, as soon as it is available."""
+    lines = (json.dumps(engine_result_schema.dump(engine_result)) + "\n" for engine_result in engine_results)
+    return lines, 200, {'Content-Type': 'application/x-ndjson'}
+
+
+class PhaseTimer:
+    """Measures how long every phase of a request takes.
+    The input is validated by apiflask before the route is called, so the first phase starts with the request."""
+
+    def __init__(self):
+        self.last = time.perf_counter()
+        self.start = g.get("request_start", self.last)
+        self.phases = {"validation": self.last - self.start}
+
+    def lap(self, phase: str):
+        now = time.perf_counter()
+        self.phases[phase] = now - self.last
+        self.last = now
+
+
+def timed_response(result: EvalResponse, timer: PhaseTimer, query: TimingsQuery):
+    """Add the timings to the response, if they were requested."""
+    if not query.timings:
+        return result
+    result.timings = EvalTimings.from_phases(timer.phases, time.perf_counter() - timer.start, result.results)
+    return result, 200, {"Server-Timing": result.timings.server_timing()}
+
+
 def register_eval_routes(app: APIFlask):
     @app.post('/api/v1/eval')
     @app.doc(tags=['Eval'], summary='Evaluate PAC', description='Evaluate a PAC, providing the PAC content.')
     @app.input(EvalWithPacInput.Schema, location='json', arg_name="eval_data")
+    @app.input(TimingsQuery.Schema, location='query', arg_name="query")
     @app.output(EvalResponse.Schema)
-    def r_evaluate_after_adding_pac_function(eval_data: EvalWithPacInput):
-        pac = PAC.new_pac(eval_data.content)
-        add_pac(pac)
+    def r_evaluate_after_adding_pac_function(eval_data: EvalWithPacInput, query: TimingsQuery):
+        timer = PhaseTimer()
+        pac = add_pac(PAC.new_pac(eval_data.content))
+        timer.lap("storage")
 
-        ed = EvalData(pac, eval_data.dest_host, eval_data.src_ip)
+        ed = EvalData(pac, eval_data.dest_host, eval_data.src_ip, eval_data.dns, eval_data.timestamp)
         result = call_engines(ed)
-        return result
+        timer.lap("dispatch")
+        return timed_response(result, timer, query)
 
 
     @app.post('/api/v1/eval/<string:uid>')
     @app.doc(tags=['Eval'], summary='Evaluate PAC by UID', description='Evaluate a PAC, referencing it by UID')
     @app.input(PACId.Schema, location='path', arg_name="pid")
     @app.input(EvalInput.Schema, location='json', arg_name="eval_data")
+    @app.input(TimingsQuery.Schema, location='query', arg_name="query")
     @app.output(EvalResponse.Schema)
-    def r_evaluate_by_uid_function(pid: PACId, uid: str, eval_data: EvalInput):
+    def r_evaluate_by_uid_function(pid: PACId, uid: str, eval_data: EvalInput, query: TimingsQuery):
+        timer = PhaseTimer()
         pac = get_pac(pid.uid)
+        timer.lap("storage")
 
-        ed = EvalData(pac, eval_data.dest_host, eval_data.src_ip)
+        ed = EvalData(pac, eval_data.dest_host, eval_data.src_ip, eval_data.dns, eval_data.timestamp)
         result = call_engines(ed)
+        timer.lap("dispatch")
+        return timed_response(result, timer, query)
+
+
+    @app.post('/api/v1/eval/batch')
+    @app.doc(tags=['Eval'], summary='Batch Evaluate PAC', description='Evaluate multiple cases against a PAC, providing the PAC content.')
+    @app.input(EvalBatchWithPacInput.Schema, location='json', arg_name="batch_data")
+    @app.output(EvalBatchResponse.Schema)
+    def r_batch_evaluate_after_adding_pac_function(batch_data: EvalBatchWithPacInput):
+        pac = add_pac(PAC.new_pac(batch_data.content))
+
+        bd = EvalBatchData(pac, [EvalData(pac, case.dest_host, case.src_ip, case.dns, case.timestamp) for case in batch_data.cases])
+        result = call_engines_batch(bd)
         return result
+
+
+    @app.post('/api/v1/eval/<string:uid>/batch')
+    @app.doc(tags=['Eval'], summary='Batch Evaluate PAC by UID', description='Evaluate multiple cases against a PAC, referencing it by UID')
+    @app.input(PACId.Schema, location='path', arg_name="pid")
+    @app.input(EvalBatchInput.Schema, location='json', arg_name="batch_data")
+    @app.output(EvalBatchResponse.Schema)
+    def r_batch_evaluate_by_uid_function(pid: PACId, uid: str, batch_data: EvalBatchInput):
+        pac = get_pac(pid.uid)
+
+        bd = EvalBatchData(pac, [EvalData(pac, case.dest_host, case.src_ip, case.dns, case.timestamp) for case in batch_data.cases])
+        result = call_engines_batch(bd)
+        return result
+
+
+    @app.post('/api/v1/eval/stream')
+    @app.doc(tags=['Eval'], summary='Evaluate PAC (streaming)', description='Evaluate a PAC, providing the PAC content. Every engine result is streamed as a line of json (NDJSON) as soon as the engine replies.')
+    @app.input(EvalWithPacInput.Schema, location='json', arg_name="eval_data")
+    def r_stream_evaluate_after_adding_pac_function(eval_data: EvalWithPacInput):
+        pac = add_pac(PAC.new_pac(eval_data.content))
+
+        ed = EvalData(pac, eval_data.dest_host, eval_data.src_ip, eval_data.dns, eval_data.timestamp)
+        return ndjson_response(stream_engines(ed))
+
+
+    @app.post('/api/v1/eval/<string:uid>/stream')
+    @app.doc(tags=['Eval'], summary='Evaluate PAC by UID (streaming)', description='Evaluate a PAC, referencing it by UID. Every engine result is streamed as a line of json (NDJSON) as soon as the engine replies.')
+    @app.input(PACId.Schema, location='path', arg_name="pid")
+    @app.input(EvalInput.Schema, location='json', arg_name="eval_data")
+    def r_stream_evaluate_by_uid_function(pid: PACId, uid: str, eval_data: EvalInput):
+        pac = get_pac(pid.uid)
+
+        ed = EvalData(pac, eval_data.dest_host, eval_data.src_ip, eval_data.dns, eval_data.timestamp)
+        return ndjson_response(stream_engines(ed))
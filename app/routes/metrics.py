@@ -0,0 +1,46 @@
+from apiflask import APIFlask
+from flask import Response
+
+# imports from other parts of this app
+from engine_pool import pool_stats
+from engine_registry import HEALTH_UP, get_engines
+from metrics import CONTENT_TYPE, Gauge, render_metrics
+from pac_engines import result_cache_stats
+from pac_storage import store_stats
+
+
+def register_gauges():
+    """Gauges read the current state of the app, whenever the metrics are scraped.
+    With multiple worker processes, the values of all processes are summed up,
+    except for state shared by all processes (the PAC-Store) or checked by every process (the health of the engines)."""
+    Gauge("pac_store_size", "Number of PACs in the PAC-Store", lambda: store_stats()["size"], aggregate="max")
+    Gauge("pac_store_max_size", "Maximum number of PACs in the PAC-Store", lambda: store_stats()["max_size"], aggregate="max")
+    Gauge("pac_store_evictions_total", "PACs evicted from the PAC-Store",
+          lambda: store_stats()["evictions"], metric_type="counter")
+    Gauge("pac_result_cache_size", "Number of engine results in the result cache", lambda: result_cache_stats()["size"])
+    Gauge("pac_result_cache_evictions_total", "Engine results evicted from the result cache",
+          lambda: result_cache_stats()["evictions"], metric_type="counter")
+    Gauge("pac_engine_pool_workers", "Number of threads sending requests to the engines", lambda: pool_stats()["workers"])
+    Gauge("pac_engine_pool_active", "Engine requests currently processed by a thread", lambda: pool_stats()["active"])
+    Gauge("pac_engine_pool_queued", "Engine requests waiting for a free thread", lambda: pool_stats()["queued"])
+    Gauge("pac_engine_instance_up", "1 if the last health check of the engine instance succeeded",
+          lambda: {
+              (engine.name, instance.url): int(instance.health == HEALTH_UP)
+              for engine in get_engines() for instance in engine.instances
+          },
+          label_names=("engine", "instance"), aggregate="max")
+    Gauge("pac_engine_instance_outstanding", "Requests currently sent to the engine instance",
+          lambda: {
+              (engine.name, instance.url): instance.outstanding
+              for engine in get_engines() for instance in engine.instances
+          },
+          label_names=("engine", "instance"))
+
+
+def register_metrics_routes(app: APIFlask):
+    register_gauges()
+
+    @app.get('/metrics')
+    @app.doc(summary='Get metrics', description='Metrics of the core server in the Prometheus text format, including latencies of all routes and engines. With multiple worker processes, the metrics of all processes are merged.')
+    def r_metrics():
+        return Response(render_metrics(), mimetype=None, content_type=CONTENT_TYPE)
@@ -6,7 +6,7 @@ from marshmallow_dataclass import dataclass
 
 # imports from other parts of this app
 from classes.pac import PAC, ShortPac
-from pac_storage import has_pac, list_pac, add_pac, get_pac
+from pac_storage import list_pac, add_pac, get_pac, get_pac_content
 from routes.schemas.pac_uid import PACId
 from routes.schemas.generic_output import GenericOutput
 
@@ -44,17 +44,19 @@ def register_pac_routes(app: APIFlask):
     @app.input(PACId.Schema, location='path', arg_name="pid")
     @app.output(PacDetailsOutput)
     def r_get_pac(pid: PACId, uid: str):
-        if not has_pac(pid.uid):
+        try:
+            return {"status": "success", "pac": get_pac(pid.uid)}
+        except KeyError:
             return abort(404, "PAC not found")
-        return {"status": "success", "pac": get_pac(pid.uid)}
 
     @app.get('/pac/<string:uid>')
     @app.doc(tags=['PAC'], summary='Get PAC Content by UID', description='Get PAC by UID. This Endpoints also sets the Content-Type to "application/x-ns-proxy-autoconfig" as expected for a PAC.')
     @app.input(PACId.Schema, location='path', arg_name="pid")
     def r_get_pac_content(pid: PACId, uid: str):
-        if not has_pac(pid.uid):
+        try:
+            return get_pac_content(pid.uid), 200, {'Content-Type': 'application/x-ns-proxy-autoconfig'}
+        except KeyError:
             return abort(404, "PAC not found")
-        return get_pac(pid.uid).content, 200, {'Content-Type': 'application/x-ns-proxy-autoconfig'}
 
     @app.post('/api/v1/pac')
     @app.doc(tags=['PAC'], summary='Add PAC', description='Add a new PAC to the database.')
@@ -63,6 +65,5 @@ def register_pac_routes(app: APIFlask):
     def r_add_pac(pac_data: InputCreatePAC):
         if not pac_data.content:
             return abort(400, "The 'content' field is required")
-        pac = PAC.new_pac(pac_data.content)
-        add_pac(pac)
+        pac = add_pac(PAC.new_pac(pac_data.content))
         return {"status": "success", "pac": pac}
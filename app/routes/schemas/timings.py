@@ -0,0 +1,10 @@
+from dataclasses import field
+from marshmallow_dataclass import dataclass
+
+
+@dataclass
+class TimingsQuery:
+    """Query parameters to request a breakdown of the time spent on a request"""
+    timings: bool = field(default=False, metadata={
+        "description": "Add the time spent in every phase of the request to the response, and as Server-Timing header",
+    })
@@ -1,6 +1,10 @@
 from apiflask import APIFlask
 from werkzeug.middleware.proxy_fix import ProxyFix
 
+from engine_pool import init_engine_pool
+from engine_registry import init_engine_registry
+from metrics import init_metrics
+from pac_engines import init_engines
 from pac_storage import init_store
 
 # create flask app
@@ -20,6 +24,14 @@ if app.config.get('PROXY_FIX', 'false').lower() == 'true':
 
 # init pac store
 init_store(app)
+# init engine registry (incl. background health checks)
+init_engine_registry(app)
+# init engines (incl. result cache)
+init_engines(app)
+# init the thread-pool shared by all requests to the engines
+init_engine_pool(app)
+# measure the latency of all requests
+init_metrics(app)
 
 # add routes
 from routes.other import register_other_routes
@@ -28,6 +40,10 @@ from routes.pac import register_pac_routes
 register_pac_routes(app)
 from routes.eval import register_eval_routes
 register_eval_routes(app)
+from routes.engines import register_engine_routes
+register_engine_routes(app)
+from routes.metrics import register_metrics_routes
+register_metrics_routes(app)
 
 
 # add "status" and "status_code" fields to the default flask errors
@@ -0,0 +1,239 @@
+import collections
+import mmap
+import os
+import struct
+import threading
+from typing import NamedTuple, Optional
+
+# imports from other parts of this app
+from classes.pac import PAC, ShortPac
+
+# Every record in the segment file starts with this header, followed by the utf-8 encoded PAC content.
+# magic, record type, uid, added_time, sha256 of the content, length of the content
+RECORD_HEADER = struct.Struct("<4sB36sd32sI")
+RECORD_MAGIC = b"PAC1"
+RECORD_ADD = 1
+RECORD_DELETE = 2
+
+# only compact if at least this many bytes can be reclaimed
+COMPACT_MIN_BYTES = 1024 * 1024
+
+
+class DiskEntry(NamedTuple):
+    """Metadata of a single PAC stored in the segment file. This is all that is kept in memory."""
+    short: ShortPac
+    content_hash: str
+    offset: int
+    length: int
+
+
+class DiskStore:
+    """PAC-Store that appends all PACs to a segment file on disk, and reads their content back via mmap.
+    Only the metadata of the PACs is kept in memory, which allows a much larger cache.
+    Evicted PACs are marked by a delete record, and their space is reclaimed by compaction.
+    On startup, the index is rebuilt by reading the record headers of the segment file."""
+
+    def __init__(self, max_cache: int, path: str):
+        self.max_cache = max_cache
+        self.path = path
+        # uid -> DiskEntry, ordered from least to most recently used
+        self.entries: collections.OrderedDict[str, DiskEntry] = collections.OrderedDict()
+        # content hash -> uid
+        self.hashes: dict[str, str] = {}
+        # number of bytes in the segment file used by evicted PACs and delete records
+        self.dead_bytes = 0
+        # number of PACs evicted since startup
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.file = open(path, "a+b")
+        self.mm: Optional[mmap.mmap] = None
+
+        with self.lock:
+            self._rebuild_index()
+            while len(self.entries) > self.max_cache:
+                self._evict_oldest()
+            self._compact_if_needed()
+
+    def has_pac(self, uid: str) -> bool:
+        return uid in self.entries
+
+    def get_pac(self, uid: str) -> PAC:
+        with self.lock:
+            entry = self._touch(uid)
+            content = self._read(entry.offset, entry.length).decode("utf-8")
+        return PAC(
+            uid=uid,
+            content=content,
+            added_time=entry.short.added_time,
+            content_hash=entry.content_hash,
+        )
+
+    def get_pac_content(self, uid: str) -> bytes:
+        """Get the raw content of a PAC, directly from the mmap without decoding."""
+        with self.lock:
+            entry = self._touch(uid)
+            return self._read(entry.offset, entry.length)
+
+    def add_pac(self, pac: PAC) -> PAC:
+        with self.lock:
+            existing_uid = self.hashes.get(pac.content_hash)
+            if existing_uid is not None:
+                self.entries.move_to_end(existing_uid)
+                existing = self.entries[existing_uid]
+                return PAC(
+                    uid=existing_uid,
+                    content=pac.content,
+                    added_time=existing.short.added_time,
+                    content_hash=existing.content_hash,
+                )
+
+            # replacing a PAC with the same uid also has to drop the old record
+            if pac.uid in self.entries:
+                self._delete(pac.uid)
+
+            content = pac.content.encode("utf-8")
+            offset = self._append(RECORD_ADD, pac.uid, pac.added_time, pac.content_hash, content)
+            self.entries[pac.uid] = DiskEntry(pac.simple(), pac.content_hash, offset, len(content))
+            self.hashes[pac.content_hash] = pac.uid
+
+            # evict the least recently used PACs
+            while len(self.entries) > self.max_cache:
+                self._evict_oldest()
+            self._compact_if_needed()
+
+            return pac
+
+    def list_pac(self) -> list[ShortPac]:
+        with self.lock:
+            return [entry.short for entry in self.entries.values()]
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def compact(self):
+        """Rewrite the segment file with only the PACs still in the store, to reclaim the space of evicted PACs."""
+        with self.lock:
+            self._compact()
+
+    def _touch(self, uid: str) -> DiskEntry:
+        if uid not in self.entries:
+            raise KeyError(f"PAC with UID {uid} not found")
+        self.entries.move_to_end(uid)
+        return self.entries[uid]
+
+    def _read(self, offset: int, length: int) -> bytes:
+        # the mmap only covers the file at the time it was created, so remap after appends
+        if self.mm is None or offset + length > len(self.mm):
+            self._remap()
+        return self.mm[offset:offset + length]
+
+    def _remap(self):
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+        # mmap does not support empty files
+        if os.fstat(self.file.fileno()).st_size > 0:
+            self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _append(self, record_type: int, uid: str, added_time: float, content_hash: str, content: bytes) -> int:
+        """Append a record to the segment file and return the offset of its content."""
+        header = RECORD_HEADER.pack(
+            RECORD_MAGIC,
+            record_type,
+            uid.encode("ascii").ljust(36),
+            added_time,
+            bytes.fromhex(content_hash) if content_hash else bytes(32),
+            len(content),
+        )
+        self.file.seek(0, os.SEEK_END)
+        offset = self.file.tell() + RECORD_HEADER.size
+        self.file.write(header + content)
+        self.file.flush()
+        return offset
+
+    def _delete(self, uid: str):
+        entry = self.entries.pop(uid)
+        del self.hashes[entry.content_hash]
+        self._append(RECORD_DELETE, uid, 0, "", b"")
+        # the old record and the delete record itself are both dead space now
+        self.dead_bytes += RECORD_HEADER.size + entry.length + RECORD_HEADER.size
+
+    def _evict_oldest(self):
+        uid = next(iter(self.entries))
+        self._delete(uid)
+        self.evictions += 1
+
+    def _rebuild_index(self):
+        """Read all record headers of the segment file, to rebuild the in-memory index."""
+        self._remap()
+        if self.mm is None:
+            return
+
+        offset = 0
+        size = len(self.mm)
+        while offset + RECORD_HEADER.size <= size:
+            magic, record_type, raw_uid, added_time, digest, length = RECORD_HEADER.unpack_from(self.mm, offset)
+            content_offset = offset + RECORD_HEADER.size
+            if magic != RECORD_MAGIC or content_offset + length > size:
+                # incomplete or corrupt record, most likely from a crash during a write
+                break
+            uid = raw_uid.decode("ascii").rstrip()
+
+            if record_type == RECORD_ADD:
+                content_hash = digest.hex()
+                self.entries[uid] = DiskEntry(ShortPac(uid=uid, added_time=added_time), content_hash, content_offset, length)
+                self.entries.move_to_end(uid)
+                self.hashes[content_hash] = uid
+            elif record_type == RECORD_DELETE and uid in self.entries:
+                entry = self.entries.pop(uid)
+                self.hashes.pop(entry.content_hash, None)
+                self.dead_bytes += RECORD_HEADER.size + entry.length + RECORD_HEADER.size
+            offset = content_offset + length
+
+        if offset < size:
+            # drop the broken tail, so new records are appended after the last valid one
+            self.mm.close()
+            self.mm = None
+            self.file.truncate(offset)
+
+    def _compact_if_needed(self):
+        live_bytes = sum(RECORD_HEADER.size + entry.length for entry in self.entries.values())
+        if self.dead_bytes >= COMPACT_MIN_BYTES and self.dead_bytes > live_bytes:
+            self._compact()
+
+    def _compact(self):
+        compact_path = self.path + ".compact"
+        new_entries: collections.OrderedDict[str, DiskEntry] = collections.OrderedDict()
+
+        with open(compact_path, "wb") as compact_file:
+            offset = 0
+            for uid, entry in self.entries.items():
+                content = self._read(entry.offset, entry.length)
+                compact_file.write(RECORD_HEADER.pack(
+                    RECORD_MAGIC,
+                    RECORD_ADD,
+                    uid.encode("ascii").ljust(36),
+                    entry.short.added_time,
+                    bytes.fromhex(entry.content_hash),
+                    entry.length,
+                ))
+                compact_file.write(content)
+                offset += RECORD_HEADER.size
+                new_entries[uid] = entry._replace(offset=offset)
+                offset += entry.length
+            compact_file.flush()
+            os.fsync(compact_file.fileno())
+
+        # swap the compacted file in place of the old segment file
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+        self.file.close()
+        os.replace(compact_path, self.path)
+        self.file = open(self.path, "a+b")
+
+        self.entries = new_entries
+        self.dead_bytes = 0
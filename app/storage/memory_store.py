@@ -0,0 +1,65 @@
+import collections
+import threading
+from typing import Union
+
+# imports from other parts of this app
+from classes.pac import PAC, ShortPac
+
+
+class MemoryStore:
+    """PAC-Store that keeps all PACs in memory.
+    PACs are indexed by uid and by a hash of their content, so identical PACs are only stored once.
+    When the Store is full, the least recently used PAC gets evicted."""
+
+    def __init__(self, max_cache: int):
+        self.max_cache = max_cache
+        # uid -> PAC, ordered from least to most recently used
+        self.pacs: collections.OrderedDict[str, PAC] = collections.OrderedDict()
+        # content hash -> uid
+        self.hashes: dict[str, str] = {}
+        # number of PACs evicted since startup
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def has_pac(self, uid: str) -> bool:
+        return uid in self.pacs
+
+    def get_pac(self, uid: str) -> PAC:
+        with self.lock:
+            if uid not in self.pacs:
+                raise KeyError(f"PAC with UID {uid} not found")
+            self.pacs.move_to_end(uid)
+            return self.pacs[uid]
+
+    def get_pac_content(self, uid: str) -> Union[str, bytes]:
+        return self.get_pac(uid).content
+
+    def add_pac(self, pac: PAC) -> PAC:
+        with self.lock:
+            existing_uid = self.hashes.get(pac.content_hash)
+            if existing_uid is not None:
+                self.pacs.move_to_end(existing_uid)
+                return self.pacs[existing_uid]
+
+            # replacing a PAC with the same uid also has to drop the hash of the old content
+            replaced = self.pacs.pop(pac.uid, None)
+            if replaced is not None:
+                del self.hashes[replaced.content_hash]
+
+            self.pacs[pac.uid] = pac
+            self.hashes[pac.content_hash] = pac.uid
+
+            # evict the least recently used PACs
+            while len(self.pacs) > self.max_cache:
+                _, evicted = self.pacs.popitem(last=False)
+                del self.hashes[evicted.content_hash]
+                self.evictions += 1
+
+            return pac
+
+    def list_pac(self) -> list[ShortPac]:
+        with self.lock:
+            return [pac.simple() for pac in self.pacs.values()]
+
+    def __len__(self) -> int:
+        return len(self.pacs)
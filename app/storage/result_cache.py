@@ -0,0 +1,42 @@
+import collections
+import threading
+import time
+from typing import Any, Hashable, Optional
+
+
+class ResultCache:
+    """Bounded cache for evaluation results.
+    Every entry has its own TTL, and the least recently used entry gets evicted when the cache is full."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        # key -> (expiry timestamp, value), ordered from least to most recently used
+        self.entries: collections.OrderedDict[Hashable, tuple[float, Any]] = collections.OrderedDict()
+        # number of entries evicted to make room for new ones, expired entries are not counted
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def put(self, key: Hashable, value: Any, ttl: float):
+        if self.max_size <= 0 or ttl <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (time.monotonic() + ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def __len__(self) -> int:
+        return len(self.entries)
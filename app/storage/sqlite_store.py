@@ -0,0 +1,110 @@
+import os
+import sqlite3
+import threading
+import time
+
+# imports from other parts of this app
+from classes.pac import PAC, ShortPac
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pacs (
+    uid TEXT PRIMARY KEY,
+    content_hash TEXT NOT NULL UNIQUE,
+    content TEXT NOT NULL,
+    added_time REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS pacs_last_used ON pacs (last_used);
+"""
+
+# seconds until reading a PAC updates its last_used again
+# every update takes the write lock of the database, which would serialize all workers reading the same PACs
+TOUCH_INTERVAL = 60
+
+
+class SqliteStore:
+    """PAC-Store that keeps all PACs in a SQLite database file.
+    The database is shared by all processes using the same file, so the core server can run multiple worker processes,
+    and every worker sees every PAC. Identical PACs are only stored once.
+    When the Store is full, the least recently used PAC gets evicted.
+    Reads only update the last use of a PAC every TOUCH_INTERVAL seconds, so the order of eviction is that coarse."""
+
+    def __init__(self, max_cache: int, path: str):
+        self.max_cache = max_cache
+        self.path = path
+        # sqlite connections can't be shared between threads, so every thread gets its own connection
+        self.local = threading.local()
+        # number of PACs evicted by this process since startup
+        self.evictions = 0
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connection() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            # autocommit mode, transactions are started explicitly where required
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            # WAL allows readers in other processes to continue while a PAC is added
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def has_pac(self, uid: str) -> bool:
+        return self._connection().execute("SELECT 1 FROM pacs WHERE uid = ?", (uid,)).fetchone() is not None
+
+    def get_pac(self, uid: str) -> PAC:
+        conn = self._connection()
+        row = conn.execute(
+            "SELECT uid, content, added_time, content_hash, last_used FROM pacs WHERE uid = ?", (uid,)
+        ).fetchone()
+        if row is None:
+            raise KeyError(f"PAC with UID {uid} not found")
+        now = time.time()
+        if now - row[4] > TOUCH_INTERVAL:
+            conn.execute("UPDATE pacs SET last_used = ? WHERE uid = ?", (now, uid))
+        return PAC(uid=row[0], content=row[1], added_time=row[2], content_hash=row[3])
+
+    def get_pac_content(self, uid: str) -> str:
+        return self.get_pac(uid).content
+
+    def add_pac(self, pac: PAC) -> PAC:
+        conn = self._connection()
+        # IMMEDIATE takes the write lock right away, so two processes can't add the same content at once
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT uid, content, added_time, content_hash FROM pacs WHERE content_hash = ?", (pac.content_hash,)
+            ).fetchone()
+            if row is not None:
+                conn.execute("UPDATE pacs SET last_used = ? WHERE uid = ?", (time.time(), row[0]))
+                conn.execute("COMMIT")
+                return PAC(uid=row[0], content=row[1], added_time=row[2], content_hash=row[3])
+
+            # replacing a PAC with the same uid also drops the old content
+            conn.execute(
+                "INSERT OR REPLACE INTO pacs (uid, content_hash, content, added_time, last_used) VALUES (?, ?, ?, ?, ?)",
+                (pac.uid, pac.content_hash, pac.content, pac.added_time, time.time()),
+            )
+
+            # evict the least recently used PACs
+            evicted = conn.execute(
+                "DELETE FROM pacs WHERE uid IN (SELECT uid FROM pacs ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_cache,),
+            ).rowcount
+            conn.execute("COMMIT")
+            self.evictions += evicted
+            return pac
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def list_pac(self) -> list[ShortPac]:
+        rows = self._connection().execute("SELECT uid, added_time FROM pacs ORDER BY last_used").fetchall()
+        return [ShortPac(uid=uid, added_time=added_time) for uid, added_time in rows]
+
+    def __len__(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM pacs").fetchone()[0]
@@ -6,6 +6,9 @@ import re
 # RegEx used for Validation
 ip_regex = re.compile(r'^(\d{1,3}\.){3}\d{1,3}$')
 hostname_regex = re.compile(r'^(?!:\/\/)([a-zA-Z0-9.-]{1,253})\.([a-zA-Z]{2,63})$')
+# one or more labels of up to 63 characters, e.g. 'wpad', 'proxy.corp' or 'www.example.com.'
+dns_label = r'[a-zA-Z0-9_](?:[a-zA-Z0-9_-]{0,61}[a-zA-Z0-9_])?'
+dns_name_regex = re.compile(rf'^(?=.{{1,253}}\.?$){dns_label}(?:\.{dns_label})*\.?$')
 
 class URLValidator(Validator):
     """Validator to check if a string is a valid URL."""
@@ -80,3 +83,27 @@ def validate_hostname(hostname):
         return True
 
     return bool(hostname_regex.match(hostname))
+
+
+def validate_dns_name(name):
+    """
+    Validate if the input is a syntactically valid DNS name, including single labels like 'wpad' or 'intranet'.
+
+    :param name: The string to validate as a DNS name.
+    :return: True if the input is a valid DNS name, otherwise False.
+    """
+    return bool(dns_name_regex.match(name))
+
+
+class DnsMapValidator(Validator):
+    """Validator to check if a dict maps valid DNS names to valid IP addresses (IPv4) or None (unresolvable)."""
+    def __init__(self, message=None):
+        if message is None:
+            message = "The dict must map Hostnames to IPs or null."
+        self.message = message
+
+    def __call__(self, value):
+        for hostname, ip_address in value.items():
+            if not validate_dns_name(hostname) or (ip_address is not None and not validate_ip(ip_address)):
+                raise ValidationError(f"{self.message}, invalid entry: '{hostname}'")
+        return
@@ -0,0 +1,349 @@
+"""Benchmark of the core server, using stub engines instead of the real ones (see stub_engine.py).
+Starts the stub engines and the core server (via gunicorn, as in Docker) on localhost,
+then runs every scenario with a number of concurrent clients for a fixed duration.
+Reports throughput, latency percentiles and the memory of the core server per scenario.
+
+Scenarios:
+- eval: POST /api/v1/eval with the PAC content
+- eval_uid: POST /api/v1/eval/<uid> with a stored PAC
+- upload: POST /api/v1/pac with a new PAC every request, so the store keeps evicting
+- list: GET /api/v1/pac with a full store
+
+Every evaluation uses a new dest_host, so the engines are called instead of answering from the result cache.
+Results can be written to a json file, and compared against a previous run to fail on regressions.
+
+Usage: python3 bench.py [--duration S] [--concurrency N] [--scenarios eval,eval_uid,...] [--json FILE] [--baseline FILE]
+Run "python3 bench.py --help" for all options, including the behaviour of the stub engines."""
+
+import argparse
+import itertools
+import json
+import math
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Callable, Optional
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(BENCH_DIR, "..", "app")
+DEFAULT_PAC = os.path.join(BENCH_DIR, "..", "example.pac")
+
+SCENARIOS = ["eval", "eval_uid", "upload", "list"]
+
+# seconds to wait for the core server and the stub engines to start
+STARTUP_TIMEOUT = 30
+
+
+def free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_until_up(url: str, process: subprocess.Popen):
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Process for {url} exited with code {process.returncode}")
+        try:
+            if requests.get(url + "up", timeout=1).status_code == 200:
+                return
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f"{url} did not come up within {STARTUP_TIMEOUT} seconds")
+
+
+def process_tree_rss(pid: int) -> int:
+    """Resident memory (in bytes) of a process and all its descendants, e.g. the gunicorn master and its workers."""
+    children: dict[int, list[int]] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "r") as f:
+                # the process name may contain spaces, so the fields are parsed from the end of the name
+                fields = f.read().rsplit(")", 1)[1].split()
+            children.setdefault(int(fields[1]), []).append(int(entry))
+        except (OSError, IndexError):
+            # the process exited meanwhile
+            continue
+
+    rss = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        pending.extend(children.get(current, []))
+        try:
+            with open(f"/proc/{current}/status", "r") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        rss += int(line.split()[1]) * 1024
+        except OSError:
+            continue
+    return rss
+
+
+def percentile(sorted_values: list[float], p: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, math.ceil(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class Environment:
+    """The stub engines and the core server, running as child processes."""
+
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.processes: list[subprocess.Popen] = []
+        self.store_dir = tempfile.TemporaryDirectory(prefix="pac-bench-")
+        self.core_url = ""
+        self.core: Optional[subprocess.Popen] = None
+
+    def start(self):
+        engines = []
+        for i in range(self.args.engines):
+            port = free_port()
+            process = subprocess.Popen([
+                sys.executable, os.path.join(BENCH_DIR, "stub_engine.py"), str(port),
+                "--latency", str(self.args.latency),
+                "--jitter", str(self.args.jitter),
+                "--error-rate", str(self.args.error_rate),
+                "--timeout-rate", str(self.args.timeout_rate),
+                "--timeout", str(self.args.timeout),
+            ], stdout=subprocess.DEVNULL)
+            self.processes.append(process)
+            engines.append({"name": f"stub{i}", "url": f"http://127.0.0.1:{port}/", "flags": ["evaluation", "src_ip"]})
+            wait_until_up(engines[-1]["url"], process)
+
+        port = free_port()
+        env = {
+            **os.environ,
+            "APP_ENGINES": json.dumps(engines),
+            "APP_MAX_CACHE": str(self.args.store_size),
+            "APP_STORE_PATH": os.path.join(self.store_dir.name, "pac_store"),
+            "APP_SERVER_WORKERS": str(self.args.server_workers),
+        }
+        for setting in self.args.core_env:
+            key, _, value = setting.partition("=")
+            env[key] = value
+        self.core = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "-b", f"127.0.0.1:{port}", "server:app"],
+            cwd=APP_DIR,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=None if self.args.verbose else subprocess.DEVNULL,
+        )
+        self.processes.append(self.core)
+        self.core_url = f"http://127.0.0.1:{port}/"
+        wait_until_up(self.core_url, self.core)
+
+    def stop(self):
+        for process in self.processes:
+            if process.poll() is None:
+                process.send_signal(signal.SIGTERM)
+        for process in self.processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        self.store_dir.cleanup()
+
+
+class Scenario:
+    """A single kind of request, that is sent over and over by every client."""
+
+    def __init__(self, name: str, pac_content: str, core_url: str, store_size: int):
+        self.name = name
+        self.pac_content = pac_content
+        self.core_url = core_url
+        self.store_size = store_size
+        # used to make every dest_host and uploaded PAC unique
+        self.counter = itertools.count()
+        self.uid = ""
+
+    def setup(self, session: requests.Session):
+        if self.name == "eval_uid":
+            self.uid = self.upload(session).json()["pac"]["uid"]
+        elif self.name == "list":
+            # fill the store, so the list contains the maximum number of PACs
+            for _ in range(self.store_size):
+                self.upload(session)
+
+    def upload(self, session: requests.Session) -> requests.Response:
+        content = f"{self.pac_content}\n// {next(self.counter)}\n"
+        return session.post(self.core_url + "api/v1/pac", json={"content": content})
+
+    def request(self, session: requests.Session) -> requests.Response:
+        if self.name == "eval":
+            return session.post(self.core_url + "api/v1/eval", json={
+                "dest_host": f"host{next(self.counter)}.example.com",
+                "src_ip": "10.0.0.1",
+                "content": self.pac_content,
+            })
+        if self.name == "eval_uid":
+            return session.post(self.core_url + f"api/v1/eval/{self.uid}", json={
+                "dest_host": f"host{next(self.counter)}.example.com",
+                "src_ip": "10.0.0.1",
+            })
+        if self.name == "upload":
+            return self.upload(session)
+        return session.get(self.core_url + "api/v1/pac")
+
+
+def run_clients(request: Callable[[requests.Session], requests.Response], concurrency: int, duration: float) -> tuple[list[float], int]:
+    """Send requests from concurrent clients until the duration (in seconds) passed.
+    Returns the latency (in seconds) of every request, and the number of failed requests."""
+    latencies: list[list[float]] = [[] for _ in range(concurrency)]
+    errors = [0] * concurrency
+    deadline = time.monotonic() + duration
+
+    def client(index: int):
+        # every client has its own session, so connections are reused like a real client would
+        with requests.Session() as session:
+            while time.monotonic() < deadline:
+                start = time.perf_counter()
+                try:
+                    ok = request(session).status_code == 200
+                except requests.exceptions.RequestException:
+                    ok = False
+                latencies[index].append(time.perf_counter() - start)
+                if not ok:
+                    errors[index] += 1
+
+    threads = [threading.Thread(target=client, args=(i,), daemon=True) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return [latency for client_latencies in latencies for latency in client_latencies], sum(errors)
+
+
+def run_scenario(scenario: Scenario, environment: Environment, args: argparse.Namespace) -> dict:
+    with requests.Session() as session:
+        scenario.setup(session)
+    if args.warmup > 0:
+        run_clients(scenario.request, args.concurrency, args.warmup)
+
+    # sample the memory of the core server while the scenario runs
+    rss_samples = []
+    stop_sampling = threading.Event()
+    def sample_memory():
+        while not stop_sampling.is_set():
+            rss_samples.append(process_tree_rss(environment.core.pid))
+            stop_sampling.wait(0.5)
+    sampler = threading.Thread(target=sample_memory, daemon=True)
+    sampler.start()
+
+    start = time.monotonic()
+    latencies, errors = run_clients(scenario.request, args.concurrency, args.duration)
+    elapsed = time.monotonic() - start
+    stop_sampling.set()
+    sampler.join()
+    rss_samples.append(process_tree_rss(environment.core.pid))
+
+    latencies.sort()
+    return {
+        "scenario": scenario.name,
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "max_rss_mb": round(max(rss_samples) / 1024 / 1024, 1),
+        "end_rss_mb": round(rss_samples[-1] / 1024 / 1024, 1),
+    }
+
+
+def print_report(results: list[dict]):
+    columns = ["scenario", "requests", "errors", "throughput", "p50_ms", "p95_ms", "p99_ms", "max_rss_mb", "end_rss_mb"]
+    widths = [max(len(column), *(len(str(result[column])) for result in results)) for column in columns]
+    print("  ".join(column.ljust(width) for column, width in zip(columns, widths)))
+    for result in results:
+        print("  ".join(str(result[column]).ljust(width) for column, width in zip(columns, widths)))
+
+
+def compare_to_baseline(results: list[dict], baseline: list[dict], max_regression: float) -> list[str]:
+    """Compare throughput, p95 latency and memory against a previous run.
+    Returns a description of every value that got worse by more than max_regression percent."""
+    regressions = []
+    baseline_by_name = {result["scenario"]: result for result in baseline}
+    for result in results:
+        previous = baseline_by_name.get(result["scenario"])
+        if previous is None:
+            continue
+        # (key, True if higher is better)
+        for key, higher_is_better in [("throughput", True), ("p95_ms", False), ("max_rss_mb", False)]:
+            if not previous[key]:
+                continue
+            change = (result[key] - previous[key]) / previous[key] * 100
+            if (-change if higher_is_better else change) > max_regression:
+                regressions.append(f"{result['scenario']}: {key} changed from {previous[key]} to {result[key]} ({change:+.1f}%)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the core server, using stub engines.")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"comma separated list of scenarios, out of: {', '.join(SCENARIOS)}")
+    parser.add_argument("--duration", type=float, default=10, help="seconds every scenario runs")
+    parser.add_argument("--warmup", type=float, default=2, help="seconds of load before every scenario, which are not measured")
+    parser.add_argument("--concurrency", type=int, default=16, help="number of concurrent clients")
+    parser.add_argument("--pac", default=DEFAULT_PAC, help="PAC file used for all requests")
+    parser.add_argument("--store-size", type=int, default=1000, help="maximum number of PACs in the store (APP_MAX_CACHE)")
+    parser.add_argument("--server-workers", type=int, default=1, help="number of worker processes of the core server (APP_SERVER_WORKERS)")
+    parser.add_argument("--core-env", action="append", default=[], metavar="KEY=VALUE", help="additional environment variable for the core server, can be repeated")
+    parser.add_argument("--engines", type=int, default=3, help="number of stub engines")
+    parser.add_argument("--latency", type=float, default=5, help="milliseconds every stub engine evaluation takes")
+    parser.add_argument("--jitter", type=float, default=2, help="milliseconds the latency randomly varies by")
+    parser.add_argument("--error-rate", type=float, default=0, help="share of stub engine requests that get an error reply")
+    parser.add_argument("--timeout-rate", type=float, default=0, help="share of stub engine requests that don't reply in time")
+    parser.add_argument("--timeout", type=float, default=6000, help="milliseconds a timed out stub engine request takes")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="results of a previous run (see --json), exits with 1 if a scenario got worse")
+    parser.add_argument("--max-regression", type=float, default=10, help="percent a value may get worse than the baseline")
+    parser.add_argument("--verbose", action="store_true", help="show the log of the core server")
+    args = parser.parse_args()
+
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    with open(args.pac, "r", encoding="utf-8") as f:
+        pac_content = f.read()
+
+    environment = Environment(args)
+    results = []
+    try:
+        environment.start()
+        for name in scenarios:
+            print(f"Running scenario '{name}' for {args.duration}s with {args.concurrency} clients...", file=sys.stderr)
+            scenario = Scenario(name, pac_content, environment.core_url, args.store_size)
+            results.append(run_scenario(scenario, environment, args))
+    finally:
+        environment.stop()
+
+    print_report(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare_to_baseline(results, json.load(f), args.max_regression)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
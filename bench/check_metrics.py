@@ -0,0 +1,86 @@
+"""Checks the metrics of the core server with multiple worker processes, using a stub engine (see stub_engine.py).
+It starts the core server via gunicorn with 2 workers, sends requests and scrapes GET /metrics over and over,
+every time on a new connection, so the requests and scrapes are spread over both workers.
+Every counter and histogram must never decrease from one scrape to the next,
+and once the workers wrote their metrics (APP_METRICS_WRITE_INTERVAL), the counts must cover all requests.
+
+Usage: python3 check_metrics.py [--workers N] [--rounds N] [--requests N]"""
+
+import argparse
+import re
+import sys
+import time
+import requests
+
+from bench import Environment
+
+PAC = "function FindProxyForURL(url, host) { return 'DIRECT'; }"
+
+# a sample line of the Prometheus text format: name{labels} value
+SAMPLE = re.compile(r"^([a-zA-Z_:][a-zA-Z0-9_:]*(?:\{.*\})?) (\S+)$")
+
+
+def scrape(core_url: str) -> dict[str, float]:
+    """The samples of all counters and histograms, a new connection is used for every scrape."""
+    text = requests.get(core_url + "metrics", headers={"Connection": "close"}, timeout=10).text
+    cumulative = set(re.findall(r"^# TYPE (\S+) (?:counter|histogram)$", text, re.MULTILINE))
+    samples = {}
+    for line in text.splitlines():
+        match = SAMPLE.match(line)
+        if match and re.sub(r"(_bucket|_sum|_count)?(\{.*)?$", "", match.group(1)) in cumulative:
+            samples[match.group(1)] = float(match.group(2))
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that the metrics of multiple worker processes are merged.")
+    parser.add_argument("--workers", type=int, default=2, help="worker processes of the core server")
+    parser.add_argument("--rounds", type=int, default=20, help="rounds of requests, every round is followed by scrapes")
+    parser.add_argument("--requests", type=int, default=5, help="requests per round")
+    args = parser.parse_args()
+
+    environment = Environment(argparse.Namespace(
+        engines=1, latency=1, jitter=0, error_rate=0, timeout_rate=0, timeout=0, store_size=100,
+        server_workers=args.workers, core_env=[], verbose=False,
+    ))
+    decreased = []
+    try:
+        environment.start()
+        core_url = environment.core_url
+        previous: dict[str, float] = {}
+        sent = 0
+        for i in range(args.rounds):
+            for j in range(args.requests):
+                requests.post(core_url + "api/v1/eval", headers={"Connection": "close"}, timeout=10, json={
+                    "dest_host": f"host{i}-{j}.example.com", "src_ip": "10.0.0.1", "content": PAC,
+                })
+                sent += 1
+            for _ in range(args.workers):
+                samples = scrape(core_url)
+                decreased.extend(
+                    f"{name}: {previous[name]} -> {value}"
+                    for name, value in samples.items() if value < previous.get(name, 0)
+                )
+                previous.update(samples)
+
+        # wait until every worker wrote its metrics at least once more
+        time.sleep(2)
+        final = scrape(core_url)
+    finally:
+        environment.stop()
+
+    evals = sum(value for name, value in final.items()
+                if name.startswith("pac_http_request_duration_seconds_count") and 'route="/api/v1/eval"' in name)
+    checks = {
+        f"no counter decreased between scrapes ({len(decreased)} did)": not decreased,
+        f"requests counted by all workers ({int(evals)}) == requests sent ({sent})": evals == sent,
+    }
+    for line in decreased[:10]:
+        print(f"decreased: {line}")
+    for check, passed in checks.items():
+        print(f"{'PASS' if passed else 'FAIL'}: {check}")
+    sys.exit(0 if all(checks.values()) else 1)
+
+
+if __name__ == "__main__":
+    main()
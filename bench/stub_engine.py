@@ -0,0 +1,119 @@
+"""Stub engine used to benchmark the core server without the real engines.
+It speaks the same API as the engines (GET /up, POST / and POST /batch), but instead of evaluating the PAC,
+it waits for a configurable latency and replies with a fixed proxy.
+Some requests can fail on purpose, either with an error reply or by not replying before the core server gives up.
+
+Usage: python3 stub_engine.py PORT [--latency MS] [--jitter MS] [--error-rate RATE] [--timeout-rate RATE] [--timeout MS]"""
+
+import argparse
+import json
+import random
+import sys
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubEngineServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # the core server keeps a pool of connections per engine, so allow a burst of new connections
+    request_queue_size = 256
+
+    def __init__(self, port: int, latency: float, jitter: float, error_rate: float, timeout_rate: float, timeout: float):
+        super().__init__(("127.0.0.1", port), StubEngineHandler)
+        # all in seconds
+        self.latency = latency
+        self.jitter = jitter
+        self.timeout = timeout
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+
+    def handle_error(self, request, client_address):
+        # the core server closes the connection of requests it gave up on, which is expected for simulated timeouts
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+
+class StubEngineHandler(BaseHTTPRequestHandler):
+    # keep connections alive, like the real engines
+    protocol_version = "HTTP/1.1"
+    # headers and body are written separately, without this every reply waits for the delayed ACK of the client
+    disable_nagle_algorithm = True
+    server: StubEngineServer
+
+    def log_message(self, format, *args):
+        # logging every request would slow down the stub more than the latency it simulates
+        pass
+
+    def send_json_response(self, json_body: dict, status_code: int):
+        body = json.dumps(json_body).encode("utf-8")
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/up":
+            self.send_json_response({"status": "success", "message": "Server is up and running!"}, 200)
+        else:
+            self.send_json_response({"status": "failed", "error": "Not Found"}, 404)
+
+    def do_POST(self):
+        try:
+            data = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        except json.JSONDecodeError:
+            self.send_json_response({"status": "failed", "error": "Request must be a valid JSON"}, 400)
+            return
+
+        if self.path not in ("/", "/batch"):
+            self.send_json_response({"status": "failed", "error": "Not Found"}, 404)
+            return
+
+        start = time.perf_counter()
+        roll = random.random()
+        if roll < self.server.timeout_rate:
+            time.sleep(self.server.timeout)
+        else:
+            time.sleep(max(0.0, self.server.latency + random.uniform(-self.server.jitter, self.server.jitter)))
+        eval_time = round((time.perf_counter() - start) * 1000, 3)
+
+        if roll >= 1 - self.server.error_rate:
+            self.send_json_response({
+                "status": "failed",
+                "error": "Simulated error",
+                "error_code": 1,
+                "message": "The stub engine failed this request on purpose",
+                "eval_time": eval_time,
+            }, 400)
+        elif self.path == "/batch":
+            results = [{"status": "success", "proxy": "DIRECT"} for _ in data.get("cases", [])]
+            self.send_json_response({"status": "success", "results": results, "eval_time": eval_time}, 200)
+        else:
+            self.send_json_response({"status": "success", "proxy": "DIRECT", "eval_time": eval_time}, 200)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub engine used to benchmark the core server.")
+    parser.add_argument("port", type=int)
+    parser.add_argument("--latency", type=float, default=5, help="milliseconds every evaluation takes")
+    parser.add_argument("--jitter", type=float, default=0, help="milliseconds the latency randomly varies by, in both directions")
+    parser.add_argument("--error-rate", type=float, default=0, help="share of requests that get an error reply")
+    parser.add_argument("--timeout-rate", type=float, default=0, help="share of requests that take --timeout to reply")
+    parser.add_argument("--timeout", type=float, default=6000, help="milliseconds a timed out request takes, should exceed the read timeout of the core server")
+    args = parser.parse_args()
+
+    server = StubEngineServer(
+        port=args.port,
+        latency=args.latency / 1000,
+        jitter=args.jitter / 1000,
+        error_rate=args.error_rate,
+        timeout_rate=args.timeout_rate,
+        timeout=args.timeout / 1000,
+    )
+    print(f"Stub engine listening on port {args.port}", flush=True)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
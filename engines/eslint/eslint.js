@@ -1,44 +1,114 @@
-import { ESLint } from "eslint";
+import crypto from "crypto";
 import http from "http";
+import os from "os";
+import { LRUCache } from "../shared/cache.js";
+import { WorkerPool, WorkerPoolBusyError, WorkerPoolUnavailableError, WorkerTimeoutError } from "../shared/pool.js";
 
 // The port the server will run on
-const port = 8083;
+// can be overwritten, to run multiple instances of the engine
+const port = process.env.PORT || 8083;
 
-const eslint = new ESLint({
-    overrideConfigFile: "eslint.config.js",
+// PACs are linted by a pool of worker threads, the main thread only handles the HTTP requests
+// requests waiting for an idle worker are limited, so an overloaded engine replies with 503 instead of piling up requests
+const pool = new WorkerPool(new URL('./worker.js', import.meta.url), Number(process.env.WORKERS || os.availableParallelism()), "Linting", {
+    maxQueue: Number(process.env.QUEUE_SIZE || 128),
+    queueTimeout: Number(process.env.QUEUE_TIMEOUT || 5000),
 });
+// max time (in ms) linting a single PAC may take, before the worker is replaced
+const lintTimeout = Number(process.env.LINT_TIMEOUT || 10000);
+// max size (in bytes) of a request body, larger requests are rejected with 413
+const maxPayloadSize = Number(process.env.MAX_PAYLOAD_SIZE || 10 * 1024 * 1024);
+// lint results, keyed by the hash of the PAC content
+// linting only depends on the content, so the result never changes for the same content
+const resultCache = new LRUCache(Number(process.env.RESULT_CACHE_SIZE || 1000));
 
-const reply = (res, success, body) => {
+const reply = (res, success, body, statusCode = null) => {
     // Set the response HTTP header
-    res.writeHead(success ? 200 : 400, {'Content-Type': 'application/json'});
+    res.writeHead(statusCode || (success ? 200 : 400), {'Content-Type': 'application/json'});
     // Write the response content
     res.end(JSON.stringify(
         { status: success ? 'success' : 'failed', ...body }
     ));
 }
 
+// Error used if a request body exceeds maxPayloadSize
+class PayloadTooLargeError extends Error {}
+
 // Helper function to parse the body for POST requests
+// the chunks are collected as buffers and only decoded once, and the body is rejected as soon as it gets too large
 const parseRequestBody = (req) => {
   return new Promise((resolve, reject) => {
-    let body = "";
+    const tooLarge = () => new PayloadTooLargeError(`Request body exceeds the limit of ${maxPayloadSize} bytes.`);
+    if (Number(req.headers['content-length']) > maxPayloadSize) {
+      reject(tooLarge());
+      return;
+    }
+
+    const chunks = [];
+    let size = 0;
     req.on("data", (chunk) => {
-      body += chunk.toString();
+      size += chunk.length;
+      if (size > maxPayloadSize) {
+        // stop buffering, the rest of the body is discarded
+        req.removeAllListeners("data");
+        req.resume();
+        reject(tooLarge());
+        return;
+      }
+      chunks.push(chunk);
     });
     req.on("end", () => {
+      if (size > maxPayloadSize) return;
       try {
-        resolve(JSON.parse(body));
+        resolve(JSON.parse(Buffer.concat(chunks, size).toString("utf-8")));
       } catch (err) {
         reject(err);
       }
     });
+    req.on("error", reject);
   });
 };
 
+// Reply to errors raised while handling a request
+const replyError = (res, error) => {
+    console.error("Error processing request:", error.message);
+    if (error instanceof SyntaxError) {
+        reply(res, false, { message: "Invalid JSON in request body." })
+    } else if (error instanceof PayloadTooLargeError) {
+        reply(res, false, { message: error.message }, 413)
+    } else if (error instanceof WorkerTimeoutError) {
+        reply(res, false, { message: error.message })
+    } else if (error instanceof WorkerPoolUnavailableError || error instanceof WorkerPoolBusyError) {
+        reply(res, false, { message: error.message }, 503)
+    } else {
+        reply(res, false, { message: "Internal Server Error" })
+    }
+}
+
+// Milliseconds since start, reported as "eval_time" so the core server can tell linting and network time apart
+const elapsed = (start) => Math.round((performance.now() - start) * 1000) / 1000;
+
+// Lint the pac content in the worker pool, see worker.js
+const lintPac = async (pacContent) => {
+    const hash = crypto.createHash('sha256').update(pacContent).digest('hex');
+    let result = resultCache.get(hash);
+    if (!result) {
+        result = await pool.run({ pac: pacContent }, lintTimeout);
+        resultCache.set(hash, result);
+    }
+    return result;
+}
+
 // Create the server using native Node.js
 const server = http.createServer(async (req, res) => {
     if (req.method === "GET" && req.url === "/up") {
         // Respond to /up route with JSON
-        reply(res, true, { message: "Server is up and running!" })
+        // the server is down if its workers can't start, so the core server stops sending requests
+        if (pool.healthy) {
+            reply(res, true, { message: "Server is up and running!" })
+        } else {
+            reply(res, false, { message: "Workers failed to start." }, 503)
+        }
     } else if (req.method === "POST" && req.url === "/") {
         try {
             const body = await parseRequestBody(req);
@@ -49,26 +119,38 @@ const server = http.createServer(async (req, res) => {
                 return;
             }
 
-            const results = await eslint.lintText(body.pac.content);
-            const formatted = results[0].messages.filter(x => x.severity >= 2).map(m => `${m.line}:${m.column} ${m.message} (${m.ruleId})`);
+            const start = performance.now();
+            const result = await lintPac(body.pac.content);
 
             // Respond with the results as JSON
-            if (formatted.length > 0) {
-                reply(res, false, {
-                    message: formatted.join('\n'),
-                    error_code: formatted.length,
-                    error: `${formatted.length} syntax errors found.`,
-                })
-            } else {
-                reply(res, true, { message: "No Problems Found" })
-            }
+            reply(res, result.status === 'success', { ...result, eval_time: elapsed(start) })
         } catch (error) {
-            console.error("Error processing request:", error.message);
-            if (error instanceof SyntaxError) {
-                reply(res, false, { message: "Invalid JSON in request body." })
-            } else {
-                reply(res, false, { message: "Internal Server Error" })
+            replyError(res, error)
+        }
+    } else if (req.method === "POST" && req.url === "/batch") {
+        try {
+            const body = await parseRequestBody(req);
+
+            // Validate that the "pac_content" field exists in the request body
+            if (!body.pac || !body.pac.content) {
+                reply(res, false, { message: "Request body must contain a 'pac.content' field." })
+                return;
             }
+
+            // Validate that the "cases" field exists in the request body
+            if (!Array.isArray(body.cases)) {
+                reply(res, false, { message: "Request body must contain a 'cases' field, which is an array." })
+                return;
+            }
+
+            // linting only depends on the pac, so lint once and reuse the result for every case
+            const start = performance.now();
+            const result = await lintPac(body.pac.content);
+
+            // Respond with the results as JSON
+            reply(res, true, { results: body.cases.map(() => result), eval_time: elapsed(start) })
+        } catch (error) {
+            replyError(res, error)
         }
     } else {
         // Handle unknown routes
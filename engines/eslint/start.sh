@@ -1,6 +1,10 @@
 #!/bin/bash
 
-echo "Starting eslint engine..."
+# additional instances listen on the base port plus a multiple of 100
+# keep in sync with INSTANCE_PORT_STEP of the core server
+export PORT=$((8083 + 100 * ${INSTANCE:-0}))
+
+echo "Starting eslint engine on port $PORT..."
 
 npm start &
 PID=$!
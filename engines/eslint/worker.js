@@ -0,0 +1,33 @@
+import { Linter } from "eslint";
+import { parentPort } from "worker_threads";
+import config from "./eslint.config.js";
+
+// This file runs inside the worker threads of the WorkerPool, and does the actual linting of PACs
+
+// the config is loaded once per worker, and the Linter works on the content only
+// so no config resolution or file system lookups happen per request
+const linter = new Linter({ configType: "flat" });
+
+// Lint the pac content and convert the eslint messages into an engine result
+const lintPac = (pacContent) => {
+    const messages = linter.verify(pacContent, config, { filename: "pac.js" });
+    const formatted = messages.filter(x => x.severity >= 2).map(m => `${m.line}:${m.column} ${m.message} (${m.ruleId})`);
+
+    if (formatted.length > 0) {
+        return {
+            status: 'failed',
+            message: formatted.join('\n'),
+            error_code: formatted.length,
+            error: `${formatted.length} syntax errors found.`,
+        };
+    }
+    return { status: 'success', message: "No Problems Found" };
+}
+
+// Tasks are sent by the WorkerPool, every task gets exactly one reply with the same id
+parentPort.on('message', ({ id, pac }) => {
+    parentPort.postMessage({ id, result: lintPac(pac) });
+});
+
+// everything is loaded, so the WorkerPool can send tasks
+parentPort.postMessage({ ready: true });
@@ -0,0 +1,64 @@
+// Shared by the v8 and eslint engine
+/**
+ * Simple LRU cache, based on the insertion order of a Map.
+ * Every get moves the entry to the end, and the first entry gets evicted when the cache is full.
+ */
+export class LRUCache {
+    constructor(maxSize) {
+        this.maxSize = maxSize;
+        this.entries = new Map();
+    }
+
+    get(key) {
+        if (!this.entries.has(key)) return undefined;
+        const value = this.entries.get(key);
+        // re-insert to mark as most recently used
+        this.entries.delete(key);
+        this.entries.set(key, value);
+        return value;
+    }
+
+    set(key, value) {
+        if (this.maxSize <= 0) return;
+        this.entries.delete(key);
+        this.entries.set(key, value);
+        if (this.entries.size > this.maxSize) {
+            this.entries.delete(this.entries.keys().next().value);
+        }
+    }
+
+    delete(key) {
+        this.entries.delete(key);
+    }
+
+    get size() {
+        return this.entries.size;
+    }
+}
+
+/**
+ * Bounded cache without any bookkeeping on reads, the oldest entry gets evicted when the cache is full.
+ * Used for hot lookups (e.g. once per helper call inside a PAC), where moving entries on every get would cost too much.
+ */
+export class BoundedCache {
+    constructor(maxSize) {
+        this.maxSize = maxSize;
+        this.entries = new Map();
+    }
+
+    get(key) {
+        return this.entries.get(key);
+    }
+
+    set(key, value) {
+        if (this.maxSize <= 0) return;
+        if (!this.entries.has(key) && this.entries.size >= this.maxSize) {
+            this.entries.delete(this.entries.keys().next().value);
+        }
+        this.entries.set(key, value);
+    }
+
+    get size() {
+        return this.entries.size;
+    }
+}
@@ -0,0 +1,155 @@
+// Shared by the v8 and eslint engine
+import { Worker } from 'worker_threads';
+
+/**
+ * Error used if a worker did not finish a task in time, and was terminated
+ */
+export class WorkerTimeoutError extends Error {}
+
+/**
+ * Error used if the workers of a pool keep failing to start (e.g. a missing module), so the pool can't run any task
+ * the engines reply with 503, and report themselves as down via /up
+ */
+export class WorkerPoolUnavailableError extends Error {}
+
+/**
+ * Error used if a task was rejected since the queue of the pool is full, or it waited too long for an idle worker
+ * the engines reply with 503, like the core server does if its own queue is full
+ */
+export class WorkerPoolBusyError extends Error {}
+
+// delay (in ms) before respawning a worker that failed to start, doubled on every consecutive failure up to the max
+const RESPAWN_DELAY = 100;
+const MAX_RESPAWN_DELAY = 10000;
+// consecutive startup failures after which the pool is unhealthy
+const MAX_STARTUP_FAILURES = 5;
+
+/**
+ * Pool of worker threads, every worker handles a single task at a time.
+ * Tasks are queued until a worker is idle, at most maxQueue tasks, for at most queueTimeout ms each.
+ * If a worker does not reply within the timeout of its task, it is terminated and replaced by a new worker,
+ * so a stuck task can never block the pool.
+ * Workers post { ready: true } once they are loaded, and only get tasks after that.
+ * Workers that die before they are ready are respawned with an exponential backoff,
+ * after MAX_STARTUP_FAILURES consecutive failures the pool is unhealthy and rejects all tasks, until a worker starts again.
+ */
+export class WorkerPool {
+    // taskName is used in the error of tasks that timed out, e.g. 'PAC evaluation'
+    // maxQueue and queueTimeout (in ms) limit the tasks waiting for an idle worker, see WorkerPoolBusyError
+    constructor(file, size, taskName, { maxQueue = 128, queueTimeout = 5000 } = {}) {
+        this.file = file;
+        this.size = size;
+        this.taskName = taskName;
+        this.maxQueue = maxQueue;
+        this.queueTimeout = queueTimeout;
+        this.nextId = 0;
+        // tasks waiting for an idle worker
+        this.queue = [];
+        // all workers, every entry is { worker, task, ready }, task is null if the worker is idle
+        // worker is null while waiting for a respawn
+        this.workers = [];
+        // consecutive workers that died before they were ready
+        this.startupFailures = 0;
+        this.healthy = true;
+        for (let i = 0; i < size; i++) {
+            this.workers.push(this.spawn());
+        }
+    }
+
+    spawn() {
+        const entry = { worker: new Worker(this.file), task: null, ready: false };
+        entry.worker.on('message', ({ id, result, ready }) => {
+            if (ready) {
+                entry.ready = true;
+                this.startupFailures = 0;
+                this.healthy = true;
+                this.dispatch();
+                return;
+            }
+            const task = entry.task;
+            if (!task || task.id !== id) return;
+            clearTimeout(task.timer);
+            entry.task = null;
+            task.resolve(result);
+            this.dispatch();
+        });
+        entry.worker.on('error', (err) => this.replace(entry, err));
+        entry.worker.on('exit', () => this.replace(entry, new Error('Worker exited unexpectedly')));
+        return entry;
+    }
+
+    // Replace a dead or stuck worker, failing the task it was working on
+    // a worker that died before it was ready is respawned after a delay, see the class comment
+    replace(entry, err) {
+        const index = this.workers.indexOf(entry);
+        if (index === -1) return;
+        const task = entry.task;
+        if (task) clearTimeout(task.timer);
+        entry.worker.removeAllListeners();
+        // errors of the old worker are not relevant anymore
+        entry.worker.on('error', () => {});
+        entry.worker.terminate();
+        if (entry.ready) {
+            this.workers[index] = this.spawn();
+        } else {
+            this.startupFailures++;
+            console.error(`Worker failed to start (${this.startupFailures} times in a row):`, err.message);
+            if (this.startupFailures >= MAX_STARTUP_FAILURES && this.healthy) {
+                this.healthy = false;
+                const queue = this.queue;
+                this.queue = [];
+                for (const queued of queue) {
+                    clearTimeout(queued.timer);
+                    queued.reject(new WorkerPoolUnavailableError(`Workers failed to start: ${err.message}`));
+                }
+            }
+            const delay = Math.min(RESPAWN_DELAY * 2 ** (this.startupFailures - 1), MAX_RESPAWN_DELAY);
+            const waiting = { worker: null, task: null, ready: false };
+            this.workers[index] = waiting;
+            setTimeout(() => {
+                this.workers[this.workers.indexOf(waiting)] = this.spawn();
+            }, delay);
+        }
+        if (task) task.reject(err);
+        this.dispatch();
+    }
+
+    // Run a task on the next idle worker, the returned promise is rejected if the task took longer than timeout (in ms)
+    run(message, timeout) {
+        return new Promise((resolve, reject) => {
+            if (!this.healthy) {
+                reject(new WorkerPoolUnavailableError(`${this.taskName} is unavailable, the workers failed to start`));
+                return;
+            }
+            if (this.queue.length >= this.maxQueue) {
+                reject(new WorkerPoolBusyError(`${this.taskName} is busy, ${this.queue.length} tasks are queued already`));
+                return;
+            }
+            const task = { id: this.nextId++, message, timeout, resolve, reject };
+            // the client gave up on tasks that waited too long, so they are dropped instead of blocking the workers
+            task.timer = setTimeout(() => {
+                this.queue.splice(this.queue.indexOf(task), 1);
+                reject(new WorkerPoolBusyError(`${this.taskName} waited more than ${this.queueTimeout}ms for an idle worker`));
+            }, this.queueTimeout);
+            this.queue.push(task);
+            this.dispatch();
+        });
+    }
+
+    dispatch() {
+        for (const entry of this.workers) {
+            if (this.queue.length === 0) return;
+            if (entry.task || !entry.ready) continue;
+
+            const task = this.queue.shift();
+            clearTimeout(task.timer);
+            entry.task = task;
+            // the timeout starts once a worker picked up the task, the time spent in the queue is limited by queueTimeout
+            task.timer = setTimeout(
+                () => this.replace(entry, new WorkerTimeoutError(`${this.taskName} did not finish within ${task.timeout}ms`)),
+                task.timeout,
+            );
+            entry.worker.postMessage({ id: task.id, ...task.message });
+        }
+    }
+}
@@ -0,0 +1,104 @@
+import fs from 'fs';
+import path from 'path';
+import vm from 'vm';
+import { buildPredefinedFuncs } from './util.js';
+
+// Micro-benchmark of the PAC helper functions
+// evaluates the example PACs (and a generated PAC with many shExpMatch / isInNet rules)
+// once with the helpers of util.js, and once with the previous helpers, which parse their patterns on every call
+// usage: node bench.js [iterations] [rounds]
+
+const iterations = Number(process.argv[2] || 2000);
+const rounds = Number(process.argv[3] || 5);
+const root = path.resolve(path.dirname(new URL(import.meta.url).pathname), '../..');
+
+// helpers as they were before the pattern caches, used as baseline
+const uncachedFuncs = (src_ip) => {
+    const funcs = buildPredefinedFuncs(src_ip);
+    return Object.assign(funcs, {
+        shExpMatch: (url, pattern) => {
+            pattern = pattern.replace(/\./g, '\\.');
+            pattern = pattern.replace(/\*/g, '.*');
+            pattern = pattern.replace(/\?/g, '.');
+            var newRe = new RegExp('^' + pattern + '$');
+            return newRe.test(url);
+        },
+        isInNet: (ipaddr, pattern, maskstr) => {
+            if (!funcs.isValidIpAddress(pattern) || !funcs.isValidIpAddress(maskstr)) {
+                return false;
+            }
+            if (!funcs.isValidIpAddress(ipaddr)) {
+                ipaddr = funcs.dnsResolve(ipaddr);
+                if (ipaddr == null) {
+                    return false;
+                }
+            }
+            var host = funcs.convert_addr(ipaddr);
+            var pat = funcs.convert_addr(pattern);
+            var mask = funcs.convert_addr(maskstr);
+            return (host & mask) == (pat & mask);
+        },
+    });
+}
+
+// PAC in the style of larger real world PACs, with a long list of shExpMatch and isInNet rules
+const generatedPac = () => {
+    const rules = [];
+    for (let i = 0; i < 200; i++) {
+        rules.push(`    if (shExpMatch(host, "*.domain${i}.example.com")) return "PROXY proxy${i % 4}:8080";`);
+        rules.push(`    if (isInNet(host, "10.${i}.0.0", "255.255.0.0")) return "DIRECT";`);
+    }
+    return `function FindProxyForURL(url, host) {\n${rules.join('\n')}\n    return "PROXY default:8080";\n}\n`;
+}
+
+const loadPacs = () => {
+    const pacs = { 'generated (400 rules)': generatedPac(), 'example.pac': fs.readFileSync(path.join(root, 'example.pac'), 'utf-8') };
+    const dir = path.join(root, 'example/pacs');
+    for (const sub of fs.readdirSync(dir)) {
+        for (const file of fs.readdirSync(path.join(dir, sub))) {
+            pacs[`example/pacs/${sub}/${file}`] = fs.readFileSync(path.join(dir, sub, file), 'utf-8');
+        }
+    }
+    return pacs;
+}
+
+const hosts = ['www.example.com', 'google.com', 'heise.com', 'a.domain150.example.com', '10.199.1.1', 'unknown.org'];
+
+// every measurement runs for at least this long, fast PACs would otherwise only measure timer and GC noise
+const minDuration = 50n * 1000000n;
+
+const evaluate = (ctx, count) => {
+    for (let i = 0; i < count; i++) {
+        const host = hosts[i % hosts.length];
+        ctx.FindProxyForURL('https://' + host + '/', host);
+    }
+}
+
+const run = (pacContent, funcs) => {
+    const ctx = vm.createContext(funcs('192.168.1.1'));
+    new vm.Script(pacContent).runInContext(ctx);
+    // every round uses a fresh context, so warm up the JIT first, otherwise the compilation of FindProxyForURL is measured
+    evaluate(ctx, iterations);
+    let count = 0;
+    const start = process.hrtime.bigint();
+    do {
+        evaluate(ctx, iterations);
+        count += iterations;
+    } while (process.hrtime.bigint() - start < minDuration);
+    // microseconds per evaluation
+    return Number(process.hrtime.bigint() - start) / 1000 / count;
+}
+
+console.log(`at least ${iterations} evaluations (after as many to warm up) and ${minDuration / 1000000n}ms per PAC, best of ${rounds} rounds, µs per evaluation`);
+const rows = Object.entries(loadPacs()).map(([name, content]) => {
+    // alternate both variants and keep the best round, so neither JIT warm-up nor GC pauses skew the result
+    let before = Infinity, after = Infinity;
+    for (let round = 0; round < rounds; round++) {
+        before = Math.min(before, run(content, uncachedFuncs));
+        after = Math.min(after, run(content, buildPredefinedFuncs));
+    }
+    // PACs without any calls of the cached helpers can't get faster, their speedup shows the noise of the measurement
+    const helperCalls = (content.match(/\b(?:shExpMatch|isInNet)\s*\(/g) || []).length;
+    return { pac: name, helpers: helperCalls, uncached: before.toFixed(2), cached: after.toFixed(2), speedup: (before / after).toFixed(1) + 'x' };
+});
+console.table(rows);
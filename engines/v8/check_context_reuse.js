@@ -0,0 +1,62 @@
+import { WorkerPool } from '../shared/pool.js';
+
+// Checks that reusing contexts never changes the result of an evaluation
+// most PACs below keep some kind of state, so they have to return the same proxy as in a fresh context,
+// no matter how often they were evaluated before, and whether they are evaluated on their own or in a batch
+// the others keep their state in a closure, which is not detected, to check that their contexts are actually reused
+// a single worker is used, so every evaluation hits the same caches
+// usage: node check_context_reuse.js
+
+const counterPac = (setup, increment, counter) => `${setup}
+function FindProxyForURL(url, host) {
+    ${increment};
+    return 'PROXY p' + ${counter};
+}`;
+
+const cases = {
+    'object global': counterPac('var seen = { n: 0 };', 'seen.n++', 'seen.n'),
+    'array global': counterPac('var seen = [];', 'seen.push(host)', 'seen.length'),
+    'primitive global': counterPac('var seen = 0;', 'seen++', 'seen'),
+    'Math property': counterPac('', 'Math.cnt = (Math.cnt || 0) + 1', 'Math.cnt'),
+    'String.prototype property': counterPac('', "String.prototype.cnt = (''.cnt || 0) + 1", "''.cnt"),
+    'object added to a builtin at top-level': counterPac('JSON.seen = { n: 0 };', 'JSON.seen.n++', 'JSON.seen.n'),
+    'replaced builtin': counterPac('', 'var max = Math.max; Math.max = function () { return max.apply(null, arguments) + 1; }', 'Math.max(0)'),
+    'stateless, with a polyfill': counterPac("String.prototype.twice = function () { return this + this; };", '', "'1'.twice()"),
+    'top-level let': counterPac('let seen = 0;', 'seen++', 'seen'),
+    'top-level const object': counterPac('const other = 1, seen = { n: 0 };', 'seen.n++', 'seen.n'),
+    'top-level class': counterPac('class Seen {}', 'Seen.n = (Seen.n || 0) + 1', 'Seen.n'),
+    'let inside a function (reused)': counterPac('var next = (function () { let n = 0; return function () { return ++n; }; })();', '', 'next()'),
+    'top-level const and function (reused)': counterPac('const prefix = "p"; let next = (() => { let n = 0; return () => ++n; })();', '', 'next()'),
+    'Date in comments and strings (reused)': counterPac('// no Date here\nvar next = (function () { var n = 0; return function () { return ++n; }; })();', "'Date'", 'next()'),
+};
+// the results of the reused contexts count up, the batch is evaluated in the context of the single evaluations
+const reused = ['p1', 'p2', 'p3', 'p4', 'p5', 'p6'];
+const expected = {
+    'replaced builtin': 'p1',
+    'stateless, with a polyfill': 'p11',
+    'let inside a function (reused)': reused,
+    'top-level const and function (reused)': reused,
+    'Date in comments and strings (reused)': reused,
+};
+
+const pool = new WorkerPool(new URL('./worker.js', import.meta.url), 1, 'PAC evaluation');
+const hosts = ['a.example.com', 'b.example.com', 'c.example.com'];
+let failed = 0;
+
+for (const [name, pac] of Object.entries(cases)) {
+    const want = expected[name] || 'p1';
+    const results = [];
+    for (const dest_host of hosts) {
+        const result = await pool.run({ type: 'eval', pac, cases: [{ dest_host, src_ip: '10.0.0.1' }] }, 5000);
+        results.push(result.proxy || result.message);
+    }
+    const batch = await pool.run({ type: 'batch', pac, cases: hosts.map(dest_host => ({ dest_host, src_ip: '10.0.0.1' })) }, 5000);
+    results.push(...batch.results.map(result => result.proxy || result.message));
+
+    const passed = Array.isArray(want) ? results.join() === want.join() : results.every(result => result === want);
+    if (!passed) failed++;
+    const description = Array.isArray(want) ? want.join(', ') : `${want} every time`;
+    console.log(`${passed ? 'PASS' : 'FAIL'}: ${name} (expected ${description}, got ${results.join(', ')})`);
+}
+
+process.exit(failed > 0 ? 1 : 0);
@@ -0,0 +1,153 @@
+// Scans the top-level code of a PAC, without a full parser, so the worker knows which state it has to capture:
+// - names: the top-level let, const and class bindings, which are not properties of the global object
+// - usesDate: whether the code (not comments or strings) references Date
+// returns null if the PAC can't be scanned reliably, e.g. for destructuring declarations or unbalanced brackets
+// a misdetected name is harmless, the worker just can't read it and treats the PAC as stateful
+
+// keywords after which a / starts a regular expression instead of a division
+const KEYWORDS_BEFORE_EXPRESSION = new Set([
+    'return', 'typeof', 'instanceof', 'in', 'of', 'new', 'delete', 'void', 'throw', 'case', 'do', 'else', 'yield', 'await',
+]);
+
+// character checks on char codes, since the scanner looks at every character of the PAC
+const isDigit = (code) => code >= 48 && code <= 57;
+const isIdentifierStart = (code) => (code >= 65 && code <= 90) || (code >= 97 && code <= 122) || code === 95 || code === 36 || code > 0x7f;
+const isIdentifierPart = (code) => isIdentifierStart(code) || isDigit(code);
+const isWhitespace = (code) => code === 32 || (code >= 9 && code <= 13) || code === 0xa0 || code === 0xfeff || code === 0x2028 || code === 0x2029;
+
+export const scanPac = (source) => {
+    const names = [];
+    let usesDate = false;
+    // depth of (), [] and {}, only declarations at depth 0 are top-level
+    let depth = 0;
+    // depths at which the ${ } of a template literal were opened, the template continues once its } closes
+    const templates = [];
+    // previous significant token: { type: 'identifier' | 'number' | 'string' | 'regex' | 'punctuator', value }
+    let prev = null;
+    // let, const or class at depth 0, waiting for the name of the binding
+    let pending = null;
+    // inside the declarators of a top-level let or const, where a name follows every comma
+    let declaring = false;
+    let i = 0;
+
+    // skip a string or the rest of a template literal, returns false if it is unterminated
+    const skipQuoted = (quote) => {
+        while (i < source.length) {
+            const ch = source[i++];
+            if (ch === '\\') {
+                i++;
+            } else if (ch === quote) {
+                return true;
+            } else if (quote === '`' && ch === '$' && source[i] === '{') {
+                i++;
+                templates.push(depth);
+                depth++;
+                return true;
+            }
+        }
+        return false;
+    }
+
+    // skip a regular expression literal including its flags, returns false if it is unterminated
+    const skipRegExp = () => {
+        let inClass = false;
+        while (i < source.length) {
+            const ch = source[i++];
+            if (ch === '\\') {
+                i++;
+            } else if (ch === '\n') {
+                return false;
+            } else if (ch === '[') {
+                inClass = true;
+            } else if (ch === ']') {
+                inClass = false;
+            } else if (ch === '/' && !inClass) {
+                while (i < source.length && isIdentifierPart(source.charCodeAt(i))) i++;
+                return true;
+            }
+        }
+        return false;
+    }
+
+    const regExpAllowed = () => prev === null
+        || (prev.type === 'punctuator' && prev.value !== ')' && prev.value !== ']')
+        || (prev.type === 'identifier' && KEYWORDS_BEFORE_EXPRESSION.has(prev.value));
+
+    while (i < source.length) {
+        const ch = source[i];
+        const code = source.charCodeAt(i);
+        if (isWhitespace(code)) {
+            i++;
+            continue;
+        }
+        if (ch === '/' && source[i + 1] === '/') {
+            const end = source.indexOf('\n', i);
+            i = end === -1 ? source.length : end;
+            continue;
+        }
+        if (ch === '/' && source[i + 1] === '*') {
+            const end = source.indexOf('*/', i + 2);
+            if (end === -1) return null;
+            i = end + 2;
+            continue;
+        }
+
+        let token;
+        if (ch === '"' || ch === "'" || ch === '`') {
+            i++;
+            if (!skipQuoted(ch)) return null;
+            token = { type: 'string', value: ch };
+        } else if (ch === '}' && templates.length > 0 && templates[templates.length - 1] === depth - 1) {
+            // end of a ${ } inside a template literal
+            templates.pop();
+            depth--;
+            i++;
+            if (!skipQuoted('`')) return null;
+            token = { type: 'string', value: '`' };
+        } else if (ch === '/' && regExpAllowed()) {
+            i++;
+            if (!skipRegExp()) return null;
+            token = { type: 'regex', value: '/' };
+        } else if (isIdentifierStart(code)) {
+            const start = i;
+            while (i < source.length && isIdentifierPart(source.charCodeAt(i))) i++;
+            token = { type: 'identifier', value: source.slice(start, i) };
+        } else if (isDigit(code) || (ch === '.' && isDigit(source.charCodeAt(i + 1)))) {
+            while (i < source.length && (isIdentifierPart(source.charCodeAt(i)) || source[i] === '.')) i++;
+            token = { type: 'number', value: ch };
+        } else {
+            i++;
+            if ('([{'.includes(ch)) depth++;
+            if (')]}'.includes(ch)) depth--;
+            if (depth < 0) return null;
+            token = { type: 'punctuator', value: ch };
+        }
+
+        const afterDot = prev !== null && prev.type === 'punctuator' && prev.value === '.';
+        if (pending !== null) {
+            if (token.type === 'identifier') {
+                names.push(token.value);
+                declaring = pending !== 'class';
+            } else if (pending !== 'class' && token.type === 'punctuator' && (token.value === '[' || token.value === '{')) {
+                // destructuring declarations are not supported
+                return null;
+            }
+            // otherwise let was used as a plain identifier (sloppy mode), or the class is anonymous
+            pending = null;
+        } else if (token.type === 'identifier' && depth === 0 && !afterDot
+            && (token.value === 'let' || token.value === 'const' || token.value === 'class')) {
+            pending = token.value;
+            declaring = false;
+        } else if (declaring && depth === 0 && token.type === 'punctuator' && token.value === ',') {
+            pending = 'let';
+        } else if (declaring && depth === 0 && token.type === 'punctuator' && token.value === ';') {
+            declaring = false;
+        }
+        if (token.type === 'identifier' && token.value === 'Date' && !afterDot) {
+            usesDate = true;
+        }
+        prev = token;
+    }
+
+    return depth === 0 && templates.length === 0 ? { names, usesDate } : null;
+}
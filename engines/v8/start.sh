@@ -1,6 +1,10 @@
 #!/bin/bash
 
-echo "Starting v8 engine..."
+# additional instances listen on the base port plus a multiple of 100
+# keep in sync with INSTANCE_PORT_STEP of the core server
+export PORT=$((8081 + 100 * ${INSTANCE:-0}))
+
+echo "Starting v8 engine on port $PORT..."
 
 npm start &
 PID=$!
@@ -1,3 +1,103 @@
+import { BoundedCache } from '../shared/cache.js';
+
+// PACs call shExpMatch and isInNet over and over with the same handful of literal patterns
+// so the parsed patterns are cached per process, instead of parsing them on every call
+// pattern -> RegExp
+const shExpCache = new BoundedCache(Number(process.env.SHEXP_CACHE_SIZE || 1000));
+// "pattern/mask" -> { pat, mask } with both converted to numbers, or null if the pattern or mask is invalid
+const netCache = new BoundedCache(Number(process.env.NET_CACHE_SIZE || 1000));
+
+const shExpRegExp = (pattern) => {
+    let re = shExpCache.get(pattern);
+    if (re === undefined) {
+        let source = pattern.replace(/\./g, '\\.');
+        source = source.replace(/\*/g, '.*');
+        source = source.replace(/\?/g, '.');
+        re = new RegExp('^' + source + '$');
+        shExpCache.set(pattern, re);
+    }
+    return re;
+}
+
+const parseNet = (pattern, maskstr) => {
+    const key = pattern + '/' + maskstr;
+    let net = netCache.get(key);
+    if (net === undefined) {
+        net = (predefinedFuncs.isValidIpAddress(pattern) && predefinedFuncs.isValidIpAddress(maskstr))
+            ? { pat: predefinedFuncs.convert_addr(pattern), mask: predefinedFuncs.convert_addr(maskstr) }
+            : null;
+        netCache.set(key, net);
+    }
+    return net;
+}
+
+// Environment of the current evaluation, set via setEnvironment before PAC code runs
+// - dns: resolver table (hostname -> IP, or null if unresolvable), if null the dummy resolver is used
+// - clock: fixed time ({ timestamp in ms, utc_offset in minutes used as local time }), if null the time functions return false,
+//   so results don't depend on the real clock, and can be cached
+// a worker only evaluates a single PAC at a time, so a module level variable is enough
+let environment = { dns: null, clock: null };
+// JSON of a dns override -> resolver table, so batches sharing the same override only build it once
+const resolverCache = new BoundedCache(Number(process.env.RESOLVER_CACHE_SIZE || 100));
+
+export const setEnvironment = (dns, clock) => {
+    let table = null;
+    if (dns) {
+        const key = JSON.stringify(dns);
+        table = resolverCache.get(key);
+        if (table === undefined) {
+            table = new Map(Object.entries(dns).map(([host, ip]) => [host.toLowerCase(), ip]));
+            resolverCache.set(key, table);
+        }
+    }
+    environment = { dns: table, clock: clock || null };
+}
+
+const WEEKDAYS = ['SUN', 'MON', 'TUE', 'WED', 'THU', 'FRI', 'SAT'];
+const MONTHS = ['JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN', 'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC'];
+
+// Get the time of the clock override, split into the fields used by the time functions of PACs
+const clockFields = (gmt) => {
+    // shift the timestamp by the offset, so the UTC getters return the local time of the clock
+    const date = new Date(environment.clock.timestamp + (gmt ? 0 : (environment.clock.utc_offset || 0) * 60000));
+    return {
+        year: date.getUTCFullYear(),
+        month: date.getUTCMonth(),
+        day: date.getUTCDate(),
+        weekday: date.getUTCDay(),
+        seconds: date.getUTCHours() * 3600 + date.getUTCMinutes() * 60 + date.getUTCSeconds(),
+    };
+}
+
+// Split off the optional "GMT" argument of the time functions
+const splitGmt = (args) => {
+    const gmt = args.length > 0 && args[args.length - 1] === 'GMT';
+    return [gmt ? args.slice(0, -1) : args, gmt];
+}
+
+// Check if value is within start and end (both inclusive), ranges with start after end wrap around
+const inRange = (value, start, end) => {
+    return start <= end ? (start <= value && value <= end) : (value >= start || value <= end);
+}
+
+// Compare two arrays of numbers lexicographically
+const compareFields = (a, b) => {
+    for (let i = 0; i < a.length; i++) {
+        if (a[i] !== b[i]) return a[i] < b[i] ? -1 : 1;
+    }
+    return 0;
+}
+
+// Parse an argument of dateRange into its field, numbers up to 31 are days, larger numbers are years
+const parseDateArg = (arg) => {
+    const month = MONTHS.indexOf(String(arg).toUpperCase());
+    if (month !== -1) return { field: 'month', value: month };
+    const number = Number(arg);
+    if (!Number.isInteger(number) || number < 1) return null;
+    return number <= 31 ? { field: 'day', value: number } : { field: 'year', value: number };
+}
+const DATE_FIELDS = ['year', 'month', 'day'];
+
 // Object for use as global context that includes all functions that can be used inside a PAC script
 /* eslint-disable no-undef */
 const predefinedFuncs = {
@@ -26,7 +126,8 @@ const predefinedFuncs = {
         return true;
     },
     isInNet: (ipaddr, pattern, maskstr) => {
-        if (!predefinedFuncs.isValidIpAddress(pattern) || !predefinedFuncs.isValidIpAddress(maskstr)) {
+        var net = parseNet(pattern, maskstr);
+        if (net === null) {
             return false;
         }
         if (!predefinedFuncs.isValidIpAddress(ipaddr)) {
@@ -36,9 +137,7 @@ const predefinedFuncs = {
             }
         }
         var host = predefinedFuncs.convert_addr(ipaddr);
-        var pat = predefinedFuncs.convert_addr(pattern);
-        var mask = predefinedFuncs.convert_addr(maskstr);
-        return (host & mask) == (pat & mask);
+        return (host & net.mask) == (net.pat & net.mask);
     },
     isPlainHostName: (host) => {
         return host.search('\\.') == -1;
@@ -47,19 +146,86 @@ const predefinedFuncs = {
         return (host == hostdom) || (hostdom.lastIndexOf(host + '.', 0) === 0);
     },
     shExpMatch: (url, pattern) => {
-        pattern = pattern.replace(/\./g, '\\.');
-        pattern = pattern.replace(/\*/g, '.*');
-        pattern = pattern.replace(/\?/g, '.');
-        var newRe = new RegExp('^' + pattern + '$');
-        return newRe.test(url);
+        return shExpRegExp(pattern).test(url);
+    },
+    // without a dns override, every host resolves to a dummy IP (but is reported as not resolvable)
+    isResolvable: (host) => {
+        return environment.dns !== null && predefinedFuncs.dnsResolve(host) !== null;
+    },
+    dnsResolve: (host) => {
+        if (predefinedFuncs.isValidIpAddress(host)) {
+            return host;
+        }
+        if (environment.dns === null) {
+            return '1.1.1.1';
+        }
+        const ip = environment.dns.get(String(host).toLowerCase());
+        return ip === undefined ? null : ip;
     },
-    // dummy
-    isResolvable: () => false,
-    dnsResolve: () => '1.1.1.1',
+    // dummy, overwritten per src_ip in buildPredefinedFuncs
     myIpAddress: () => '1.1.1.1',
-    weekdayRange: () => false,
-    dateRange: () => false,
-    timeRange: () => false,
+    // weekdayRange(wd1 [, wd2] [, "GMT"])
+    weekdayRange: (...args) => {
+        const [days, gmt] = splitGmt(args);
+        if (days.length < 1 || days.length > 2) return false;
+        const [start, end] = days.map(day => WEEKDAYS.indexOf(String(day).toUpperCase()));
+        if (start === -1 || end === -1 || !environment.clock) return false;
+        return inRange(clockFields(gmt).weekday, start, end === undefined ? start : end);
+    },
+    // dateRange(day | month | year [, "GMT"]), or a range of the same fields, e.g. dateRange(1, "JUN", 15, "AUG")
+    dateRange: (...args) => {
+        const [dateArgs, gmt] = splitGmt(args);
+        const parsed = dateArgs.map(parseDateArg);
+        if (parsed.length === 0 || parsed.length > 6 || parsed.includes(null) || !environment.clock) return false;
+        const now = clockFields(gmt);
+
+        if (parsed.length === 1) {
+            return now[parsed[0].field] === parsed[0].value;
+        }
+        if (parsed.length % 2 !== 0) return false;
+
+        // both ends of the range must consist of the same, distinct fields
+        const half = parsed.length / 2;
+        const startArgs = parsed.slice(0, half);
+        const endArgs = parsed.slice(half);
+        const fields = DATE_FIELDS.filter(f => startArgs.some(arg => arg.field === f));
+        if (fields.length !== half || !fields.every(f => endArgs.some(arg => arg.field === f))) return false;
+
+        const toFields = (rangeArgs) => fields.map(f => rangeArgs.find(arg => arg.field === f).value);
+        const start = toFields(startArgs);
+        const end = toFields(endArgs);
+        const current = fields.map(f => now[f]);
+        if (compareFields(start, end) > 0 && fields.includes('year')) {
+            // ranges including a year can't wrap around
+            return false;
+        }
+        return compareFields(start, end) <= 0
+            ? compareFields(start, current) <= 0 && compareFields(current, end) <= 0
+            : compareFields(current, start) >= 0 || compareFields(current, end) <= 0;
+    },
+    // timeRange(hour [, "GMT"]), timeRange(h1, h2), timeRange(h1, m1, h2, m2) or timeRange(h1, m1, s1, h2, m2, s2)
+    // the end of a range with hours or minutes is exclusive, e.g. timeRange(9, 17) ends at 17:00:00
+    timeRange: (...args) => {
+        const [timeArgs, gmt] = splitGmt(args);
+        const numbers = timeArgs.map(Number);
+        if (numbers.some(number => !Number.isInteger(number)) || !environment.clock) return false;
+        const now = clockFields(gmt).seconds;
+
+        switch (numbers.length) {
+            case 1:
+                return Math.floor(now / 3600) === numbers[0];
+            case 2:
+                return numbers[0] === numbers[1]
+                    ? Math.floor(now / 3600) === numbers[0]
+                    : inRange(now, numbers[0] * 3600, (numbers[1] * 3600 + 86399) % 86400);
+            case 4:
+                return inRange(now, numbers[0] * 3600 + numbers[1] * 60, (numbers[2] * 3600 + numbers[3] * 60 + 86399) % 86400);
+            case 6:
+                return inRange(now, numbers[0] * 3600 + numbers[1] * 60 + numbers[2], numbers[3] * 3600 + numbers[4] * 60 + numbers[5]);
+            default:
+                return false;
+        }
+    },
     alert: () => {},
 }
 /* eslint-enable no-undef */
@@ -71,12 +237,6 @@ export const buildPredefinedFuncs = (src_ip) => {
     })
 }
 
-// helper func to build a vm command to execute
-export const build_cmd = (host, url=null) => {
-    let must_url = url ? url : 'https://' + host + '/test'
-    return `test = FindProxyForURL('${must_url}', '${host}');`
-}
-
 
 const ipRegex = /^(\d{1,3}\.){3}\d{1,3}$/;
 /**
@@ -1,13 +1,35 @@
 import http from 'http';
-import vm from 'vm';
-import { buildPredefinedFuncs, build_cmd, ValidateIP, ValidateHostname } from  './util.js';
+import os from 'os';
+import { WorkerPool, WorkerPoolBusyError, WorkerPoolUnavailableError, WorkerTimeoutError } from '../shared/pool.js';
+import { ValidateIP, ValidateHostname } from  './util.js';
 
 // The port the server will run on
-const port = 8081;
+// can be overwritten, to run multiple instances of the engine
+const port = process.env.PORT || 8081;
 
-const reply = (res, success, body) => {
+// PACs are evaluated by a pool of worker threads, the main thread only handles the HTTP requests
+// requests waiting for an idle worker are limited, so an overloaded engine replies with 503 instead of piling up requests
+const pool = new WorkerPool(new URL('./worker.js', import.meta.url), Number(process.env.WORKERS || os.availableParallelism()), 'PAC evaluation', {
+    maxQueue: Number(process.env.QUEUE_SIZE || 128),
+    queueTimeout: Number(process.env.QUEUE_TIMEOUT || 5000),
+});
+
+// max time (in ms) a single run of PAC code may take, see worker.js
+const evalTimeout = Number(process.env.EVAL_TIMEOUT || 1000);
+
+// Evaluate cases against a PAC in the worker pool
+// the worker gets some extra time per case, on top of the vm timeout of the PAC code
+// if it still does not reply in time, it is stuck (e.g. in a PAC helper function) and gets replaced
+const runPool = (type, pacContent, cases) => {
+    return pool.run({ type, pac: pacContent, cases }, (cases.length + 1) * evalTimeout + 1000);
+}
+
+// Milliseconds since start, reported as "eval_time" so the core server can tell evaluation and network time apart
+const elapsed = (start) => Math.round((performance.now() - start) * 1000) / 1000;
+
+const reply = (res, success, body, statusCode = null) => {
     // Set the response HTTP header
-    res.writeHead(success ? 200 : 400, {'Content-Type': 'application/json'});
+    res.writeHead(statusCode || (success ? 200 : 400), {'Content-Type': 'application/json'});
     // Write the response content
     res.end(JSON.stringify(
         { status: success ? 'success' : 'failed', ...body }
@@ -31,11 +53,36 @@ const parseRequestBody = (req) => {
     });
 };
 
+// Pick the fields of a case, that are passed on to the worker
+const pickCase = (c) => ({ dest_host: c.dest_host, src_ip: c.src_ip, dns: c.dns, clock: c.clock });
+
+// Validate the optional dns and clock overrides of a case, returns an error message if they are invalid
+const validateOverrides = (c) => {
+    if (c.dns !== undefined && c.dns !== null) {
+        if (typeof c.dns !== 'object' || Array.isArray(c.dns)
+            || !Object.values(c.dns).every(ip => ip === null || (typeof ip === 'string' && ValidateIP(ip)))) {
+            return "The 'dns' field must map hostnames to IP addresses, or null if the hostname is unresolvable.";
+        }
+    }
+    if (c.clock !== undefined && c.clock !== null) {
+        if (typeof c.clock !== 'object' || !Number.isFinite(c.clock.timestamp)
+            || !(c.clock.utc_offset === undefined || Number.isInteger(c.clock.utc_offset))) {
+            return "The 'clock' field must contain a 'timestamp' in milliseconds, and optionally an 'utc_offset' in minutes.";
+        }
+    }
+    return null;
+}
+
 // Create the server
 const server = http.createServer(async (req, res) => {
     if (req.method === 'GET' && req.url === '/up') {
         // Respond to /up route with JSON
-        reply(res, true, { message: "Server is up and running!" })
+        // the server is down if its workers can't start, so the core server stops sending requests
+        if (pool.healthy) {
+            reply(res, true, { message: "Server is up and running!" })
+        } else {
+            reply(res, false, { message: "Workers failed to start." }, 503)
+        }
     } else if (req.method === "POST" && req.url === "/") {
         try {
             const body = await parseRequestBody(req);
@@ -58,14 +105,73 @@ const server = http.createServer(async (req, res) => {
                 return;
             }
 
-            const results = evalPac(body.pac.content, body.dest_host, body.src_ip);
+            // Validate the optional dns and clock overrides
+            const error = validateOverrides(body);
+            if (error) {
+                reply(res, false, { message: error })
+                return;
+            }
+
+            const start = performance.now();
+            const results = await runPool('eval', body.pac.content, [pickCase(body)]);
 
             // Respond with the results as JSON
-            reply(res, true, results)
+            reply(res, true, { ...results, eval_time: elapsed(start) })
         } catch (error) {
             console.error("Error processing request:", error.message);
             if (error instanceof SyntaxError) {
                 reply(res, false, { message: "Invalid JSON in request body." })
+            } else if (error instanceof WorkerTimeoutError) {
+                reply(res, false, { message: error.message })
+            } else if (error instanceof WorkerPoolUnavailableError || error instanceof WorkerPoolBusyError) {
+                reply(res, false, { message: error.message }, 503)
+            } else {
+                reply(res, false, { message: "Internal Server Error" })
+            }
+        }
+    } else if (req.method === "POST" && req.url === "/batch") {
+        try {
+            const body = await parseRequestBody(req);
+
+            // Validate that the "pac_content" field exists in the request body
+            if (!body.pac || !body.pac.content) {
+                reply(res, false, { message: "Request body must contain a 'pac.content' field." })
+                return;
+            }
+
+            // Validate that the "cases" field exists in the request body
+            if (!Array.isArray(body.cases)) {
+                reply(res, false, { message: "Request body must contain a 'cases' field, which is an array." })
+                return;
+            }
+
+            // invalid cases only fail themselves, not the whole batch
+            const cases = body.cases.map(c => {
+                if (!c.dest_host || !ValidateHostname(c.dest_host)) {
+                    return { error: "Case must contain a 'dest_host' field, which is a valid hostname." };
+                }
+                if (!c.src_ip || !ValidateIP(c.src_ip)) {
+                    return { error: "Case must contain a 'src_ip' field, which is a valid IP address." };
+                }
+                const error = validateOverrides(c);
+                if (error) {
+                    return { error };
+                }
+                return pickCase(c);
+            });
+            const start = performance.now();
+            const results = await runPool('batch', body.pac.content, cases);
+
+            // Respond with the results as JSON
+            reply(res, true, { ...results, eval_time: elapsed(start) })
+        } catch (error) {
+            console.error("Error processing request:", error.message);
+            if (error instanceof SyntaxError) {
+                reply(res, false, { message: "Invalid JSON in request body." })
+            } else if (error instanceof WorkerTimeoutError) {
+                reply(res, false, { message: error.message })
+            } else if (error instanceof WorkerPoolUnavailableError || error instanceof WorkerPoolBusyError) {
+                reply(res, false, { message: error.message }, 503)
             } else {
                 reply(res, false, { message: "Internal Server Error" })
             }
@@ -80,40 +186,3 @@ const server = http.createServer(async (req, res) => {
 server.listen(port, () => {
     console.log(`Server is listening on port :${port}`);
 });
-
-const evalPac = (pacContent, testHost, src_ip) => {
-    try {
-        const predefinedFuncs = buildPredefinedFuncs(src_ip);
-        let ctx = vm.createContext(Object.assign({}, predefinedFuncs));
-        vm.runInContext(pacContent, ctx);
-        if (typeof ctx.FindProxyForURL !== 'function') {
-            throw new Error('FindProxyForURL is not defined in PAC');
-        }
-
-        vm.runInContext(build_cmd(testHost), ctx);
-
-        // post-process returned proxy
-        let proxy = []
-        if (ctx.test && typeof ctx.test === 'string') {
-            const parts = ctx.test.trim().split(';');
-            for (let part of parts) {
-                part = part.trim();
-                if (part === "DIRECT") {
-                    proxy.push("DIRECT");
-                } else if (part.startsWith('PROXY ')) {
-                    proxy.push(part.substring(6));
-                } else if (part === "") {
-                    // do nothing / skip
-                } else{
-                    proxy.push(part);
-                }
-            }
-        } else {
-            proxy.push('<no proxy>');
-        }
-
-        return { status: 'success', proxy: proxy.join(';') };
-    } catch (err) {
-        return { status: 'failed', message: err.message };
-    }
-}
@@ -0,0 +1,343 @@
+import crypto from 'crypto';
+import vm from 'vm';
+import { parentPort } from 'worker_threads';
+import { LRUCache } from '../shared/cache.js';
+import { scanPac } from './scan.js';
+import { buildPredefinedFuncs, setEnvironment } from './util.js';
+
+// This file runs inside the worker threads of the WorkerPool, and does the actual evaluation of PACs
+// every worker has its own caches, since compiled scripts and contexts can't be shared between threads
+
+// compiled PAC scripts, keyed by the hash of the PAC content
+const scriptCache = new LRUCache(Number(process.env.SCRIPT_CACHE_SIZE || 100));
+// V8 code cache of PAC scripts, used to speed up compilation if a script was evicted from the scriptCache
+const codeCache = new LRUCache(Number(process.env.CODE_CACHE_SIZE || 1000));
+// contexts with an already evaluated PAC script, keyed by the hash of the PAC content and the src_ip
+const contextCache = new LRUCache(Number(process.env.CONTEXT_CACHE_SIZE || 200));
+
+// max time (in ms) a single run of PAC code may take, before it is interrupted
+const evalTimeout = Number(process.env.EVAL_TIMEOUT || 1000);
+
+// Calls FindProxyForURL for every host in __pac_hosts, the hosts are passed as values and never end up in source code
+// compiled once and run in the context of every PAC, errors only fail the host that caused them
+const callScript = new vm.Script(`__pac_hosts.map((host) => {
+    try {
+        return { result: FindProxyForURL('https://' + host + '/test', host) };
+    } catch (err) {
+        return { error: String(err && err.message !== undefined ? err.message : err) };
+    }
+})`, { filename: 'call.js' });
+
+// Get the compiled script for a PAC, compiling it (with the help of the code cache) if required
+const getScript = (pacContent, hash) => {
+    let script = scriptCache.get(hash);
+    if (!script) {
+        script = new vm.Script(pacContent, { filename: 'pac.js', cachedData: codeCache.get(hash) });
+        scriptCache.set(hash, script);
+    }
+    return script;
+}
+
+// hashes of PACs that changed their global state while running FindProxyForURL, or whose state can't be captured
+// these PACs get a fresh context for every evaluation
+const statefulPacs = new LRUCache(Number(process.env.CONTEXT_CACHE_SIZE || 200));
+
+// Get a script returning the top-level let, const and class bindings of a PAC, keyed by the hash of the PAC content
+// these bindings are not properties of the global object, so they are read by a script run in the context of the PAC
+// null if the state of the PAC can't be captured:
+// - the PAC can't be scanned (see scanPac)
+// - code using Date could depend on the real clock, so a reused context would keep the time it was created at
+const lexicalCache = new LRUCache(Number(process.env.SCRIPT_CACHE_SIZE || 100));
+const getLexicalScript = (pacContent, hash) => {
+    let lexicalScript = lexicalCache.get(hash);
+    if (lexicalScript === undefined) {
+        const scanned = scanPac(pacContent);
+        lexicalScript = null;
+        if (scanned !== null && !scanned.usesDate) {
+            try {
+                lexicalScript = new vm.Script(`(() => ({ ${scanned.names.join(', ')} }))`, { filename: 'lexical.js' });
+            } catch {
+                // a misdetected name, e.g. a keyword
+            }
+        }
+        lexicalCache.set(hash, lexicalScript);
+    }
+    return lexicalScript;
+}
+
+// Capture the state of a value, returns undefined if the state can't be captured,
+// e.g. for cycles, accessors or objects other than plain objects, arrays and functions
+// primitives are captured as they are, objects as { ref, keys, values } with the captured value of every enumerable property
+// ancestors holds the objects currently being captured, to detect cycles
+const captureValue = (value, ancestors) => {
+    if (value === null || (typeof value !== 'object' && typeof value !== 'function')) {
+        return value;
+    }
+    if (typeof value === 'object' && !Array.isArray(value)) {
+        // objects of the context have the Object.prototype of the context, so compare the shape instead of the prototype
+        const proto = Object.getPrototypeOf(value);
+        if (proto !== null && (Object.getPrototypeOf(proto) !== null || Object.prototype.toString.call(value) !== '[object Object]')) {
+            return undefined;
+        }
+    }
+    return captureObject(value, ancestors);
+}
+
+const captureObject = (value, ancestors) => {
+    if (ancestors.has(value)) return undefined;
+    ancestors.add(value);
+    const keys = Object.keys(value);
+    const values = new Array(keys.length);
+    for (let i = 0; i < keys.length; i++) {
+        const descriptor = Object.getOwnPropertyDescriptor(value, keys[i]);
+        if (!('value' in descriptor)) return undefined;
+        values[i] = captureValue(descriptor.value, ancestors);
+        if (values[i] === undefined && descriptor.value !== undefined) return undefined;
+    }
+    ancestors.delete(value);
+    return { ref: value, keys, values };
+}
+
+// Check whether a value still has the captured state, objects and functions must still be the same instances
+const sameValue = (value, captured) => {
+    if (captured === null || typeof captured !== 'object') {
+        return Object.is(value, captured);
+    }
+    return value === captured.ref && sameObject(value, captured);
+}
+
+// Check whether the enumerable properties of an object still have the captured state
+const sameObject = (value, captured) => {
+    const keys = Object.keys(value);
+    if (keys.length !== captured.keys.length) return false;
+    for (let i = 0; i < keys.length; i++) {
+        if (keys[i] !== captured.keys[i] || !sameValue(value[keys[i]], captured.values[i])) return false;
+    }
+    return true;
+}
+
+// builtins of a context, and their prototypes, which PACs could change, e.g. Math.counter = 1 or String.prototype.counter = 1
+const BUILTINS = [
+    'Object', 'Function', 'Array', 'Number', 'Boolean', 'String', 'Symbol', 'BigInt', 'Date', 'RegExp',
+    'Error', 'EvalError', 'RangeError', 'ReferenceError', 'SyntaxError', 'TypeError', 'URIError',
+    'Math', 'JSON', 'Reflect', 'Map', 'Set', 'WeakMap', 'WeakSet', 'Promise', 'Proxy', 'ArrayBuffer', 'DataView', 'Intl',
+];
+
+// Run in every context before the PAC is loaded, so the PAC can't shadow the builtins used here
+// returns a function, which is called once the PAC was loaded and remembers the writable properties of the builtins,
+// it returns a function that checks whether these properties still hold the same values, and returns null if not
+// otherwise it returns the enumerable properties of the builtins, which are added by assignments like Math.counter = 1
+// (builtins only have non-enumerable properties, except Error.stackTraceLimit), so their state can be captured as well
+// loops are indexed, since the PAC could replace e.g. Array.prototype.push or the array iterator
+const builtinsScript = new vm.Script(`(() => {
+    const { ownKeys } = Reflect;
+    const { getOwnPropertyDescriptor, keys } = Object;
+    const builtins = [${BUILTINS.join(', ')}]
+        .flatMap((builtin) => typeof builtin.prototype === 'object' && builtin.prototype !== null ? [builtin, builtin.prototype] : [builtin]);
+    return () => {
+        const objects = [], names = [], values = [];
+        for (let i = 0; i < builtins.length; i++) {
+            const builtinKeys = ownKeys(builtins[i]);
+            for (let j = 0; j < builtinKeys.length; j++) {
+                const descriptor = getOwnPropertyDescriptor(builtins[i], builtinKeys[j]);
+                if ('value' in descriptor && (descriptor.writable || descriptor.configurable)) {
+                    objects[objects.length] = builtins[i];
+                    names[names.length] = builtinKeys[j];
+                    values[values.length] = descriptor.value;
+                }
+            }
+        }
+        return () => {
+            for (let i = 0; i < objects.length; i++) {
+                if (objects[i][names[i]] !== values[i]) return null;
+            }
+            const added = {};
+            for (let i = 0; i < builtins.length; i++) {
+                const addedKeys = keys(builtins[i]);
+                for (let j = 0; j < addedKeys.length; j++) {
+                    const descriptor = getOwnPropertyDescriptor(builtins[i], addedKeys[j]);
+                    if (!('value' in descriptor)) return null;
+                    added[i + '.' + addedKeys[j]] = descriptor.value;
+                }
+            }
+            return added;
+        };
+    };
+})()`, { filename: 'builtins.js' });
+
+// Snapshot the state of all globals in a context, including the contents of objects and arrays,
+// the top-level let, const and class bindings (see getLexicalScript) and the properties of the builtins (see builtinsScript)
+// used to detect PACs that change their global state while running FindProxyForURL
+// readers holds the functions returning the lexical bindings and the added properties of the builtins,
+// which return a new object on every call, so only the properties of these objects are compared
+// returns null if the state can't be captured
+const snapshotGlobals = (ctx, readers) => {
+    const builtins = readers.builtins();
+    if (builtins === null) return null;
+    const globals = captureObject(ctx, new Set());
+    const added = captureObject(builtins, new Set());
+    const lexicals = captureObject(readers.lexicals(), new Set());
+    return globals === undefined || added === undefined || lexicals === undefined ? null : { globals, added, lexicals };
+}
+
+const sameGlobals = (ctx, readers, snapshot) => {
+    const builtins = readers.builtins();
+    return builtins !== null && sameObject(ctx, snapshot.globals) && sameObject(builtins, snapshot.added)
+        && sameObject(readers.lexicals(), snapshot.lexicals);
+}
+
+// Get a context in which the PAC script was already evaluated for the given src_ip and environment
+// the environment is part of the key, since the PAC could already use it while setting up its globals
+// contexts of stateful PACs are not cached, their snapshot is null
+const getContext = (pacContent, src_ip, envKey) => {
+    const hash = crypto.createHash('sha256').update(pacContent).digest('hex');
+    const key = `${hash}|${src_ip}|${envKey}`;
+
+    let entry = contextCache.get(key);
+    if (!entry) {
+        const script = getScript(pacContent, hash);
+        const ctx = vm.createContext(buildPredefinedFuncs(src_ip));
+        const rememberBuiltins = builtinsScript.runInContext(ctx);
+        script.runInContext(ctx, { timeout: evalTimeout });
+        if (typeof ctx.FindProxyForURL !== 'function') {
+            throw new Error('FindProxyForURL is not defined in PAC');
+        }
+        if (codeCache.get(hash) === undefined) {
+            // create the code cache after the first run, so it includes the lazily compiled functions
+            codeCache.set(hash, script.createCachedData());
+        }
+
+        let snapshot = null;
+        let readers = null;
+        const lexicalScript = statefulPacs.get(hash) === undefined ? getLexicalScript(pacContent, hash) : null;
+        if (lexicalScript !== null) {
+            try {
+                // the builtins as changed by the top-level code of the PAC (e.g. polyfills) are the state to compare against
+                readers = { builtins: rememberBuiltins(), lexicals: lexicalScript.runInContext(ctx) };
+                snapshot = snapshotGlobals(ctx, readers);
+            } catch {
+                // a misdetected name, which is not defined in the PAC
+            }
+        }
+        if (snapshot === null) statefulPacs.set(hash, true);
+        entry = { key, hash, ctx, readers, snapshot };
+        if (snapshot !== null) {
+            contextCache.set(key, entry);
+        }
+    }
+    return entry;
+}
+
+// Convert the value returned by FindProxyForURL into the proxy reported by the engine
+const formatProxy = (result) => {
+    let proxy = []
+    if (result && typeof result === 'string') {
+        const parts = result.trim().split(';');
+        for (let part of parts) {
+            part = part.trim();
+            if (part === "DIRECT") {
+                proxy.push("DIRECT");
+            } else if (part.startsWith('PROXY ')) {
+                proxy.push(part.substring(6));
+            } else if (part === "") {
+                // do nothing / skip
+            } else{
+                proxy.push(part);
+            }
+        }
+    } else {
+        proxy.push('<no proxy>');
+    }
+    return proxy.join(';');
+}
+
+// Key of the dns and clock overrides of a case, cases with the same key are evaluated in the same environment
+const environmentKey = (c) => (c.dns || c.clock) ? JSON.stringify([c.dns || null, c.clock || null]) : '';
+
+// Evaluate multiple hosts against a PAC, returns one result per host
+// env contains the dns and clock overrides shared by all hosts
+// hosts are evaluated in a single run as long as the context can be reused, so every host sees the state of a fresh context:
+// if a run changed the global state, only the result of its first host is kept and the others are evaluated again, one context each
+const evalPacHosts = (pacContent, testHosts, src_ip, env) => {
+    const results = [];
+    try {
+        setEnvironment(env.dns, env.clock);
+        const envKey = environmentKey(env);
+
+        while (results.length < testHosts.length) {
+            const { key, hash, ctx, readers, snapshot } = getContext(pacContent, src_ip, envKey);
+            // contexts of stateful PACs are only used for a single host
+            const hosts = snapshot !== null ? testHosts.slice(results.length) : [testHosts[results.length]];
+
+            let runResults;
+            ctx.__pac_hosts = hosts;
+            try {
+                // every host gets the full timeout, as if it was evaluated on its own
+                runResults = callScript.runInContext(ctx, { timeout: evalTimeout * hosts.length });
+            } catch (err) {
+                // the run was interrupted, so the state of the context is unknown
+                contextCache.delete(key);
+                throw err;
+            } finally {
+                delete ctx.__pac_hosts;
+            }
+
+            // only reuse the context, if FindProxyForURL did not change the global state
+            // otherwise the next evaluation could see a different state than a fresh evaluation
+            if (snapshot !== null && !sameGlobals(ctx, readers, snapshot)) {
+                contextCache.delete(key);
+                statefulPacs.set(hash, true);
+                runResults = runResults.slice(0, 1);
+            }
+
+            for (const { result, error } of runResults) {
+                results.push(error !== undefined
+                    ? { status: 'failed', message: error }
+                    : { status: 'success', proxy: formatProxy(result) }
+                );
+            }
+        }
+        return results;
+    } catch (err) {
+        // hosts evaluated before the error keep their results
+        return results.concat(testHosts.slice(results.length).map(() => ({ status: 'failed', message: err.message })));
+    }
+}
+
+const evalPac = (pacContent, c) => evalPacHosts(pacContent, [c.dest_host], c.src_ip, c)[0];
+
+// Evaluate all cases of a batch, cases with the same src_ip and environment share a context and are evaluated together, see evalPacHosts
+// cases with an error are passed through as their result
+const evalBatch = (pacContent, cases) => {
+    const results = new Array(cases.length);
+    // src_ip and environment -> indexes of all cases with that src_ip and environment
+    const groups = new Map();
+    cases.forEach((c, index) => {
+        if (c.error) {
+            results[index] = { status: 'failed', message: c.error };
+        } else {
+            const key = `${c.src_ip}|${environmentKey(c)}`;
+            if (!groups.has(key)) groups.set(key, []);
+            groups.get(key).push(index);
+        }
+    });
+    for (const indexes of groups.values()) {
+        const first = cases[indexes[0]];
+        const groupResults = evalPacHosts(pacContent, indexes.map(index => cases[index].dest_host), first.src_ip, first);
+        indexes.forEach((index, i) => { results[index] = groupResults[i]; });
+    }
+    return results;
+}
+
+// Tasks are sent by the WorkerPool, every task gets exactly one reply with the same id
+// - eval: evaluate a single case
+// - batch: evaluate all cases against the same PAC, see evalBatch
+parentPort.on('message', ({ id, type, pac, cases }) => {
+    const result = type === 'batch'
+        ? { results: evalBatch(pac, cases) }
+        : evalPac(pac, cases[0]);
+    parentPort.postMessage({ id, result });
+});
+
+// everything is loaded, so the WorkerPool can send tasks
+parentPort.postMessage({ ready: true });
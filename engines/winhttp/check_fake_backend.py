@@ -0,0 +1,89 @@
+"""Checks the concurrency of the winhttp engine on Linux, using the fake backend (see fake_winhttp.py).
+It starts winhttp.py with WINHTTP_BACKEND=fake, sends more concurrent requests than the engine has workers,
+and checks via GET /stats that no more evaluations than workers ran at the same time,
+and that no session was ever used by two threads at once.
+
+Usage: python3 check_fake_backend.py [--port PORT] [--workers N] [--requests N] [--delay MS]"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+PAC = "function FindProxyForURL(url, host) { return 'DIRECT'; }"
+
+
+def request(url: str, body: dict = None) -> dict:
+    data = json.dumps(body).encode("utf-8") if body is not None else None
+    req = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(req, timeout=30) as res:
+        return json.loads(res.read())
+
+
+def wait_until_up(base_url: str, timeout: float = 10):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            request(f"{base_url}/up")
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the concurrency of the winhttp engine with the fake backend.")
+    parser.add_argument("--port", type=int, default=8092)
+    parser.add_argument("--workers", type=int, default=4, help="worker threads of the engine")
+    parser.add_argument("--requests", type=int, default=64, help="requests sent, half of them are batches")
+    parser.add_argument("--delay", type=float, default=50, help="milliseconds every fake evaluation takes")
+    args = parser.parse_args()
+
+    env = dict(os.environ, WINHTTP_BACKEND="fake", WORKERS=str(args.workers), FAKE_DELAY=str(args.delay / 1000))
+    engine = subprocess.Popen(
+        [sys.executable, "winhttp.py", str(args.port)],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        base_url = f"http://127.0.0.1:{args.port}"
+        wait_until_up(base_url)
+
+        def send(i: int) -> bool:
+            if i % 2:
+                cases = [{"dest_host": f"host{i}-{j}.example.com", "src_ip": "10.0.0.1"} for j in range(3)]
+                reply = request(f"{base_url}/batch", {"pac": {"content": PAC}, "cases": cases})
+                return reply["status"] == "success" and all(r["status"] == "success" for r in reply["results"])
+            reply = request(f"{base_url}/", {"pac": {"content": PAC}, "dest_host": f"host{i}.example.com", "src_ip": "10.0.0.1"})
+            return reply["status"] == "success"
+
+        # more clients than workers, so requests have to wait for a free worker
+        with ThreadPoolExecutor(max_workers=args.workers * 4) as executor:
+            succeeded = sum(executor.map(send, range(args.requests)))
+
+        stats = request(f"{base_url}/stats")
+    finally:
+        engine.terminate()
+        engine.wait()
+
+    print(json.dumps(stats, indent=2))
+    checks = {
+        f"all {args.requests} requests succeeded": succeeded == args.requests,
+        f"max_concurrent ({stats['max_concurrent']}) <= workers ({args.workers})": stats["max_concurrent"] <= args.workers,
+        f"shared_session_calls ({stats['shared_session_calls']}) == 0": stats["shared_session_calls"] == 0,
+        f"sessions_opened ({stats['sessions_opened']}) <= workers ({args.workers})": stats["sessions_opened"] <= args.workers,
+    }
+    for check, passed in checks.items():
+        print(f"{'PASS' if passed else 'FAIL'}: {check}")
+    sys.exit(0 if all(checks.values()) else 1)
+
+
+if __name__ == "__main__":
+    main()
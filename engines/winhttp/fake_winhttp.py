@@ -0,0 +1,75 @@
+"""This File contains a fake of the WinHTTP layer, which does not evaluate PACs at all.
+It is used to run the engine on Linux (WINHTTP_BACKEND=fake), e.g. to test the server and its concurrency without wine."""
+
+import itertools
+import threading
+import time
+import urllib.request
+from typing import Optional
+
+from winhttp_api import WinHttpError
+
+# error of WinHTTP, if the PAC can't be downloaded
+ERROR_WINHTTP_UNABLE_TO_DOWNLOAD_SCRIPT = 12167
+
+
+class FakeWinHttpApi:
+    """Stand-in for WinHttpApi (see winhttp_api.py).
+    Every evaluation downloads the PAC like WinHTTP would, takes `delay` seconds and returns `proxy`.
+    Evaluations of hosts starting with "hang." never finish, to simulate a hanging WinHTTP.
+    Keeps track of how many evaluations ran at the same time, and if a session was ever used by two threads at once."""
+
+    def __init__(self, delay: float = 0.05, proxy: Optional[str] = None):
+        self.delay = delay
+        self.proxy = proxy
+        self.lock = threading.Lock()
+        self.handles = itertools.count(1)
+        # sessions currently used by an evaluation
+        self.busy_sessions = set()
+        self.stats = {
+            "sessions_opened": 0,
+            "sessions_closed": 0,
+            "evaluations": 0,
+            "concurrent": 0,
+            "max_concurrent": 0,
+            "shared_session_calls": 0,
+            "downloads": 0,
+        }
+
+    def snapshot_stats(self) -> dict:
+        with self.lock:
+            return dict(self.stats)
+
+    def open_session(self) -> int:
+        with self.lock:
+            self.stats["sessions_opened"] += 1
+            return next(self.handles)
+
+    def close_session(self, session: int):
+        with self.lock:
+            self.stats["sessions_closed"] += 1
+
+    def get_proxy_for_url(self, session: int, destination_url: str, pac_url: str) -> Optional[str]:
+        with self.lock:
+            if session in self.busy_sessions:
+                self.stats["shared_session_calls"] += 1
+            self.busy_sessions.add(session)
+            self.stats["evaluations"] += 1
+            self.stats["concurrent"] += 1
+            self.stats["max_concurrent"] = max(self.stats["max_concurrent"], self.stats["concurrent"])
+        try:
+            try:
+                with urllib.request.urlopen(pac_url, timeout=5) as res:
+                    res.read()
+            except OSError:
+                raise WinHttpError("WinHttpGetProxyForUrl", ERROR_WINHTTP_UNABLE_TO_DOWNLOAD_SCRIPT)
+            with self.lock:
+                self.stats["downloads"] += 1
+            if destination_url.startswith("https://hang."):
+                threading.Event().wait()
+            time.sleep(self.delay)
+            return self.proxy
+        finally:
+            with self.lock:
+                self.busy_sessions.discard(session)
+                self.stats["concurrent"] -= 1
@@ -0,0 +1,101 @@
+"""This File contains a tiny in-process server, which serves the PAC contents received by the engine to WinHTTP.
+WinHTTP can only evaluate PACs it downloads from a URL, so without it every evaluation would need a
+second request to the core server. PACs are served under the hash of their content, so WinHTTP can
+reuse its script cache for identical PACs.
+The server runs on its own thread, so downloads never wait for the (bounded) workers of the engine."""
+
+import collections
+import contextlib
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+
+class PacFileStore:
+    """Bounded store of PAC contents keyed by the hash of their content, the least recently used PAC gets evicted.
+    PACs are pinned while an evaluation might still download them, pinned PACs are never evicted,
+    so the store can exceed max_size by the number of concurrent evaluations."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.entries: collections.OrderedDict[str, bytes] = collections.OrderedDict()
+        # hash -> number of evaluations using the PAC
+        self.pins: dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def put(self, content: str) -> str:
+        """Store and pin the content, and return its hash. Every put has to be followed by a release."""
+        data = content.encode("utf-8")
+        content_hash = hashlib.sha256(data).hexdigest()
+        with self.lock:
+            self.entries[content_hash] = data
+            self.entries.move_to_end(content_hash)
+            self.pins[content_hash] = self.pins.get(content_hash, 0) + 1
+            self._evict()
+        return content_hash
+
+    def release(self, content_hash: str):
+        """Unpin the content, once WinHTTP does not need to download it anymore."""
+        with self.lock:
+            self.pins[content_hash] -= 1
+            if self.pins[content_hash] == 0:
+                del self.pins[content_hash]
+                self._evict()
+
+    def _evict(self):
+        unpinned = [content_hash for content_hash in self.entries if content_hash not in self.pins]
+        for content_hash in unpinned[:max(len(self.entries) - self.max_size, 0)]:
+            del self.entries[content_hash]
+
+    def get(self, content_hash: str) -> Optional[bytes]:
+        with self.lock:
+            return self.entries.get(content_hash)
+
+
+class PacFileHandler(BaseHTTPRequestHandler):
+    store: PacFileStore = None
+
+    def do_GET(self):
+        # /pac/<hash>.pac
+        content_hash = self.path.removeprefix("/pac/").removesuffix(".pac")
+        data = self.store.get(content_hash) if self.path.startswith("/pac/") else None
+        if data is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ns-proxy-autoconfig")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        # downloads happen for every uncached evaluation, so don't log them
+        pass
+
+
+class PacFileServer:
+    """Serves the PACs of a PacFileStore on an ephemeral port of 127.0.0.1."""
+
+    def __init__(self, max_size: int):
+        self.store = PacFileStore(max_size)
+        handler = type("BoundPacFileHandler", (PacFileHandler,), {"store": self.store})
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.httpd.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self.httpd.server_address[1]}/pac/"
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="pac-files", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    @contextlib.contextmanager
+    def serve(self, content: str):
+        """Store the content, and yield the URL under which WinHTTP can download it.
+        The content is not evicted before the block ends, so wrap all evaluations using the URL."""
+        content_hash = self.store.put(content)
+        try:
+            yield f"{self.base_url}{content_hash}.pac"
+        finally:
+            self.store.release(content_hash)
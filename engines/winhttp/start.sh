@@ -1,8 +1,14 @@
 #!/bin/bash
 
-echo "Starting WinHTTP engine..."
+# additional instances listen on the base port plus a multiple of 100
+# keep in sync with INSTANCE_PORT_STEP of the core server
+PORT=$((8082 + 100 * ${INSTANCE:-0}))
 
-xvfb-run --auto-servernum --server-args="-screen 0 1024x768x16" wine python.exe winhttp.py &
+echo "Starting WinHTTP engine on port $PORT..."
+
+# the supervisor runs a pool of winhttp worker processes behind $PORT, and restarts them if they hang or die
+# every worker gets its own port, which the supervisor passes in place of {port}
+python3 supervisor.py $PORT -- xvfb-run --auto-servernum --server-args="-screen 0 1024x768x16" wine python.exe winhttp.py {port} &
 PID=$!
 echo "WinHTTP Engine started with PID: $PID"
 wait $PID
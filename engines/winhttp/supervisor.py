@@ -0,0 +1,328 @@
+"""This File contains a supervisor, which runs a pool of winhttp worker processes behind a single port.
+WinHTTP under wine is slow and not always stable, so instead of a single process:
+- requests are forwarded to the worker process with the least outstanding requests
+- every worker is health checked via its "/up" Endpoint, and restarted if it dies or stops responding
+- workers are recycled (one at a time) after a number of evaluations, or as soon as a request to them hangs
+- "/stats" reports the state of every worker
+
+Usage: python3 supervisor.py PORT -- COMMAND...
+COMMAND starts a single worker, "{port}" in COMMAND is replaced with the port the worker has to listen on.
+e.g. on Linux without wine: WINHTTP_BACKEND=fake python3 supervisor.py 8082 -- python3 winhttp.py {port}"""
+
+import http.client
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+# States of a worker process
+STATE_STARTING = "starting"
+STATE_READY = "ready"
+# no new requests, restarted as soon as all outstanding requests finished
+STATE_DRAINING = "draining"
+# a request to the worker hung, restarted right away
+STATE_HUNG = "hung"
+
+# a worker is restarted after this many failed health checks in a row
+HEALTH_FAILURE_THRESHOLD = 3
+
+# the core server gives up on a request after its APP_ENGINE_READ_TIMEOUT, plus a timeout per case of a batch
+# requests to a worker time out this many seconds earlier, so a hung worker is restarted while the core server still waits,
+# instead of holding a thread of the supervisor, and counting as outstanding, long after the core server gave up
+CORE_READ_TIMEOUT_MARGIN = 0.5
+# keep in sync with ENGINE_BATCH_TIMEOUT_PER_CASE of the core server
+BATCH_TIMEOUT_PER_CASE = 0.5
+
+
+def free_port() -> int:
+    """Find a free port on 127.0.0.1 for a worker."""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class WorkerProcess:
+    """A single winhttp worker process, including its stats."""
+
+    def __init__(self, index: int, command: list[str]):
+        self.index = index
+        self.command = command
+        self.process: Optional[subprocess.Popen] = None
+        self.port = 0
+        self.state = STATE_STARTING
+        self.started_at = 0.0
+        # number of requests currently forwarded to this worker
+        self.outstanding = 0
+        # evaluations since the last (re)start, and in total
+        self.evaluations = 0
+        self.total_evaluations = 0
+        self.health_failures = 0
+        self.last_health_check = 0.0
+        self.restarts = 0
+        self.last_restart_reason: Optional[str] = None
+
+    def start(self):
+        self.port = free_port()
+        command = [part.replace("{port}", str(self.port)) for part in self.command]
+        # a new session, so the whole process group (e.g. xvfb-run and wine) can be killed at once
+        self.process = subprocess.Popen(command, start_new_session=True)
+        self.state = STATE_STARTING
+        self.started_at = time.monotonic()
+        self.evaluations = 0
+        self.health_failures = 0
+        print(f"Worker {self.index} started with PID {self.process.pid} on port {self.port}")
+
+    def stop(self):
+        if self.process is None:
+            return
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        self.process.wait()
+
+    def exited(self) -> bool:
+        return self.process is not None and self.process.poll() is not None
+
+    def check_health(self, timeout: float) -> bool:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=timeout)
+            try:
+                conn.request("GET", "/up")
+                return conn.getresponse().status == 200
+            finally:
+                conn.close()
+        except OSError:
+            return False
+
+    def status(self) -> dict:
+        return {
+            "index": self.index,
+            "pid": self.process.pid if self.process else None,
+            "port": self.port,
+            "state": self.state,
+            "uptime": round(time.monotonic() - self.started_at, 1),
+            "outstanding": self.outstanding,
+            "evaluations": self.evaluations,
+            "total_evaluations": self.total_evaluations,
+            "restarts": self.restarts,
+            "last_restart_reason": self.last_restart_reason,
+        }
+
+
+class Supervisor:
+    """Starts the worker processes, picks a worker for every request, and restarts workers if required."""
+
+    def __init__(self, command: list[str], processes: int, max_evaluations: int, request_timeout: float,
+                 health_interval: float, startup_timeout: float):
+        self.workers = [WorkerProcess(i, command) for i in range(processes)]
+        self.max_evaluations = max_evaluations
+        # seconds, batches get BATCH_TIMEOUT_PER_CASE per case on top
+        self.request_timeout = request_timeout
+        self.health_interval = health_interval
+        self.startup_timeout = startup_timeout
+        self.lock = threading.Lock()
+
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+        threading.Thread(target=self._monitor, name="supervisor", daemon=True).start()
+
+    def acquire(self, exclude: list[WorkerProcess]) -> Optional[WorkerProcess]:
+        """Pick the ready worker with the least outstanding requests, or None if no worker is ready."""
+        with self.lock:
+            candidates = [w for w in self.workers if w.state == STATE_READY and w not in exclude]
+            if not candidates:
+                # draining workers still work, so rather use them than rejecting the request
+                candidates = [w for w in self.workers if w.state == STATE_DRAINING and w not in exclude]
+            if not candidates:
+                return None
+            worker = min(candidates, key=lambda w: w.outstanding)
+            worker.outstanding += 1
+            return worker
+
+    def release(self, worker: WorkerProcess, evaluations: int, hung: bool = False):
+        with self.lock:
+            worker.outstanding -= 1
+            worker.evaluations += evaluations
+            worker.total_evaluations += evaluations
+            if hung:
+                worker.state = STATE_HUNG
+            elif worker.state == STATE_READY and 0 < self.max_evaluations <= worker.evaluations:
+                # only recycle one worker at a time, so the other workers keep handling requests
+                if not any(w.state in [STATE_DRAINING, STATE_STARTING] for w in self.workers):
+                    worker.state = STATE_DRAINING
+
+    def restart(self, worker: WorkerProcess, reason: str):
+        print(f"Restarting worker {worker.index}: {reason}")
+        worker.stop()
+        with self.lock:
+            worker.restarts += 1
+            worker.last_restart_reason = reason
+            worker.start()
+
+    def _monitor(self):
+        while True:
+            for worker in self.workers:
+                self._check(worker)
+            time.sleep(0.5)
+
+    def _check(self, worker: WorkerProcess):
+        if worker.exited():
+            self.restart(worker, f"exited with code {worker.process.returncode}")
+        elif worker.state == STATE_HUNG:
+            self.restart(worker, "request did not finish in time")
+        elif worker.state == STATE_DRAINING and worker.outstanding == 0:
+            self.restart(worker, f"recycled after {worker.evaluations} evaluations")
+        elif worker.state == STATE_STARTING:
+            if worker.check_health(timeout=1):
+                worker.state = STATE_READY
+                worker.last_health_check = time.monotonic()
+            elif time.monotonic() - worker.started_at > self.startup_timeout:
+                self.restart(worker, f"not up within {self.startup_timeout}s")
+        elif worker.state == STATE_READY and time.monotonic() - worker.last_health_check >= self.health_interval:
+            worker.last_health_check = time.monotonic()
+            if worker.check_health(timeout=self.health_interval):
+                worker.health_failures = 0
+            else:
+                worker.health_failures += 1
+                if worker.health_failures >= HEALTH_FAILURE_THRESHOLD:
+                    self.restart(worker, f"failed {worker.health_failures} health checks")
+
+    def forward(self, path: str, body: bytes, evaluations: int) -> tuple[int, bytes]:
+        """Forward a request to a worker, returns the status code and body of the reply.
+        Requests that never reached a worker are retried on another worker."""
+        tried = []
+        while len(tried) < len(self.workers):
+            worker = self.acquire(exclude=tried)
+            if worker is None:
+                break
+            tried.append(worker)
+
+            hung = False
+            # requests that did not reach the worker don't count as evaluations
+            handled = evaluations
+            try:
+                timeout = self.request_timeout + (evaluations * BATCH_TIMEOUT_PER_CASE if path == "/batch" else 0)
+                conn = http.client.HTTPConnection("127.0.0.1", worker.port, timeout=timeout)
+                try:
+                    conn.request("POST", path, body, {"Content-Type": "application/json"})
+                    res = conn.getresponse()
+                    return res.status, res.read()
+                finally:
+                    conn.close()
+            except (socket.timeout, TimeoutError):
+                hung = True
+                return 504, failed_reply("WinHTTP worker did not reply in time, the worker is restarted")
+            except OSError:
+                # the worker is not reachable (anymore), try the next one
+                handled = 0
+                continue
+            finally:
+                self.release(worker, handled, hung)
+
+        return 503, failed_reply("No WinHTTP worker is available")
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "max_evaluations": self.max_evaluations,
+                "request_timeout": self.request_timeout,
+                "batch_timeout_per_case": BATCH_TIMEOUT_PER_CASE,
+                "workers": [worker.status() for worker in self.workers],
+            }
+
+    def stop(self):
+        for worker in self.workers:
+            worker.stop()
+
+
+def failed_reply(error: str) -> bytes:
+    return json.dumps({"status": "failed", "error": error}).encode("utf-8")
+
+
+class SupervisorHandler(BaseHTTPRequestHandler):
+    supervisor: Supervisor = None
+
+    def send_json(self, status_code: int, body: bytes):
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/up":
+            # the engine is up as long as a single worker is ready
+            ready = any(worker.state == STATE_READY for worker in self.supervisor.workers)
+            if ready:
+                self.send_json(200, json.dumps({"status": "success", "message": "Server is up and running!"}).encode("utf-8"))
+            else:
+                self.send_json(503, failed_reply("No WinHTTP worker is ready"))
+        elif self.path == "/stats":
+            self.send_json(200, json.dumps({"status": "success", **self.supervisor.stats()}).encode("utf-8"))
+        else:
+            self.send_json(404, failed_reply("Not Found"))
+
+    def do_POST(self):
+        if self.path not in ["/", "/batch"]:
+            self.send_json(404, failed_reply("Not Found"))
+            return
+
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        evaluations = 1
+        if self.path == "/batch":
+            # every case of a batch counts as an evaluation
+            try:
+                evaluations = max(len(json.loads(body).get("cases", [])), 1)
+            except (ValueError, AttributeError, TypeError):
+                pass
+
+        status_code, reply = self.supervisor.forward(self.path, body, evaluations)
+        self.send_json(status_code, reply)
+
+
+def default_request_timeout() -> float:
+    """Default of WINHTTP_REQUEST_TIMEOUT, derived from the read timeout of the core server for this engine,
+    which is set in the same environment (see entrypoint.sh)."""
+    core_read_timeout = float(os.environ.get("APP_ENGINE_READ_TIMEOUT_WINHTTP", os.environ.get("APP_ENGINE_READ_TIMEOUT", 5)))
+    return max(core_read_timeout - CORE_READ_TIMEOUT_MARGIN, core_read_timeout / 2)
+
+
+def main():
+    if "--" not in sys.argv or sys.argv.index("--") != 2:
+        print(__doc__)
+        sys.exit(1)
+    port = int(sys.argv[1])
+    command = sys.argv[3:]
+
+    supervisor = Supervisor(
+        command=command,
+        processes=int(os.environ.get("WINHTTP_PROCESSES", 2)),
+        max_evaluations=int(os.environ.get("WINHTTP_MAX_EVALUATIONS", 1000)),
+        request_timeout=float(os.environ.get("WINHTTP_REQUEST_TIMEOUT", default_request_timeout())),
+        health_interval=float(os.environ.get("WINHTTP_HEALTH_INTERVAL", 5)),
+        startup_timeout=float(os.environ.get("WINHTTP_STARTUP_TIMEOUT", 60)),
+    )
+    SupervisorHandler.supervisor = supervisor
+    supervisor.start()
+    # the workers run in their own sessions, so make sure they are stopped when the supervisor is terminated
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    httpd = ThreadingHTTPServer(('0.0.0.0', port), SupervisorHandler)
+    httpd.daemon_threads = True
+    print(f"Starting supervisor on port {port} with {len(supervisor.workers)} workers...")
+    try:
+        httpd.serve_forever()
+    finally:
+        supervisor.stop()
+
+
+if __name__ == "__main__":
+    main()
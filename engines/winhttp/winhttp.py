@@ -1,27 +1,16 @@
-import ctypes
+import os
 import struct
-from ctypes import wintypes
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlparse
-from http.server import BaseHTTPRequestHandler, HTTPServer
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from error_parser import parse_winhttp_error
+from pac_files import PacFileServer
+from winhttp_api import WinHttpApi, WinHttpError
 import json
 import re
+import sys
 import threading
-
-# Constants for WinHTTP API
-WINHTTP_ACCESS_TYPE_NO_PROXY = 1
-WINHTTP_NO_PROXY_NAME = 0
-WINHTTP_NO_PROXY_BYPASS = 0
-WINHTTP_FLAG_ASYNC=0x10000000
-WINHTTP_AUTOPROXY_CONFIG_URL = 0x00000002
-
-WINHTTP_RESET_STATE = 0x00000001
-WINHTTP_RESET_SWPAD_CURRENT_NETWORK = 0x00000002
-WINHTTP_RESET_SWPAD_ALL = 0x00000004
-WINHTTP_RESET_SCRIPT_CACHE = 0x00000008
-WINHTTP_RESET_ALL = 0x0000FFFF
-WINHTTP_RESET_NOTIFY_NETWORK_CHANGED = 0x00010000
-WINHTTP_RESET_OUT_OF_PROC = 0x00020000
+import time
 
 # Regex for Validations
 ip_regex = re.compile(r'^(\d{1,3}\.){3}\d{1,3}$')
@@ -39,11 +28,18 @@ class ProxyHandlerServer(BaseHTTPRequestHandler):
         if self.path == "/up":
             # Respond to /up route with JSON
             self.send_json_response({"status": 'success', "message": "Server is up and running!"}, 200)
+        elif self.path == "/stats" and hasattr(winhttp, "snapshot_stats"):
+            # only the fake backend keeps stats, e.g. to check that sessions are never shared between threads
+            self.send_json_response({"status": "success", "workers": self.server.workers, **winhttp.snapshot_stats()}, 200)
         else:
             # Default response for GET
             self.send_json_response({"status": "failed", "error": "Not Found"}, 404)
 
     def do_POST(self):
+        if self.path not in ["/", "/batch"]:
+            self.send_json_response({"status": "failed", "error": "Not Found"}, 404)
+            return
+
         # Parse JSON payload
         content_length = int(self.headers['Content-Length'])
         post_data = self.rfile.read(content_length)
@@ -55,14 +51,20 @@ class ProxyHandlerServer(BaseHTTPRequestHandler):
 
         # Validate input
         pac_url = data.get("pac", {}).get("url")
-        dest_host = data.get("dest_host")
+        pac_content = data.get("pac", {}).get("content")
 
-        if not pac_url:
-            self.send_json_response({'status': 'failed',"error": "Field 'pac.url' is required"}, 400)
-            return
+        if pac_content:
+            # serve the content ourselves, instead of letting WinHTTP download it from the core server
+            # the content stays available until all evaluations finished
+            with pac_files.serve(pac_content) as pac_url:
+                self.handle_evaluation(data, pac_url)
+        else:
+            self.handle_evaluation(data, pac_url)
 
-        if not dest_host:
-            self.send_json_response({'status': 'failed',"error": "Field 'dest_host' is required"}, 400)
+    def handle_evaluation(self, data: dict, pac_url: str):
+        """Evaluate a single case, or every case of a batch request, against the PAC under pac_url."""
+        if not pac_url:
+            self.send_json_response({'status': 'failed',"error": "Field 'pac.content' or 'pac.url' is required"}, 400)
             return
 
         # Validate the format of URLs
@@ -70,16 +72,52 @@ class ProxyHandlerServer(BaseHTTPRequestHandler):
             self.send_json_response({'status': 'failed',"error": "'pac.url' must be a valid URL"}, 400)
             return
 
+        if self.path == "/batch":
+            self.handle_batch(data, pac_url)
+            return
+
+        dest_host = data.get("dest_host")
+
+        if not dest_host:
+            self.send_json_response({'status': 'failed',"error": "Field 'dest_host' is required"}, 400)
+            return
+
         if not ProxyHandlerServer.validate_hostname(dest_host):
             self.send_json_response({'status': 'failed',"error": "'dest_host' must be a valid Hostname"}, 400)
             return
 
         try:
+            start = time.perf_counter()
             eval_result = resolve_proxy_with_pac(dest_host, pac_url)
+            eval_result["eval_time"] = elapsed_ms(start)
             self.send_json_response(eval_result, 200)
         except Exception as e:
             self.send_json_response({'status': 'failed',"error": "Unexpected Error during evaluation", "message": str(e)}, 500)
 
+    def handle_batch(self, data: dict, pac_url: str):
+        """Evaluate every case of a batch request against the same PAC."""
+        cases = data.get("cases")
+
+        if not isinstance(cases, list):
+            self.send_json_response({'status': 'failed',"error": "Field 'cases' is required and must be a list"}, 400)
+            return
+
+        start = time.perf_counter()
+        results = []
+        for case in cases:
+            dest_host = case.get("dest_host")
+            # invalid cases only fail themselves, not the whole batch
+            if not dest_host or not ProxyHandlerServer.validate_hostname(dest_host):
+                results.append({'status': 'failed',"error": "'dest_host' must be a valid Hostname"})
+                continue
+
+            try:
+                results.append(resolve_proxy_with_pac(dest_host, pac_url))
+            except Exception as e:
+                results.append({'status': 'failed',"error": "Unexpected Error during evaluation", "message": str(e)})
+
+        self.send_json_response({'status': 'success', 'results': results, 'eval_time': elapsed_ms(start)}, 200)
+
     @staticmethod
     def validate_url(url):
         try:
@@ -123,103 +161,100 @@ class ProxyHandlerServer(BaseHTTPRequestHandler):
         return bool(hostname_regex.match(hostname))
 
     @staticmethod
-    def new_server(port=8082):
+    def new_server(port=8082, workers=4):
         server_address = ('0.0.0.0', port)
-        httpd = HTTPServer(server_address, ProxyHandlerServer)
-        print(f"Starting server on port {port}...")
+        httpd = BoundedThreadingHTTPServer(server_address, ProxyHandlerServer, workers)
+        print(f"Starting server on port {port} with {workers} workers...")
         httpd.serve_forever()
 
 
-class WINHTTP_AUTOPROXY_OPTIONS(ctypes.Structure):
-    _fields_ = [
-        ("dwFlags", ctypes.wintypes.DWORD),
-        ("dwAutoDetectFlags", ctypes.wintypes.DWORD),
-        ("lpszAutoConfigUrl", ctypes.wintypes.LPCWSTR),
-        ("lpvReserved", ctypes.c_void_p),
-        ("dwReserved", ctypes.wintypes.DWORD),
-        ("fAutoLogonIfChallenged", ctypes.wintypes.BOOL)
-    ]
+class BoundedThreadingHTTPServer(ThreadingHTTPServer):
+    """ThreadingHTTPServer, which handles requests with a fixed number of worker threads instead of a thread per request.
+    Requests exceeding the number of workers wait for a free worker."""
+
+    def __init__(self, server_address, handler_class, workers: int):
+        super().__init__(server_address, handler_class)
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="winhttp")
 
+    def process_request(self, request, client_address):
+        self.executor.submit(self.process_request_thread, request, client_address)
 
-class WINHTTP_PROXY_INFO(ctypes.Structure):
-    _fields_ = [
-        ("dwAccessType", ctypes.wintypes.DWORD),
-        ("lpszProxy", ctypes.wintypes.LPCWSTR),
-        ("lpszProxyBypass", ctypes.wintypes.LPCWSTR)
-    ]
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=True)
+        close_sessions()
 
+
+# WinHttpApi, or a fake of it (see fake_winhttp.py)
 winhttp = None
-def init_winhttp():
+def init_winhttp(backend: str = "dll"):
     global winhttp
-    winhttp = ctypes.windll.LoadLibrary("winhttp.dll")
+    if backend == "fake":
+        from fake_winhttp import FakeWinHttpApi
+        winhttp = FakeWinHttpApi(delay=float(os.environ.get("FAKE_DELAY", 0.05)))
+    else:
+        winhttp = WinHttpApi()
 
-    # check support
-    print("Platform", "supported" if winhttp.WinHttpCheckPlatform() else "unsupported")
-    if winhttp.WinHttpCheckPlatform() == 0:
-        raise Exception("WinHTTP is not supported on this platform.")
 
-def resolve_proxy_with_pac(dest_host, pac_url) -> dict:
-    """Uses WinHTTP to resolve the proxy for the given URL using the PAC file."""
-    with threading.Lock():
-        # prep input params
-        destination_url = f"https://{dest_host}/test"
-        print("dest_host", dest_host, "destination_url", destination_url, "pac_url", pac_url)
-
-        # Initialize WinHTTP session
-        hSession = winhttp.WinHttpOpen(
-            ctypes.c_wchar_p("WinHTTP-Engine"),  # user agent string
-            WINHTTP_ACCESS_TYPE_NO_PROXY,
-            WINHTTP_NO_PROXY_NAME,
-            WINHTTP_NO_PROXY_BYPASS,
-            WINHTTP_FLAG_ASYNC,
-        )
-        print("Session created", hSession)
-        if not hSession:
-            return parse_winhttp_error("WinHttpOpen", ctypes.GetLastError())
-
-        # force clear cache
-        #result = winhttp.WinHttpResetAutoProxy(
-        #    hSession,
-        #    WINHTTP_RESET_NOTIFY_NETWORK_CHANGED | WINHTTP_RESET_OUT_OF_PROC | WINHTTP_RESET_ALL,
-        #)
-        #print("Clearing Cache", "successfull" if result==0 else f"failed with code {result}")
+# serves the PAC contents received by the engine to WinHTTP
+pac_files: PacFileServer = None
+def init_pac_files(max_size: int):
+    global pac_files
+    pac_files = PacFileServer(max_size)
+    pac_files.start()
 
-        try:
-            auto_proxy_options = WINHTTP_AUTOPROXY_OPTIONS()
-            auto_proxy_options.dwFlags = WINHTTP_AUTOPROXY_CONFIG_URL
-            auto_proxy_options.dwAutoDetectFlags = 0
-            auto_proxy_options.lpszAutoConfigUrl = ctypes.wintypes.LPCWSTR(pac_url)
-            auto_proxy_options.fAutoLogonIfChallenged = False
-
-            proxy_info = WINHTTP_PROXY_INFO()
-
-            # Call WinHttpGetProxyForUrl
-            result = winhttp.WinHttpGetProxyForUrl(
-                hSession,
-                ctypes.wintypes.LPCWSTR(destination_url),
-                ctypes.byref(auto_proxy_options),
-                ctypes.byref(proxy_info),
-            )
-
-            if not result:
-                return parse_winhttp_error("WinHttpGetProxyForUrl", ctypes.GetLastError())
-
-            # Extract the proxy string from proxy_info
-            proxy = proxy_info.lpszProxy if proxy_info.lpszProxy else "DIRECT"
-            return {
-                'status': 'success',
-                'proxy': proxy,
-            }
-        except Exception as e:
-            return {
-                'status': 'failed',
-                'error_code': 1,
-                'error': f"Failed to parse PAC: {str(e)}"
-            }
 
-        finally:
-            # Properly close the WinHTTP session handle
-            winhttp.WinHttpCloseHandle(hSession)
+# every worker thread keeps its own long-lived WinHTTP session
+# so sessions are never shared between threads, and are not opened and closed for every request
+thread_sessions = threading.local()
+# all sessions opened so far, to close them on shutdown
+open_sessions = []
+sessions_lock = threading.Lock()
+
+def get_session() -> int:
+    session = getattr(thread_sessions, "handle", None)
+    if session is None:
+        session = winhttp.open_session()
+        print("Session created", session, "for thread", threading.current_thread().name)
+        thread_sessions.handle = session
+        with sessions_lock:
+            open_sessions.append(session)
+    return session
+
+
+def close_sessions():
+    with sessions_lock:
+        for session in open_sessions:
+            winhttp.close_session(session)
+        open_sessions.clear()
+
+
+def elapsed_ms(start: float) -> float:
+    """Milliseconds since start, reported as "eval_time" so the core server can tell evaluation and network time apart."""
+    return round((time.perf_counter() - start) * 1000, 3)
+
+
+def resolve_proxy_with_pac(dest_host, pac_url) -> dict:
+    """Uses WinHTTP to resolve the proxy for the given URL using the PAC file."""
+    # prep input params
+    destination_url = f"https://{dest_host}/test"
+    print("dest_host", dest_host, "destination_url", destination_url, "pac_url", pac_url)
+
+    try:
+        proxy = winhttp.get_proxy_for_url(get_session(), destination_url, pac_url)
+        return {
+            'status': 'success',
+            'proxy': proxy if proxy else "DIRECT",
+        }
+    except WinHttpError as e:
+        return parse_winhttp_error(e.func_name, e.error_id)
+    except Exception as e:
+        return {
+            'status': 'failed',
+            'error_code': 1,
+            'error': f"Failed to parse PAC: {str(e)}"
+        }
 
 
 class InvalidArchitectureError(Exception):
@@ -232,8 +267,16 @@ class InvalidArchitectureError(Exception):
 
 
 if __name__ == "__main__":
-    if not InvalidArchitectureError.is_python_32bit():
+    # "dll" uses the real WinHTTP, "fake" allows to run the engine without wine
+    backend = os.environ.get("WINHTTP_BACKEND", "dll")
+    if backend == "dll" and not InvalidArchitectureError.is_python_32bit():
         raise InvalidArchitectureError("WinHTTP must be running on 32-bit architecture.")
-    init_winhttp()
-
-    ProxyHandlerServer.new_server()
+    init_winhttp(backend)
+    init_pac_files(int(os.environ.get("PAC_CACHE_SIZE", 100)))
+
+    workers = int(os.environ.get("WORKERS", 4))
+    # the port can be overwritten, to run multiple instances of the engine
+    if len(sys.argv) > 1:
+        ProxyHandlerServer.new_server(int(sys.argv[1]), workers)
+    else:
+        ProxyHandlerServer.new_server(workers=workers)
@@ -0,0 +1,102 @@
+"""This File contains the layer between the engine and WinHTTP.
+The engine only talks to WinHTTP through a WinHttpApi object, so a fake (see fake_winhttp.py) can be swapped in,
+to run the engine and test its concurrency on Linux without wine."""
+
+import ctypes
+from ctypes import wintypes
+from typing import Optional
+
+# Constants for WinHTTP API
+WINHTTP_ACCESS_TYPE_NO_PROXY = 1
+WINHTTP_NO_PROXY_NAME = 0
+WINHTTP_NO_PROXY_BYPASS = 0
+WINHTTP_FLAG_ASYNC=0x10000000
+WINHTTP_AUTOPROXY_CONFIG_URL = 0x00000002
+
+WINHTTP_RESET_STATE = 0x00000001
+WINHTTP_RESET_SWPAD_CURRENT_NETWORK = 0x00000002
+WINHTTP_RESET_SWPAD_ALL = 0x00000004
+WINHTTP_RESET_SCRIPT_CACHE = 0x00000008
+WINHTTP_RESET_ALL = 0x0000FFFF
+WINHTTP_RESET_NOTIFY_NETWORK_CHANGED = 0x00010000
+WINHTTP_RESET_OUT_OF_PROC = 0x00020000
+
+
+class WINHTTP_AUTOPROXY_OPTIONS(ctypes.Structure):
+    _fields_ = [
+        ("dwFlags", wintypes.DWORD),
+        ("dwAutoDetectFlags", wintypes.DWORD),
+        ("lpszAutoConfigUrl", wintypes.LPCWSTR),
+        ("lpvReserved", ctypes.c_void_p),
+        ("dwReserved", wintypes.DWORD),
+        ("fAutoLogonIfChallenged", wintypes.BOOL)
+    ]
+
+
+class WINHTTP_PROXY_INFO(ctypes.Structure):
+    _fields_ = [
+        ("dwAccessType", wintypes.DWORD),
+        ("lpszProxy", wintypes.LPCWSTR),
+        ("lpszProxyBypass", wintypes.LPCWSTR)
+    ]
+
+
+class WinHttpError(Exception):
+    """Raised if a WinHTTP function failed, including the name of the function and the error code."""
+    def __init__(self, func_name: str, error_id: int):
+        super().__init__(f"{func_name} failed with error {error_id}")
+        self.func_name = func_name
+        self.error_id = error_id
+
+
+class WinHttpApi:
+    """WinHTTP via ctypes, only available on Windows (or wine) with a 32-bit python.
+    Session handles may be used from multiple threads, but the engine keeps one session per worker thread."""
+
+    def __init__(self):
+        self.dll = ctypes.windll.LoadLibrary("winhttp.dll")
+
+        # check support
+        print("Platform", "supported" if self.dll.WinHttpCheckPlatform() else "unsupported")
+        if self.dll.WinHttpCheckPlatform() == 0:
+            raise Exception("WinHTTP is not supported on this platform.")
+
+    def open_session(self) -> int:
+        session = self.dll.WinHttpOpen(
+            ctypes.c_wchar_p("WinHTTP-Engine"),  # user agent string
+            WINHTTP_ACCESS_TYPE_NO_PROXY,
+            WINHTTP_NO_PROXY_NAME,
+            WINHTTP_NO_PROXY_BYPASS,
+            WINHTTP_FLAG_ASYNC,
+        )
+        if not session:
+            raise WinHttpError("WinHttpOpen", ctypes.GetLastError())
+        return session
+
+    def close_session(self, session: int):
+        self.dll.WinHttpCloseHandle(session)
+
+    def get_proxy_for_url(self, session: int, destination_url: str, pac_url: str) -> Optional[str]:
+        """Evaluate the PAC at pac_url for destination_url.
+        Returns the proxy string, or None if the PAC returned DIRECT."""
+        auto_proxy_options = WINHTTP_AUTOPROXY_OPTIONS()
+        auto_proxy_options.dwFlags = WINHTTP_AUTOPROXY_CONFIG_URL
+        auto_proxy_options.dwAutoDetectFlags = 0
+        auto_proxy_options.lpszAutoConfigUrl = wintypes.LPCWSTR(pac_url)
+        auto_proxy_options.fAutoLogonIfChallenged = False
+
+        proxy_info = WINHTTP_PROXY_INFO()
+
+        # Call WinHttpGetProxyForUrl
+        result = self.dll.WinHttpGetProxyForUrl(
+            session,
+            wintypes.LPCWSTR(destination_url),
+            ctypes.byref(auto_proxy_options),
+            ctypes.byref(proxy_info),
+        )
+
+        if not result:
+            raise WinHttpError("WinHttpGetProxyForUrl", ctypes.GetLastError())
+
+        # Extract the proxy string from proxy_info
+        return proxy_info.lpszProxy if proxy_info.lpszProxy else None
@@ -16,22 +16,35 @@ PIDS=()
 
 # Start each engine's start.sh script
 for engine in engines/*; do
+  # code used by multiple engines, not an engine itself
+  if [ "$engine" = "engines/shared" ]; then
+    continue
+  fi
+
   if [ -d "$engine" ] && [ -f "$engine/start.sh" ]; then
-    echo "Starting $engine/start.sh..."
+    # number of instances of this engine, e.g. APP_ENGINE_INSTANCES_WINHTTP=4
+    # uses the same variables as the core server, so it knows about all instances
+    name=$(basename "$engine")
+    instances_var="APP_ENGINE_INSTANCES_${name^^}"
+    instances=${!instances_var:-${APP_ENGINE_INSTANCES:-1}}
+
+    for ((instance = 0; instance < instances; instance++)); do
+      echo "Starting $engine/start.sh (instance $instance)..."
 
-    # Run the start.sh script in the engine folder inside a subshell
-    env -C "$engine" bash "./start.sh" &
-    PIDS+=($!) # Add process ID to the list
+      # Run the start.sh script in the engine folder inside a subshell
+      env -C "$engine" INSTANCE=$instance bash "./start.sh" &
+      PIDS+=($!) # Add process ID to the list
+    done
 
   else
     echo "Warning: $engine is not a valid engine folder or missing start.sh"
   fi
 done
 
-# Start the core python server.py script
+# Start the core server with multiple worker processes, see gunicorn.conf.py
 # And add the process ID to the list
-echo "Starting core python server.py..."
-. venv/bin/activate && cd app && python3 server.py &
+echo "Starting core server..."
+. venv/bin/activate && cd app && gunicorn -c gunicorn.conf.py server:app &
 PIDS+=($!)
 
 # Trap script termination to clean up all running processes
@@ -5,7 +5,9 @@ import pandas as pd
 import requests
 import json
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from fnmatch import fnmatch
+from requests.adapters import HTTPAdapter
 
 
 # Define directories
@@ -13,7 +15,9 @@ tests_dir = "tests/"
 pacs_dir = "pacs/"
 log_file = "test_log.txt"
 api_server = "127.0.0.1:8080"
-api_url = f"http://{api_server}/api/v1/eval"
+api_url = f"http://{api_server}/api/v1"
+# number of evaluations sent to the server at the same time
+workers = int(os.environ.get("TEST_WORKERS", 8))
 
 # Setup logging
 logging.basicConfig(
@@ -28,6 +32,10 @@ logging.basicConfig(
 # Initialize failure count
 failed_tests = 0
 
+# a single session shared by all workers, which keeps a connection per worker alive
+session = requests.Session()
+session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=workers))
+
 
 required_columns = {"id", "description", "file", "dest_host", "src_ip", "expected_output", "required_flags"}
 def validate_csv_columns(df):
@@ -86,6 +94,82 @@ def find_matching_files(pattern):
     return [f for f in available_files if fnmatch(f, pattern)]
 
 
+# pac file -> uid of the uploaded PAC
+pac_uids = {}
+def upload_pac(file_path: str) -> str:
+    """
+    Read a PAC file and upload it to the server, so it can be evaluated by its uid.
+
+    :param file_path: Path of the PAC file, relative to the pacs directory.
+    :return: The uid of the uploaded PAC.
+    """
+    with open(os.path.join(pacs_dir, file_path), "r") as file:
+        file_content = file.read()
+    response = session.post(f"{api_url}/pac", json={"content": file_content})
+    response.raise_for_status()
+    return response.json()["pac"]["uid"]
+
+
+def evaluate(test: dict, file_path: str) -> tuple[list[tuple[int, str]], int]:
+    """
+    Evaluate a single test case against a single PAC file, which was uploaded before.
+
+    :param test: The test case, a row of a test csv file.
+    :param file_path: Path of the PAC file, relative to the pacs directory.
+    :return: The log records (level, message) of the evaluation, and the number of failed checks.
+             The records are logged by the caller, so the log keeps the order of the tests.
+    """
+    records = [(logging.INFO, f"=== pac file {file_path}")]
+    failed = 0
+
+    # Prepare JSON payload
+    payload = {
+        "dest_host": test["dest_host"],
+        "src_ip": test["src_ip"],
+    }
+
+    # API call
+    response = session.post(f"{api_url}/eval/{pac_uids[file_path]}", json=payload)
+    if response.status_code == 422 and "path" in response.json().get("detail", {}):
+        # the PAC was evicted from the store of the server meanwhile (more PAC files than the store holds)
+        # so send the content along, which adds the PAC and evaluates it within a single request
+        with open(os.path.join(pacs_dir, file_path), "r") as file:
+            payload["content"] = file.read()
+        response = session.post(f"{api_url}/eval", json=payload)
+    response_json = response.json()
+
+    if response.status_code != 200 or response_json.get("status") != "success":
+        records.append((logging.ERROR, f"    ❌FAIL: Request for file '{file_path}' failed. Response: {json.dumps(response_json)}"))
+        return records, failed + 1
+
+    results = response_json.get("results", [])
+    for result in results:
+        if test['required_flags'] != "" and test['required_flags'] not in result.get('flags', []):
+            records.append((logging.INFO, f"    ❔SKIPPED (engine '{result['engine']}'): Missing flags"))
+            # skip engine if it does not support the feature we need
+            continue
+
+        if result.get("status") != "success":
+            records.append((logging.ERROR, f"    ❌FAIL (engine '{result['engine']}'): Engine reported problems. error {result['error_code']}: {result['error']}.\n{result['message']}\nFull Response: {json.dumps(result)}"))
+            failed += 1
+            continue
+
+        if 'evaluation' in result.get('flags', []):
+            # if evaluation is supported we check roxy resulting from the evaluation
+            if test['expected_output'] != result['proxy']:
+                records.append((logging.ERROR, f"    ❌FAIL (engine '{result['engine']}'): Invalid Proxy. Expected: {test['expected_output']}, Actual: {result['proxy']}"))
+                failed += 1
+                continue
+
+        # no check failed, so we pass
+        records.append((logging.INFO, f"    ✅PASS (engine '{result['engine']}'): Test succeeded."))
+
+    return records, failed
+
+
+# Collect all test cases, and the PAC files each of them runs against
+# every entry is either a line to log, or a single evaluation
+plan = []
 for csv_file in csv_files:
     detected_delimiter = detect_csv_delimiter(csv_file)
     df = pd.read_csv(csv_file, delimiter=detected_delimiter)
@@ -94,60 +178,46 @@ for csv_file in csv_files:
     df["source_file"] = os.path.relpath(os.path.abspath(csv_file), os.path.abspath(tests_dir))
     df["required_flags"] = df["required_flags"].fillna("")
     test_cases = df.to_dict("records")
-    logging.info(f"= csv file '{csv_file}'")
+    plan.append(f"= csv file '{csv_file}'")
 
-    # Execute tests
     for test in test_cases:
-        logging.info(f"== test-case {int(test['id']):03d}/{len(test_cases):03d}: '{test['description']}'")
-        try:
-            file_pattern = test["file"]
-            matching_files = find_matching_files(file_pattern)
-
-            for file_path in matching_files:
-                logging.info(f"=== pac file {file_path}")
-                with open(os.path.join(pacs_dir, file_path), "r") as file:
-                    file_content = file.read()
-
-                # Prepare JSON payload
-                payload = {
-                    "dest_host": test["dest_host"],
-                    "src_ip": test["src_ip"],
-                    "content": file_content,
-                }
-
-                # API call
-                response = requests.post(api_url, json=payload)
-                response_json = response.json()
-
-                if response.status_code != 200 or response_json.get("status") != "success":
-                    logging.error(f"    ❌FAIL: Request for file '{file_path}' failed. Response: {json.dumps(response_json)}")
-                    failed_tests += 1
-                else:
-                    results = response_json.get("results", [])
-                    for result in results:
-                        if test['required_flags'] != "" and test['required_flags'] not in result.get('flags', []):
-                            logging.info(f"    ❔SKIPPED (engine '{result['engine']}'): Missing flags")
-                            # skip engine if it does not support the feature we need
-                            continue
-
-                        if result.get("status") != "success":
-                            logging.error(f"    ❌FAIL (engine '{result['engine']}'): Engine reported problems. error {result['error_code']}: {result['error']}.\n{result['message']}\nFull Response: {json.dumps(result)}")
-                            failed_tests += 1
-                            continue
-
-                        if 'evaluation' in result.get('flags', []):
-                            # if evaluation is supported we check roxy resulting from the evaluation
-                            if test['expected_output'] != result['proxy']:
-                                logging.error(f"    ❌FAIL (engine '{result['engine']}'): Invalid Proxy. Expected: {test['expected_output']}, Actual: {result['proxy']}")
-                                failed_tests += 1
-                                continue
-
-                        # no check failed, so we pass
-                        logging.info(f"    ✅PASS (engine '{result['engine']}'): Test succeeded.")
+        plan.append(f"== test-case {int(test['id']):03d}/{len(test_cases):03d}: '{test['description']}'")
+        for file_path in find_matching_files(test["file"]):
+            pac_uids[file_path] = None
+            plan.append((test, file_path))
+
 
+with ThreadPoolExecutor(max_workers=workers) as executor:
+    # Upload every PAC file only once
+    upload_futures = {file_path: executor.submit(upload_pac, file_path) for file_path in pac_uids}
+    for file_path, future in upload_futures.items():
+        try:
+            pac_uids[file_path] = future.result()
         except Exception as e:
-            logging.error(f"   ERROR: Exception during tests. Error: {str(e)}")
+            logging.error(f"   ERROR: Failed to upload pac file '{file_path}'. Error: {str(e)}")
+
+    # Execute tests
+    # all evaluations run in parallel, but their results are logged in the order of the tests
+    futures = [
+        executor.submit(evaluate, *entry) if isinstance(entry, tuple) and pac_uids[entry[1]] is not None else None
+        for entry in plan
+    ]
+    for entry, future in zip(plan, futures):
+        if isinstance(entry, str):
+            logging.info(entry)
+        elif future is None:
+            logging.info(f"=== pac file {entry[1]}")
+            logging.error(f"    ❌FAIL: File '{entry[1]}' could not be uploaded")
             failed_tests += 1
+        else:
+            try:
+                records, failed = future.result()
+                for level, message in records:
+                    logging.log(level, message)
+                failed_tests += failed
+            except Exception as e:
+                logging.error(f"   ERROR: Exception during tests. Error: {str(e)}")
+                failed_tests += 1
 
 
 # Exit with failure count as the status code